@@ -2,19 +2,34 @@
 HBM Port Access is meant to allow the HBM to be written over AXI Lite
 following cues from the LiteDRAM code
 """
+from functools import reduce
+from operator import xor
+
 # pylint: disable = unused-wildcard-import
 from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
 
 # pylint: disable = unused-wildcard-import
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.interconnect.axi import AXIInterface
+from litex.soc.interconnect import stream
+from litex.soc.interconnect import wishbone
+from litex.soc.integration.soc import SoCRegion
 
 
 ONE_BIT_WIDE = 1
 TWO_BITS_WIDE = 2
 
 class HBMCSRSCommon(Module, AutoCSR):
-    def __init__(self):
+    # clock_domain is the domain of the traffic engines. The CSRs stay in sys: start, delay_force
+    # and latch are synchronized to the engines and window_done back to sys. The other control
+    # registers are quasi-static (written while the ports are stopped) and the engines read them
+    # directly, as the stats bank reads the latched statistics, so the two domains only need a
+    # false path.
+    # sample_ports/sample_depth size the bandwidth sampler ring buffer (see do_finalize).
+    def __init__(self, clock_domain="sys", sample_ports=32, sample_depth=512):
+        self.clock_domain = clock_domain
 
         # Signal to set number of ports to use
         self.ports_mask = CSRStorage(32, description="Number of ports to use.")
@@ -24,405 +39,1689 @@ class HBMCSRSCommon(Module, AutoCSR):
 
         # Pattern 
         self.data_pattern = CSRStorage(32, description="Data pattern to write")
+        self.data_mode = CSRStorage(
+            3, description="Write data: 0=Counter, 1=PRBS7, 2=PRBS15, 3=PRBS31, 4=Walking ones, "
+            "5=Walking zeros, 6=Address, 7=PRBS31 with random strobes",
+        )
 
         self.delay_force = CSRStorage(
             1, description="Force running ports to delay to take statistics after a pause.",
         )
 
+        # Statistics snapshot: writing latch copies the 64-bit counters of every port (and the
+        # global window cycle counter) to their snapshot registers in the same cycle.
+        self.latch = CSRStorage(
+            1, description="Write to snapshot the statistics of all the ports.",
+        )
+        self.snapshot_cycles = CSRStatus(
+            64, description="Cycles of measurement window elapsed (latched)",
+        )
+
+        # Measurement window: after start is set, the ports run warmup_cycles before their
+        # counters are enabled for measure_cycles. The counters are then latched and window_done
+        # is raised, so results do not depend on how fast the host polls. A measure_cycles of 0
+        # disables the window and the counters run for as long as start is set.
+        self.warmup_cycles = CSRStorage(
+            64, description="Cycles to run before the measurement window opens.",
+        )
+        self.measure_cycles = CSRStorage(
+            64, description="Length of the measurement window in cycles (0 = until start is cleared).",
+        )
+        self.window_done = CSRStatus(
+            1, description="High once the measurement window has elapsed.",
+        )
+        self.submodules.ev = EventManager()
+        self.ev.window_done = EventSourcePulse(description="Measurement window elapsed.")
+        self.ev.finalize()
+
+        # Bandwidth sampler: every sample_period cycles while start is set, the read/write beats
+        # of every port since the previous sample are written as one entry of a BRAM ring
+        # buffer, read back through sample_bus (one 32-bit word per port, writes in the upper
+        # 16 bits, then the telemetry words, see add_sample_word). The host drains it using
+        # sample_count and reports its progress through sample_drained so that overruns are
+        # flagged. When clock_domain is not sys, every sample is counted in sys through a
+        # PulseSynchronizer, which merges samples closer than about two sys clock periods: the
+        # period must then be at least max(4, 2*ceil(clock_domain/sys frequency ratio)).
+        self.sample_period = CSRStorage(
+            16, description="Cycles between samples (0 = sampler off, at least 4 and two sys clock periods when clock domains differ).",
+        )
+        self.sample_count = CSRStatus(
+            32, description="Samples written since start (entry sample_count % depth is the next one).",
+        )
+        self.sample_drained = CSRStorage(
+            32, description="Samples read back by the host.",
+        )
+        self.sample_overflow = CSRStatus(
+            1, description="Set when unread samples were overwritten.",
+        )
+        assert sample_depth == 2**log2_int(sample_depth, False)
+        self.sample_ports = 2**log2_int(sample_ports, False)
+        self.sample_depth = sample_depth
+        self.sample_bus = wishbone.Interface(data_width=32)
+        self._sample_sources = {}
+        self._sample_words = []
+
+        self.run = Signal()        # start, in clock_domain.
+        self.force_delay = Signal()    # delay_force, in clock_domain.
+        self.snapshot = Signal()
+        self.window = Signal()
+        self.cycles = Signal(64)
+        start_d = Signal()
+        latch = Signal()
+        window_end = Signal()
+        window_done = Signal()
+        window_count = Signal(64)
+        sync = getattr(self.sync, clock_domain)
+
+        # Clock domain crossing.
+        if clock_domain == "sys":
+            self.comb += [
+                self.run.eq(self.start.storage),
+                self.force_delay.eq(self.delay_force.storage),
+                latch.eq(self.latch.re),
+                self.window_done.status.eq(window_done),
+            ]
+        else:
+            self.submodules.latch_ps = latch_ps = PulseSynchronizer("sys", clock_domain)
+            self.specials += [
+                MultiReg(self.start.storage, self.run, clock_domain),
+                MultiReg(self.delay_force.storage, self.force_delay, clock_domain),
+                MultiReg(window_done, self.window_done.status, "sys"),
+            ]
+            self.comb += [
+                latch_ps.i.eq(self.latch.re),
+                latch.eq(latch_ps.o),
+            ]
+        window_done_d = Signal()
+        self.sync += window_done_d.eq(self.window_done.status)
+        self.comb += self.ev.window_done.trigger.eq(self.window_done.status & ~window_done_d)
+
+        self.comb += self.snapshot.eq(latch | window_end)
+        sync += [
+            start_d.eq(self.run),
+            If(self.run & ~start_d,
+                self.cycles.eq(0),
+            ).Elif(self.window,
+                self.cycles.eq(self.cycles + 1),
+            ),
+            If(self.snapshot,
+                self.snapshot_cycles.status.eq(self.cycles),
+            ),
+        ]
+
+        self.stats = [
+            ("snapshot_cycles", self.snapshot_cycles.status),
+            ("window_done", self.window_done.status),
+        ]
+
+        window_fsm = FSM(reset_state="IDLE")
+        self.submodules.window_fsm = ClockDomainsRenamer(clock_domain)(window_fsm)
+        window_fsm.act("IDLE",
+            If(self.run & ~start_d,
+                NextValue(window_done, 0),
+                NextValue(window_count, 0),
+                If(self.measure_cycles.storage == 0,
+                    NextState("FREE_RUN"),
+                ).Elif(self.warmup_cycles.storage == 0,
+                    NextState("MEASURE"),
+                ).Else(
+                    NextState("WARMUP"),
+                )
+            )
+        )
+        window_fsm.act("FREE_RUN",
+            self.window.eq(self.run),
+            If(~self.run,
+                NextState("IDLE"),
+            )
+        )
+        window_fsm.act("WARMUP",
+            NextValue(window_count, window_count + 1),
+            If(~self.run,
+                NextState("IDLE"),
+            ).Elif((window_count + 1) >= self.warmup_cycles.storage,
+                NextValue(window_count, 0),
+                NextState("MEASURE"),
+            )
+        )
+        window_fsm.act("MEASURE",
+            self.window.eq(1),
+            NextValue(window_count, window_count + 1),
+            If(~self.run,
+                NextState("IDLE"),
+            ).Elif((window_count + 1) >= self.measure_cycles.storage,
+                NextState("DONE"),
+            )
+        )
+        window_fsm.act("DONE",
+            window_end.eq(1),
+            NextValue(window_done, 1),
+            NextState("IDLE"),
+        )
+
+    def add_sample_port(self, port_id, read_beat, write_beat):
+        """Record the read/write beat strobes (clock_domain) of a port in the sampler."""
+        assert port_id < self.sample_ports
+        self._sample_sources[port_id] = (read_beat, write_beat)
+
+    def add_sample_word(self, name, value):
+        """Record a telemetry value (up to 32 bits, any clock domain) along with the beats.
+
+        The value is written in every sampler entry, in the word following the port words and
+        the previous telemetry words, and latched by snapshot as the "telemetry_<name>" stat.
+        Telemetry (temperatures, voltages, alarms) changes slowly, so it is only resynchronized
+        to clock_domain: a sample taken while a multi-bit value changes may mix two readings.
+        Returns the index of the word in the sampler entries.
+        """
+        assert len(value) <= 32
+        sync = getattr(self.sync, self.clock_domain)
+        synced = Signal(32)
+        latched = Signal(len(value))
+        self.specials += MultiReg(value, synced, self.clock_domain)
+        sync += If(self.snapshot,
+            latched.eq(synced),
+        )
+        self.stats.append((f"telemetry_{name}", latched))
+        self._sample_words.append(synced)
+        return self.sample_ports + len(self._sample_words) - 1
+
+    @property
+    def sample_words(self):
+        """32-bit words stored per sampler entry: the port words then the telemetry words."""
+        return self.sample_ports + len(self._sample_words)
+
+    @property
+    def sample_slots(self):
+        """32-bit words per sampler entry in sample_bus, rounded up to a power of two (the
+        words above sample_words read as 0 and take no BRAM)."""
+        return 2**log2_int(self.sample_words, False)
+
+    @property
+    def sample_size(self):
+        return self.sample_slots*self.sample_depth*4
+
+    def do_finalize(self):
+        clock_domain = self.clock_domain
+        sync = getattr(self.sync, clock_domain)
+        index_width = log2_int(self.sample_depth, False)
+        slot_width = log2_int(self.sample_slots)
+
+        # Sample tick, in clock_domain.
+        run_d = Signal()
+        period_count = Signal(16)
+        tick = Signal()
+        restart = Signal()
+        self.comb += [
+            restart.eq(self.run & ~run_d),
+            tick.eq(self.run & ~restart & (self.sample_period.storage != 0) &
+                ((period_count + 1) >= self.sample_period.storage)),
+        ]
+        sync += [
+            run_d.eq(self.run),
+            If(restart | tick,
+                period_count.eq(0),
+            ).Elif(self.run,
+                period_count.eq(period_count + 1),
+            ),
+        ]
+
+        # Beats of every port since the last sample: the beat of the tick cycle goes to the
+        # next sample.
+        words = [Constant(0, 32)]*self.sample_words
+        for i, value in enumerate(self._sample_words):
+            words[self.sample_ports + i] = value
+        for port_id, beats in sorted(self._sample_sources.items()):
+            counts = []
+            for beat in beats:
+                count = Signal(16)
+                sync += If(restart | tick,
+                    count.eq(beat & ~restart),
+                ).Else(
+                    count.eq(count + beat),
+                )
+                counts.append(count)
+            words[port_id] = Cat(*counts)
+
+        # Ring buffer, written in clock_domain and read from sys.
+        self.specials.sample_mem = mem = Memory(32*self.sample_words, self.sample_depth)
+        wr_port = mem.get_port(write_capable=True, clock_domain=clock_domain)
+        rd_port = mem.get_port(clock_domain="sys")
+        self.specials += wr_port, rd_port
+        wr_index = Signal(max=max(self.sample_depth, 2))
+        self.comb += [
+            wr_port.adr.eq(wr_index),
+            wr_port.dat_w.eq(Cat(*words)),
+            wr_port.we.eq(tick),
+        ]
+        sync += If(restart,
+            wr_index.eq(0),
+        ).Elif(tick,
+            wr_index.eq(Mux(wr_index == (self.sample_depth - 1), 0, wr_index + 1)),
+        )
+
+        # Sample count/overflow, in sys.
+        written = Signal()
+        if clock_domain == "sys":
+            self.comb += written.eq(tick)
+        else:
+            self.submodules.sample_ps = sample_ps = PulseSynchronizer(clock_domain, "sys")
+            self.comb += [
+                sample_ps.i.eq(tick),
+                written.eq(sample_ps.o),
+            ]
+        start_d = Signal()
+        self.sync += [
+            start_d.eq(self.start.storage),
+            If(self.start.storage & ~start_d,
+                self.sample_count.status.eq(0),
+                self.sample_overflow.status.eq(0),
+            ).Else(
+                If(written,
+                    self.sample_count.status.eq(self.sample_count.status + 1),
+                ),
+                If((self.sample_count.status - self.sample_drained.storage) > self.sample_depth,
+                    self.sample_overflow.status.eq(1),
+                ),
+            ),
+        ]
+
+        # Read back: entry, then port word, registered (ack three cycles after the request).
+        bus = self.sample_bus
+        rd_word = Signal(max(slot_width, 1))
+        self.comb += rd_port.adr.eq(bus.adr[slot_width:slot_width + index_width])
+        cases = {i: bus.dat_r.eq(rd_port.dat_r[32*i:32*(i+1)]) for i in range(self.sample_words)}
+        cases["default"] = bus.dat_r.eq(0)
+        self.sync += [
+            rd_word.eq(bus.adr[:slot_width]),
+            Case(rd_word, cases),
+        ]
+        pipe = Signal(2)
+        self.sync += [
+            pipe.eq(Cat(bus.cyc & bus.stb & ~bus.ack & (pipe == 0), pipe[0])),
+            bus.ack.eq(pipe[1]),
+        ]
+
+
+# Order of the FSM status bits packed in the "state" stats word (not one-hot: exec_done and
+# beat_fsm are set along with the FSM state bits).
+HBM_PORT_STATE_BITS = (
+    "exec_done",
+    "waitinstruction_fsm",
+    "prepwritecommand_fsm",
+    "beat_fsm",
+    "prepwriteresponse_fsm",
+    "prepreadcommand_fsm",
+    "prepread_fsm",
+    "delay_state_fsm",
+)
 
 # For settings:
 OPTION_WRITE = 1
 OPTION_READ = 0
+OPTION_MIXED = 2
+OPTION_TRACE = 3
 
-class HBMReadAndWriteSM(Module, AutoCSR):
+
+# Trace record fields, LSB first (see HBMTraceReplay).
+TRACE_RECORD_LAYOUT = [
+    ("address", 32),    # Burst address, in address_readwrite units.
+    ("len", 8),         # Number of beats - 1 (truncated to the AXI len width).
+    ("gap", 16),        # Idle cycles between this burst and the next one.
+    ("write", 1),       # 0=read, 1=write.
+]
+
+# Ports per HBMPortGroup (one CSR page of about 40 words per port).
+HBM_PORT_GROUP = 8
+
+# For HBMDMABridge mode:
+DMA_MODE_FIFO = 0
+DMA_MODE_SPLIT = 1
+
+# For data_mode (see HBMDataPattern):
+DATA_COUNTER = 0
+DATA_PRBS7 = 1
+DATA_PRBS15 = 2
+DATA_PRBS31 = 3
+DATA_WALKING_ONES = 4
+DATA_WALKING_ZEROS = 5
+DATA_ADDRESS = 6
+DATA_RANDOM_STROBE = 7
+
+# PRBS polynomials x^n + x^m + 1, as {n: m}.
+PRBS_POLYNOMIALS = {7: 6, 15: 14, 31: 28}
+
+# For address_mode:
+ADDRESS_FIXED = 0
+ADDRESS_LINEAR = 1
+ADDRESS_STRIDE = 2
+ADDRESS_BANK_OFFSET = 3
+ADDRESS_RANDOM = 4
+
+# For burst_type (AXI encoding):
+BURST_FIXED = 0b00
+BURST_INCR = 0b01
+BURST_WRAP = 0b10
+
+class HBMAddressGenerator(Module, AutoCSR):
     """
-    A state machine to access the hbm in a read or write command.
+    Per-port burst address sequencer.
+
+    Produces the address of the next burst from the base address (address_readwrite << 5)
+    and the selected mode, and advances on every issued burst. The offset added to the
+    base is masked by window_mask, so sequences wrap inside the window and clearing low
+    bits of the mask aligns the generated bursts.
     """
 
-    # Here, axi_port is an AXIInterface object.
-    def __init__(self, axi_port: AXIInterface, csrs_common: HBMCSRSCommon, port_id: int):
+    def __init__(self, base, step, address_width=33, window=2**28):
+        self.next = Signal()       # Advance to the next burst address.
+        self.restart = Signal()    # Reload the sequence (start of a run).
+        self.address = Signal(address_width)
 
-        self.data_sig_r = Signal(256)
-        self.data_sig_w = Signal(256)
-        self.strb_sig = Signal(32)
-        self.beat_counter = Signal(12)
-        self.burst_counter = Signal(32)
-        self.port_num_array = Signal(32)
-        self.port_id_const = Signal(32)
-        self.delay_ctr = Signal(32)
+        self.address_mode = CSRStorage(
+            3, description="Address sequence: 0=Fixed, 1=Linear, 2=Stride, 3=Bank offset, 4=LFSR random",
+        )
+        self.address_stride = CSRStorage(
+            32, description="Bytes added to the address after every burst in Stride mode",
+        )
+        self.bank_offset = CSRStorage(
+            32, description="Bytes between two consecutive banks in Bank offset mode",
+        )
+        self.bank_count = CSRStorage(
+            8, reset=1, description="Number of banks visited before moving to the next burst in Bank offset mode",
+        )
+        self.window_mask = CSRStorage(
+            32, reset=window - 1, description="Mask applied to the offset from the base address",
+        )
+        self.random_seed = CSRStorage(
+            32, reset=0x12345678, description="LFSR seed for Random mode (must be non-zero)",
+        )
 
-        self.port_settings = CSRStorage(TWO_BITS_WIDE, description="Read/Write(LSB=0,1)")
-        self.total_reads = CSRStatus(32, description="Count of total reads")
-        self.total_writes = CSRStatus(32, description="Count of total writes")
-        self.ticks = CSRStatus(
-            32, description="Number of ticks taken for burst transaction",
+        offset = Signal(32)
+        bank_idx = Signal(8)
+        bank_base = Signal(32)
+        group_base = Signal(32)
+        lfsr = Signal(32)
+        lfsr_next = Signal(32)
+
+        # Galois LFSR, x^32 + x^22 + x^2 + x + 1.
+        self.comb += If(lfsr[0],
+            lfsr_next.eq((lfsr >> 1) ^ 0x80200003),
+        ).Else(
+            lfsr_next.eq(lfsr >> 1),
         )
-        self.address_readwrite = CSRStorage(
-            28, description="Address to perform read or write at"
+
+        self.sync += [
+            If(self.restart,
+                offset.eq(0),
+                bank_idx.eq(0),
+                bank_base.eq(0),
+                group_base.eq(0),
+                lfsr.eq(self.random_seed.storage),
+            ).Elif(self.next,
+                Case(self.address_mode.storage, {
+                    ADDRESS_LINEAR: offset.eq(offset + step),
+                    ADDRESS_STRIDE: offset.eq(offset + self.address_stride.storage),
+                    ADDRESS_BANK_OFFSET: [
+                        If((bank_idx + 1) >= self.bank_count.storage,
+                            bank_idx.eq(0),
+                            bank_base.eq(0),
+                            group_base.eq(group_base + step),
+                            offset.eq(group_base + step),
+                        ).Else(
+                            bank_idx.eq(bank_idx + 1),
+                            bank_base.eq(bank_base + self.bank_offset.storage),
+                            offset.eq(group_base + bank_base + self.bank_offset.storage),
+                        )
+                    ],
+                    ADDRESS_RANDOM: [
+                        lfsr.eq(lfsr_next),
+                        offset.eq(lfsr_next),
+                    ],
+                    "default": offset.eq(0),
+                })
+            )
+        ]
+        self.comb += self.address.eq(base + (offset & self.window_mask.storage))
+
+
+class HBMDataPattern(Module):
+    """
+    Combinatorial data pattern shared by the write engine and the read checker.
+
+    The data of a beat only depends on the seed, the mode, the position of the beat (burst
+    address and beat) and, for the PRBS modes, on the data of the previous beat of the burst
+    (`previous`), so the expected read data can be recomputed whatever the read order:
+    - DATA_COUNTER: lane 0 carries seed + beat and the other 32-bit lanes carry the seed.
+    - DATA_PRBS7/15/31: every 32-bit lane runs its own PRBS, advanced by 32 bits per beat. The
+      first beat of a burst starts from a state hashed from the seed, the burst address and the
+      lane (per-lane seeds), the next ones continue from the last n bits of the previous beat.
+    - DATA_WALKING_ONES/ZEROS: a single bit set (cleared), moving by one bit every beat.
+    - DATA_ADDRESS: every lane carries its own byte address.
+    - DATA_RANDOM_STROBE: PRBS31 data, the strobes being randomized by the write engine.
+    Without a mode signal, only DATA_COUNTER is generated.
+    """
+
+    def __init__(self, data_width, seed, address, beat, mode=None, previous=None):
+        self.data = Signal(data_width)
+
+        # # #
+
+        lanes = data_width // 32
+        beat_bytes = data_width // 8
+        counter = Signal(data_width)
+        self.comb += counter[:32].eq(seed + beat)
+        for i in range(1, lanes):
+            self.comb += counter[32*i:32*(i+1)].eq(seed)
+        if mode is None:
+            self.comb += self.data.eq(counter)
+            return
+        assert previous is not None
+
+        beat_address = Signal(len(address))
+        index = Signal(len(address))
+        self.comb += [
+            beat_address.eq(address + (beat << log2_int(beat_bytes))),
+            index.eq(beat_address >> log2_int(beat_bytes)),
+        ]
+
+        # Burst start state: multiplicative hash of the seed and the burst index, xored with a
+        # constant per lane. The PRBS logic is only evaluated in the branch of its mode.
+        hashed = Signal(32)
+        patterns = {DATA_COUNTER: self.data.eq(counter)}
+        for data_mode, n in [(DATA_PRBS7, 7), (DATA_PRBS15, 15), (DATA_PRBS31, 31)]:
+            taps = self.prbs_lane(n)
+            statements = [hashed.eq((seed ^ index[:32])*0x9e3779b1)]
+            for i in range(lanes):
+                start = Signal(n)
+                state = Signal(n)
+                statements += [
+                    start.eq((hashed ^ (0x9e3779b1*(i + 1) & 0xffffffff))[32 - n:]),
+                    If(beat == 0,
+                        state.eq(start | (start == 0)), # All zeros is a lock-up state.
+                    ).Else(
+                        state.eq(previous[32*(i+1) - n:32*(i+1)]),
+                    ),
+                    self.data[32*i:32*(i+1)].eq(Cat(*[reduce(xor, [state[b] for b in sorted(bit)]) for bit in taps])),
+                ]
+            patterns[data_mode] = statements
+        patterns[DATA_RANDOM_STROBE] = patterns[DATA_PRBS31]
+        walking = Signal(data_width)
+        self.comb += walking.eq(Constant(1, data_width) << index[:log2_int(data_width)])
+        patterns[DATA_WALKING_ONES] = self.data.eq(walking)
+        patterns[DATA_WALKING_ZEROS] = self.data.eq(~walking)
+        patterns[DATA_ADDRESS] = self.data.eq(Cat(*[(beat_address + 4*i)[:32] for i in range(lanes)]))
+        self.comb += Case(mode, patterns)
+
+    @staticmethod
+    def prbs_lane(n):
+        """State bits xored into each of the 32 bits that follow an n-bit PRBS state."""
+        m = PRBS_POLYNOMIALS[n]
+        bits = [frozenset([i]) for i in range(n)]
+        while len(bits) < n + 32:
+            bits.append(bits[-n] ^ bits[-m])
+        return bits[n:]
+
+
+class HBMReadChecker(Module, AutoCSR):
+    """
+    Pipelined read data checker.
+
+    Compares every accepted R beat against the HBMDataPattern expected at its address without
+    back-pressuring the port. The burst address, beat position and expected data of the
+    previous beat (PRBS state) are tracked per AXI ID since responses to different IDs may be
+    returned out of order.
+    """
+
+    # The PRBS states are internal, not a CSR memory.
+    autocsr_exclude = {"previous"}
+
+    def __init__(self, axi_port, seed, ids, mode=None):
+        self.restart = Signal()    # Clear the counters (start of a run).
+        self.issue = Signal()      # AR handshake for burst issue_id at issue_address.
+        self.issue_id = Signal(len(axi_port.ar.id))
+        self.issue_address = Signal(len(axi_port.ar.addr))
+
+        lanes = axi_port.data_width // 32
+        beat_bytes = axi_port.data_width // 8
+
+        self.allow = Signal(reset=1)   # The port configuration produces checkable data.
+
+        self.check_enable = CSRStorage(
+            1, description="Compare read data against the write pattern",
         )
-        self.data_readout1 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.errors = Signal(32)                                 # Read beats with a mismatch.
+        self.first_error_address = Signal(len(axi_port.ar.addr)) # Address of the first mismatching beat.
+        self.error_bitmap = Signal(lanes)                        # Lanes that mismatched at least once.
+
+        # # #
+
+        addresses = Array(Signal(len(axi_port.ar.addr)) for _ in range(ids))
+        beats = Array(Signal(len(axi_port.ar.len)) for _ in range(ids))
+
+        r_beat = Signal()
+        self.comb += r_beat.eq(axi_port.r.valid & axi_port.r.ready)
+        self.sync += [
+            If(self.issue,
+                addresses[self.issue_id].eq(self.issue_address),
+            ),
+            If(r_beat,
+                If(axi_port.r.last,
+                    beats[axi_port.r.id].eq(0),
+                ).Else(
+                    beats[axi_port.r.id].eq(beats[axi_port.r.id] + 1),
+                )
+            )
+        ]
+
+        # Stage 1: capture the beat and its position in the burst.
+        s1_beat_valid = Signal()
+        s1_valid = Signal()
+        s1_id = Signal(max=max(ids, 2))
+        s1_data = Signal(axi_port.data_width)
+        s1_address = Signal(len(axi_port.ar.addr))
+        s1_beat = Signal(len(axi_port.ar.len))
+        self.sync += [
+            s1_beat_valid.eq(r_beat),
+            s1_valid.eq(r_beat & self.check_enable.storage & self.allow),
+            s1_id.eq(axi_port.r.id),
+            s1_data.eq(axi_port.r.data),
+            s1_address.eq(addresses[axi_port.r.id]),
+            s1_beat.eq(beats[axi_port.r.id]),
+        ]
+
+        # Stage 2: expected pattern of the beat, its data being kept per ID as the PRBS state of
+        # the next beat of the burst.
+        self.specials.previous = previous = Memory(axi_port.data_width, max(ids, 2))
+        previous_port = previous.get_port(write_capable=True, async_read=True)
+        self.specials += previous_port
+        self.submodules.pattern = pattern = HBMDataPattern(axi_port.data_width,
+            seed     = seed,
+            address  = s1_address,
+            beat     = s1_beat,
+            mode     = mode,
+            previous = previous_port.dat_r,
         )
-        self.data_readout2 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.comb += [
+            previous_port.adr.eq(s1_id),
+            previous_port.dat_w.eq(pattern.data),
+            previous_port.we.eq(s1_beat_valid),
+        ]
+        s2_valid = Signal()
+        s2_data = Signal(axi_port.data_width)
+        s2_expected = Signal(axi_port.data_width)
+        s2_address = Signal(len(axi_port.ar.addr))
+        self.sync += [
+            s2_valid.eq(s1_valid),
+            s2_data.eq(s1_data),
+            s2_expected.eq(pattern.data),
+            s2_address.eq(s1_address + s1_beat*beat_bytes),
+        ]
+
+        # Stage 3: compare, lane by lane.
+        s3_valid = Signal()
+        s3_mismatch = Signal(lanes)
+        s3_address = Signal(len(axi_port.ar.addr))
+        self.sync += [
+            s3_valid.eq(s2_valid),
+            s3_address.eq(s2_address),
+        ]
+        for i in range(lanes):
+            self.sync += s3_mismatch[i].eq(s2_data[32*i:32*(i+1)] != s2_expected[32*i:32*(i+1)])
+
+        # Stage 4: accumulate.
+        self.sync += [
+            If(self.restart,
+                self.errors.eq(0),
+                self.first_error_address.eq(0),
+                self.error_bitmap.eq(0),
+            ).Elif(s3_valid & (s3_mismatch != 0),
+                self.errors.eq(self.errors + 1),
+                If(self.errors == 0,
+                    self.first_error_address.eq(s3_address),
+                ),
+                self.error_bitmap.eq(self.error_bitmap | s3_mismatch),
+            )
+        ]
+
+
+class HBMLatencyHistogram(Module, AutoCSR):
+    """
+    Per-direction transaction latency statistics.
+
+    The address handshake of every burst is timestamped per AXI ID and matched against its
+    completion (B response or last R beat). Min/max/sum/count are kept in registers and the
+    latencies are binned in a BRAM histogram of 2**latency_shift cycles wide buckets, the
+    last bucket collecting everything above. The histogram is cleared at the start of a run
+    and read back through histogram_index/histogram_count once the port is idle.
+    """
+
+    # The histogram is read back through histogram_count, not as a CSR memory.
+    autocsr_exclude = {"mem"}
+
+    def __init__(self, id_width, ids, buckets=64):
+        self.buckets = buckets
+        self.restart = Signal()    # Clear the statistics (start of a run).
+        self.timestamp = Signal(32)
+        self.issue = Signal()
+        self.issue_id = Signal(id_width)
+        self.retire = Signal()
+        self.retire_id = Signal(id_width)
+
+        self.latency_shift = CSRStorage(
+            5, description="Histogram bucket width is 2**latency_shift cycles",
+        )
+        self.latency_min = Signal(32, reset=2**32 - 1)   # Minimum latency in cycles.
+        self.latency_max = Signal(32)                    # Maximum latency in cycles.
+        self.latency_sum = Signal(64)                    # Sum of the latencies in cycles.
+        self.latency_count = Signal(32)                  # Number of completed transactions.
+        self.histogram_index = CSRStorage(
+            bits_for(buckets - 1), description="Histogram bucket to read back",
+        )
+        self.histogram_count = Signal(32)                # Count of the selected histogram bucket.
+
+        # # #
+
+        timestamps = Array(Signal(32) for _ in range(ids))
+        self.sync += If(self.issue,
+            timestamps[self.issue_id].eq(self.timestamp),
+        )
+
+        # Stage 1: latency of the completed transaction.
+        s1_valid = Signal()
+        s1_latency = Signal(32)
+        self.sync += [
+            s1_valid.eq(self.retire & ~self.restart),
+            s1_latency.eq(self.timestamp - timestamps[self.retire_id]),
+        ]
+        self.sync += [
+            If(self.restart,
+                self.latency_min.eq(2**32 - 1),
+                self.latency_max.eq(0),
+                self.latency_sum.eq(0),
+                self.latency_count.eq(0),
+            ).Elif(s1_valid,
+                If(s1_latency < self.latency_min,
+                    self.latency_min.eq(s1_latency),
+                ),
+                If(s1_latency > self.latency_max,
+                    self.latency_max.eq(s1_latency),
+                ),
+                self.latency_sum.eq(self.latency_sum + s1_latency),
+                self.latency_count.eq(self.latency_count + 1),
+            )
+        ]
+
+        # Histogram, read-modify-write of the bucket with forwarding of the previous write.
+        bucket_bits = bits_for(buckets - 1)
+        self.specials.mem = mem = Memory(32, buckets)
+        self.specials.rport = rport = mem.get_port()
+        self.specials.wport = wport = mem.get_port(write_capable=True)
+
+        s1_bucket = Signal(bucket_bits)
+        shifted = Signal(32)
+        self.comb += [
+            shifted.eq(s1_latency >> self.latency_shift.storage),
+            If(shifted >= buckets,
+                s1_bucket.eq(buckets - 1),
+            ).Else(
+                s1_bucket.eq(shifted),
+            ),
+        ]
+
+        s2_valid = Signal()
+        s2_bucket = Signal(bucket_bits)
+        s2_count = Signal(32)
+        last_valid = Signal()
+        last_bucket = Signal(bucket_bits)
+        last_count = Signal(32)
+        csr_read = Signal()
+        clearing = Signal()
+        clear_index = Signal(bucket_bits)
+
+        self.comb += [
+            If(s1_valid,
+                rport.adr.eq(s1_bucket),
+            ).Else(
+                rport.adr.eq(self.histogram_index.storage),
+            ),
+            If(last_valid & (last_bucket == s2_bucket),
+                s2_count.eq(last_count + 1),
+            ).Else(
+                s2_count.eq(rport.dat_r + 1),
+            ),
+            If(clearing,
+                wport.adr.eq(clear_index),
+                wport.dat_w.eq(0),
+                wport.we.eq(1),
+            ).Else(
+                wport.adr.eq(s2_bucket),
+                wport.dat_w.eq(s2_count),
+                wport.we.eq(s2_valid),
+            ),
+        ]
+        self.sync += [
+            s2_valid.eq(s1_valid),
+            s2_bucket.eq(s1_bucket),
+            last_valid.eq(s2_valid),
+            last_bucket.eq(s2_bucket),
+            last_count.eq(s2_count),
+            csr_read.eq(~s1_valid),
+            If(csr_read,
+                self.histogram_count.eq(rport.dat_r),
+            ),
+            If(self.restart,
+                clearing.eq(1),
+                clear_index.eq(0),
+            ).Elif(clearing,
+                clear_index.eq(clear_index + 1),
+                If(clear_index == (buckets - 1),
+                    clearing.eq(0),
+                )
+            ),
+        ]
+
+
+class HBMTokenBucket(Module, AutoCSR):
+    """
+    Token bucket bandwidth shaper of an HBM port.
+
+    The bucket fills with rate/256 bytes every cycle, up to bucket_size bytes, and every
+    burst issued (read or write) takes its size in bytes out of it. Bursts may only be issued
+    while the bucket is not in deficit, so the long term offered load is rate/256 bytes per
+    cycle whatever the burst length, with bursts of up to bucket_size bytes above it.
+    """
+
+    def __init__(self, max_bytes_per_cycle):
+        self.issue = Signal()      # A burst is issued this cycle.
+        self.cost = Signal(32)     # Its size in bytes.
+        self.allow = Signal()      # Bursts may be issued.
+
+        self.enable = CSRStorage(
+            1, description="Shape the traffic of the port (0 = full rate)",
         )
-        self.data_readout3 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.rate = CSRStorage(
+            bits_for(256*max_bytes_per_cycle),
+            description=f"Target rate in 1/256 bytes per cycle (up to {256*max_bytes_per_cycle})",
         )
-        self.data_readout4 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.bucket_size = CSRStorage(
+            32, reset=4096, description="Burst allowance in bytes",
         )
-        self.data_readout5 = CSRStatus(
-            32, description="Data to read after performing read"
+
+        # # #
+
+        # Tokens in 1/256 bytes, negative while in deficit.
+        tokens = Signal((48, True))
+        tokens_next = Signal((48, True))
+        bucket = Signal((48, True))
+        self.comb += [
+            bucket.eq(self.bucket_size.storage << 8),
+            tokens_next.eq(tokens + self.rate.storage - Mux(self.issue, self.cost << 8, 0)),
+            self.allow.eq(~self.enable.storage | (tokens >= 0)),
+        ]
+        self.sync += If(~self.enable.storage,
+            tokens.eq(0),
+        ).Elif(tokens_next > bucket,
+            tokens.eq(bucket),
+        ).Else(
+            tokens.eq(tokens_next),
+        )
+
+
+class HBMTraceReplay(Module, AutoCSR):
+    """
+    Trace source of the HBM port in trace replay mode.
+
+    Records (see TRACE_RECORD_LAYOUT) are written into a BRAM through load_address/load_data,
+    from the hbm_csr domain of the CSRs (see HBMReadAndWriteSM), and replayed from the start of
+    the run, length records per pass and loops passes (0 = until stop), the record flagged
+    last ending the trace. The BRAM is read ahead into a small FIFO so that `source` delivers one record per cycle.
+    """
+
+    # The trace is loaded through load_data, not as a CSR memory.
+    autocsr_exclude = {"mem"}
+
+    def __init__(self, depth=1024):
+        assert depth == 2**log2_int(depth, False)
+        record_width = sum(width for _, width in TRACE_RECORD_LAYOUT)
+        index_width = log2_int(depth)
+
+        self.restart = Signal()    # Start of a run: rewind the trace.
+        self.source = stream.Endpoint(TRACE_RECORD_LAYOUT)
+        self.done = Signal()       # The last record of the trace has been delivered.
+        self.loops_done = Signal(32)    # Completed passes over the BRAM trace.
+
+        self.length = CSRStorage(
+            bits_for(depth), description=f"Number of records of the BRAM trace (1-{depth})",
         )
-        self.data_readout6 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.loops = CSRStorage(
+            32, description="Number of passes over the BRAM trace (0 = until stop)",
         )
-        self.data_readout7 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.load_address = CSRStorage(
+            index_width, description="BRAM index of the next load_data record",
         )
-        self.data_readout8 = CSRStatus(
-            32, description="Data to read after performing read"
+        self.load_data = CSRStorage(
+            record_width, description="Trace record written at load_address, which then increments",
         )
-        self.exec_read_done = CSRStatus(
-            ONE_BIT_WIDE, description="High if done performing read"
+
+        # # #
+
+        self.specials.mem = mem = Memory(record_width, depth)
+        wr_port = mem.get_port(write_capable=True, clock_domain="hbm_csr")
+        rd_port = mem.get_port()
+        self.specials += wr_port, rd_port
+
+        # Load, with the CSR strobes: the BRAM is written through its hbm_csr clock port.
+        load_index = Signal(index_width)
+        self.sync.hbm_csr += If(self.load_address.re,
+            load_index.eq(self.load_address.storage),
+        ).Elif(self.load_data.re,
+            load_index.eq(load_index + 1),
         )
-        self.exec_done = CSRStatus(
-            ONE_BIT_WIDE, description="High if done performing write"
+        self.comb += [
+            wr_port.adr.eq(load_index),
+            wr_port.dat_w.eq(self.load_data.storage),
+            wr_port.we.eq(self.load_data.re),
+        ]
+
+        # Read-ahead: a BRAM read is issued whenever the FIFO can take its result.
+        self.submodules.fifo = fifo = ResetInserter()(stream.SyncFIFO(TRACE_RECORD_LAYOUT, 4))
+        index = Signal(index_width)
+        read = Signal()
+        read_final = Signal()
+        read_done = Signal()
+        reading = Signal()
+        reading_final = Signal()
+        self.comb += [
+            fifo.reset.eq(self.restart),
+            read.eq(~read_done & ~self.restart & ((fifo.level + reading) < 3)),
+            read_final.eq(((index + 1) >= self.length.storage) & (self.loops.storage != 0) &
+                ((self.loops_done + 1) >= self.loops.storage)),
+            rd_port.adr.eq(index),
+        ]
+        self.sync += [
+            reading.eq(read),
+            reading_final.eq(read & read_final),
+            If(self.restart,
+                index.eq(0),
+                self.loops_done.eq(0),
+                read_done.eq(0),
+            ).Elif(read,
+                If((index + 1) >= self.length.storage,
+                    index.eq(0),
+                    self.loops_done.eq(self.loops_done + 1),
+                ).Else(
+                    index.eq(index + 1),
+                ),
+                If(read_final,
+                    read_done.eq(1),
+                )
+            )
+        ]
+        self.comb += [
+            fifo.sink.valid.eq(reading),
+            fifo.sink.last.eq(reading_final),
+            Cat(*[getattr(fifo.sink, name) for name, _ in TRACE_RECORD_LAYOUT]).eq(rd_port.dat_r),
+            fifo.source.connect(self.source),
+        ]
+
+        self.sync += If(self.restart,
+            self.done.eq(0),
+        ).Elif(self.source.valid & self.source.ready & self.source.last,
+            self.done.eq(1),
+        )
+
+
+class HBMReadAndWriteSM(Module, AutoCSR):
+    """
+    A state machine to access the hbm in a read or write command.
+    """
+
+    # Here, axi_port is an AXIInterface object; the engine is generated from its data_width,
+    # address_width and version, so any AXI3/AXI4 port of 32 bits or more can be driven.
+    # max_outstanding sets the number of bursts that may be in flight per direction; each burst
+    # gets its own AXI ID so the port keeps the pseudo-channel busy instead of waiting on every
+    # response.
+    # address_shift is the log2 of the unit of address_readwrite in bytes (default: one beat).
+    # trace_depth is the number of records of the trace replay BRAM (0 = no trace replay).
+    # clock_domain is the domain of axi_port (the engine must not be renamed by the caller).
+    def __init__(self, axi_port: AXIInterface, csrs_common: HBMCSRSCommon, port_id: int,
+        max_outstanding=8, histogram_buckets=64, address_shift=None, trace_depth=1024,
+        clock_domain="sys"):
+        assert max_outstanding <= 2**len(axi_port.aw.id)
+        assert max_outstanding == 2**log2_int(max_outstanding, False)
+        assert axi_port.data_width >= 32
+        assert axi_port.version in ["axi3", "axi4"]
+
+        data_width = axi_port.data_width
+        address_width = axi_port.address_width
+        beat_bytes = data_width // 8
+        len_width = len(axi_port.aw.len)
+        if address_shift is None:
+            address_shift = log2_int(beat_bytes)
+
+        self.data_sig_r = Signal(data_width)
+        self.data_sig_w = Signal(data_width)
+        self.strb_sig = Signal(beat_bytes)
+        self.beat_counter = Signal(len_width)
+        self.burst_counter = Signal(32)
+        self.port_num_array = Signal(32)
+        self.port_id_const = Signal(32)
+        self.delay_ctr = Signal(32)
+
+        self.port_settings = CSRStorage(TWO_BITS_WIDE, description="Read/Write/Mixed/Trace(0,1,2,3)")
+        self.address_readwrite = CSRStorage(
+            address_width - address_shift,
+            description=f"Address to perform read or write at, in units of {2**address_shift} bytes",
         )
         self.acknowledge_readwrite = CSRStorage(
             ONE_BIT_WIDE,
             description="Acknowledge to state machine read or write happened",
         )
         self.burst_len = CSRStorage(
-            12, 
-            description="Number of bursts (default burst size is 5, 2^5=32 bytes)"
+            bits_for(2**len_width),
+            description=f"Number of beats per burst (1-{2**len_width}, {beat_bytes} bytes per beat)"
         )
         self.last_burst_len = CSRStorage(
-            12, description="Number of beats in last burst"
+            bits_for(2**len_width), description="Number of beats in last burst"
         )
-        self.waitinstruction_fsm = CSRStatus(
-            ONE_BIT_WIDE,
-            description="FSM: Wait Stage",
+        self.burst_quantity = CSRStorage(
+            32, description="Number of bursts per command",
         )
-        self.prepwritecommand_fsm = CSRStatus(
-            ONE_BIT_WIDE, 
-            description="FSM: Stage 1 of write",
+        self.delay_ctr_max = CSRStorage(
+            32, description="Number of clock cycles to delay after writing/reading bytes",
         )
-        self.beat_fsm = CSRStatus(
-            ONE_BIT_WIDE, 
-            description="FSM: Stage 2 of write",
+        self.outstanding_max = CSRStorage(
+            bits_for(max_outstanding), reset=max_outstanding,
+            description="Maximum number of bursts in flight (0 or above build limit = build limit)",
         )
-        self.beat_fsm = CSRStatus(
-            ONE_BIT_WIDE, 
-            description="FSM: Stage 2 of write",
+        self.mix_sequence = CSRStorage(
+            32, reset=0b10,
+            description="Mixed mode burst sequence, LSB first, one bit per burst (0=read, 1=write)",
         )
-        self.prepwriteresponse_fsm = CSRStatus(
-            ONE_BIT_WIDE,
-            description="FSM: Stage 3 of write",
+        self.mix_length = CSRStorage(
+            6, reset=2, description="Number of bursts in the Mixed mode sequence (1-32)",
         )
-        self.donewrite_fsm = CSRStatus(
-            ONE_BIT_WIDE, 
-            description="FSM: Done with write",
+        self.burst_type = CSRStorage(
+            2, reset=BURST_INCR,
+            description="AXI burst type: 0=Fixed, 1=Incr, 2=Wrap (Wrap needs 2, 4, 8 or 16 beats)",
         )
-        self.prepreadcommand_fsm = CSRStatus(
-            ONE_BIT_WIDE,
-            description= "FSM: Stage 1 of read",
+        self.burst_size = CSRStorage(
+            3, reset=log2_int(beat_bytes),
+            description=f"AXI transfer size, log2 of the bytes per beat (up to {log2_int(beat_bytes)})",
         )
-        self.prepread_fsm = CSRStatus(
-            ONE_BIT_WIDE,
-            description="FSM: Stage 2 of read",
+        self.qos = CSRStorage(
+            4, description="AXI QoS of the read and write bursts",
         )
-        self.doneread_fsm = CSRStatus(
-            ONE_BIT_WIDE,
-            description="FSM: Done with read",
+
+        # Status, read back in bulk through HBMStatsBank (see stats below).
+        self.total_reads = Signal(32)           # Read beats of the current command.
+        self.total_writes = Signal(32)          # Write beats of the current command.
+        self.ticks = Signal(32)                 # Cycles taken by the current command.
+        self.exec_done = Signal()               # Idle, waiting for start.
+        self.waitinstruction_fsm = Signal()     # FSM: Wait Stage.
+        self.prepwritecommand_fsm = Signal()    # FSM: Issuing write bursts.
+        self.beat_fsm = Signal()                # W engine busy.
+        self.prepwriteresponse_fsm = Signal()   # FSM: Waiting for write responses.
+        self.prepreadcommand_fsm = Signal()     # FSM: Issuing read bursts.
+        self.prepread_fsm = Signal()            # FSM: Waiting for read data.
+        self.delay_state_fsm = Signal()         # FSM: Delay between commands.
+        self.state = Signal(len(HBM_PORT_STATE_BITS))  # The bits above, packed.
+        self.outstanding = Signal(bits_for(2*max_outstanding))
+        self.snapshot_cycles = Signal(64)       # Latched counters of the measurement window.
+        self.snapshot_read_beats = Signal(64)
+        self.snapshot_write_beats = Signal(64)
+        self.snapshot_read_bytes = Signal(64)
+        self.snapshot_write_bytes = Signal(64)
+        self.trace_cycles = Signal(64)          # Cycles taken by the trace replay, up to its last response.
+        self.trace_records = Signal(32)         # Trace records issued.
+        self.trace_done = Signal()              # Trace replay complete (until the next run).
+        
+        self.comb += self.state.eq(Cat(*[getattr(self, name) for name in HBM_PORT_STATE_BITS]))
+
+        # Set number of ports to use
+        self.comb += self.port_num_array.eq(csrs_common.ports_mask.storage)
+        self.comb += self.port_id_const.eq(0x1 << (port_id))
+
+        # Address engines / outstanding transactions -------------------------------------------
+        # Every burst is tagged with its own AXI ID so that up to max_outstanding bursts can be
+        # in flight per direction. The busy bitmaps track the IDs awaiting a B / last R response.
+        # The AW/AR engines issue as soon as an ID is free, independently of the data beats.
+        write_issue = Signal()
+        write_retire = Signal()
+        read_issue = Signal()
+        read_retire = Signal()
+        write_can_issue = Signal()
+        read_can_issue = Signal()
+
+        self.write_tag = Signal(max=max(max_outstanding, 2))
+        self.read_tag = Signal(max=max(max_outstanding, 2))
+        self.write_busy = Signal(max_outstanding)
+        self.read_busy = Signal(max_outstanding)
+        self.write_outstanding = Signal(bits_for(max_outstanding))
+        self.read_outstanding = Signal(bits_for(max_outstanding))
+        self.outstanding_cap = Signal(bits_for(max_outstanding))
+
+        # Bandwidth shaping: both directions share the token bucket of the port.
+        self.submodules.shaper = shaper = HBMTokenBucket(beat_bytes)
+        self.comb += [
+            shaper.issue.eq(write_issue | read_issue),
+            shaper.cost.eq(Mux(write_issue,
+                (axi_port.aw.len + 1) << axi_port.aw.size,
+                (axi_port.ar.len + 1) << axi_port.ar.size)),
+        ]
+
+        self.submodules.w_fifo = w_fifo = stream.SyncFIFO(
+            [("len", len_width), ("address", address_width), ("id", len(axi_port.aw.id))],
+            max(max_outstanding, 2))
+
+        self.comb += [
+            If((self.outstanding_max.storage == 0) | (self.outstanding_max.storage > max_outstanding),
+                self.outstanding_cap.eq(max_outstanding),
+            ).Else(
+                self.outstanding_cap.eq(self.outstanding_max.storage),
+            ),
+            write_issue.eq(axi_port.aw.valid & axi_port.aw.ready),
+            write_retire.eq(axi_port.b.valid & axi_port.b.ready),
+            read_issue.eq(axi_port.ar.valid & axi_port.ar.ready),
+            read_retire.eq(axi_port.r.valid & axi_port.r.ready & axi_port.r.last),
+            write_can_issue.eq(~Array(self.write_busy)[self.write_tag] &
+                (self.write_outstanding < self.outstanding_cap) & w_fifo.sink.ready & shaper.allow),
+            read_can_issue.eq(~Array(self.read_busy)[self.read_tag] &
+                (self.read_outstanding < self.outstanding_cap) & shaper.allow),
+            axi_port.b.ready.eq(1),
+            axi_port.r.ready.eq(1),
+            self.outstanding.eq(self.write_outstanding + self.read_outstanding),
+        ]
+        if max_outstanding > 1:
+            self.sync += [
+                If(write_issue,
+                    self.write_tag.eq(self.write_tag + 1),
+                ),
+                If(read_issue,
+                    self.read_tag.eq(self.read_tag + 1),
+                ),
+            ]
+        self.sync += [
+            self.write_outstanding.eq(self.write_outstanding + write_issue - write_retire),
+            self.read_outstanding.eq(self.read_outstanding + read_issue - read_retire),
+        ]
+        for i in range(max_outstanding):
+            self.sync += [
+                If(write_issue & (self.write_tag == i),
+                    self.write_busy[i].eq(1),
+                ).Elif(write_retire & (axi_port.b.id == i),
+                    self.write_busy[i].eq(0),
+                ),
+                If(read_issue & (self.read_tag == i),
+                    self.read_busy[i].eq(1),
+                ).Elif(read_retire & (axi_port.r.id == i),
+                    self.read_busy[i].eq(0),
+                ),
+            ]
+
+        # Address sequencer --------------------------------------------------------------------
+        # Transfer size, clamped to the data width.
+        burst_size = Signal(3)
+        self.comb += If(self.burst_size.storage > log2_int(beat_bytes),
+            burst_size.eq(log2_int(beat_bytes)),
+        ).Else(
+            burst_size.eq(self.burst_size.storage),
         )
-        self.burst_quantity = CSRStorage(
-            32, description="Number of bursts per command",
+
+        burst_bytes = Signal(32)
+        self.comb += burst_bytes.eq((axi_port.aw.len + 1) << burst_size)
+        self.submodules.address_gen = address_gen = HBMAddressGenerator(
+            base          = self.address_readwrite.storage << address_shift,
+            step          = burst_bytes,
+            address_width = address_width,
+            window        = min(2**address_width, 2**28),
         )
-        self.delay_ctr_max = CSRStorage(
-            32, description="Number of clock cycles to delay after writing/reading bytes",
+        self.comb += address_gen.next.eq(write_issue | read_issue)
+
+        # Mixed mode sequence ------------------------------------------------------------------
+        # In Mixed mode, bit mix_idx of mix_sequence selects the direction of the next burst,
+        # e.g. 0b1000 with a length of 4 gives 3 reads for 1 write.
+        mix_idx = Signal(5)
+        mix_write = Signal()
+        mix_restart = Signal()
+        self.comb += mix_write.eq(Array(self.mix_sequence.storage)[mix_idx])
+        self.sync += [
+            If(mix_restart,
+                mix_idx.eq(0),
+            ).Elif(write_issue | read_issue,
+                If((mix_idx + 1) >= self.mix_length.storage,
+                    mix_idx.eq(0),
+                ).Else(
+                    mix_idx.eq(mix_idx + 1),
+                )
+            )
+        ]
+
+        # Read data checker --------------------------------------------------------------------
+        self.submodules.checker = checker = HBMReadChecker(axi_port,
+            seed = csrs_common.data_pattern.storage,
+            ids  = max_outstanding,
+            mode = csrs_common.data_mode.storage,
+        )
+        self.comb += [
+            checker.issue.eq(read_issue),
+            checker.issue_id.eq(axi_port.ar.id),
+            checker.issue_address.eq(axi_port.ar.addr),
+            # Fixed bursts overwrite the same location and narrow transfers or random strobes
+            # only update some lanes, so only full width Incr/Wrap bursts read back the written
+            # pattern.
+            checker.allow.eq((self.burst_type.storage != BURST_FIXED) &
+                (burst_size == log2_int(beat_bytes)) &
+                (csrs_common.data_mode.storage != DATA_RANDOM_STROBE)),
+        ]
+        self.sync += If(axi_port.r.valid & axi_port.r.ready,
+            self.data_sig_r.eq(axi_port.r.data),
+        )
+
+        # Latency statistics -------------------------------------------------------------------
+        timestamp = Signal(32)
+        self.sync += timestamp.eq(timestamp + 1)
+        self.submodules.read_latency = read_latency = HBMLatencyHistogram(
+            id_width = len(axi_port.ar.id),
+            ids      = max_outstanding,
+            buckets  = histogram_buckets,
+        )
+        self.submodules.write_latency = write_latency = HBMLatencyHistogram(
+            id_width = len(axi_port.aw.id),
+            ids      = max_outstanding,
+            buckets  = histogram_buckets,
+        )
+        self.comb += [
+            read_latency.timestamp.eq(timestamp),
+            read_latency.issue.eq(read_issue),
+            read_latency.issue_id.eq(axi_port.ar.id),
+            read_latency.retire.eq(read_retire & csrs_common.window),
+            read_latency.retire_id.eq(axi_port.r.id),
+            write_latency.timestamp.eq(timestamp),
+            write_latency.issue.eq(write_issue),
+            write_latency.issue_id.eq(axi_port.aw.id),
+            write_latency.retire.eq(write_retire & csrs_common.window),
+            write_latency.retire_id.eq(axi_port.b.id),
+        ]
+
+        # Write data engine ---------------------------------------------------------------------
+        # The AW engine pushes the length/address of every issued burst into w_fifo; the W engine streams
+        # the beats of the queued bursts back to back, so w.valid stays asserted across bursts
+        # and a stalled address channel no longer costs data cycles.
+        self.comb += [
+            w_fifo.sink.valid.eq(write_issue),
+            w_fifo.sink.len.eq(axi_port.aw.len),
+            w_fifo.sink.address.eq(axi_port.aw.addr),
+            w_fifo.sink.id.eq(axi_port.aw.id),
+            axi_port.w.valid.eq(w_fifo.source.valid),
+            axi_port.w.last.eq(self.beat_counter == w_fifo.source.len),
+            axi_port.w.data.eq(self.data_sig_w),
+            axi_port.w.strb.eq(self.strb_sig),
+            w_fifo.source.ready.eq(axi_port.w.ready & axi_port.w.last),
+            self.beat_fsm.eq(w_fifo.source.valid),
+        ]
+        if axi_port.version == "axi3":
+            # AXI3 write data carries the ID of its burst.
+            self.comb += axi_port.w.id.eq(w_fifo.source.id)
+        self.sync += [
+            If(axi_port.w.valid & axi_port.w.ready,
+                If(axi_port.w.last,
+                    self.beat_counter.eq(0),
+                ).Else(
+                    self.beat_counter.eq(self.beat_counter + 1),
+                )
+            )
+        ]
+
+        w_previous = Signal(data_width)
+        self.submodules.w_pattern = w_pattern = HBMDataPattern(axi_port.data_width,
+            seed     = csrs_common.data_pattern.storage,
+            address  = w_fifo.source.address,
+            beat     = self.beat_counter,
+            mode     = csrs_common.data_mode.storage,
+            previous = w_previous,
         )
-        self.delay_state_fsm = CSRStatus(
-            1, description="Number of clock cycles to delay after writing/reading bytes",
+        self.comb += self.data_sig_w.eq(w_pattern.data)
+        self.sync += If(axi_port.w.valid & axi_port.w.ready,
+            w_previous.eq(self.data_sig_w),
         )
-        
-        # Set number of ports to use
-        self.comb += self.port_num_array.eq(csrs_common.ports_mask.storage)
-        self.comb += self.port_id_const.eq(0x1 << (port_id))
 
+        # Statistics ---------------------------------------------------------------------------
+        # Beats are counted outside of the FSM since responses now arrive while new bursts are
+        # being issued; the FSM only decides when the counters run and when they are cleared.
+        ticks_en = Signal()
+        stats_clear = Signal()
+        run_start = Signal()
+        self.comb += [
+            address_gen.restart.eq(run_start),
+            checker.restart.eq(run_start),
+            read_latency.restart.eq(run_start),
+            write_latency.restart.eq(run_start),
+        ]
+        self.sync += [
+            If(stats_clear,
+                self.ticks.eq(0),
+                self.total_writes.eq(0),
+                self.total_reads.eq(0),
+            ).Else(
+                If(ticks_en,
+                    self.ticks.eq(self.ticks + 1),
+                ),
+                If(axi_port.w.valid & axi_port.w.ready,
+                    self.total_writes.eq(self.total_writes + 1),
+                ),
+                If(axi_port.r.valid & axi_port.r.ready,
+                    self.total_reads.eq(self.total_reads + 1),
+                ),
+            )
+        ]
+
+        # Time-resolved beats for the sampler of the common registers.
+        read_beat = Signal()
+        write_beat = Signal()
+        self.comb += [
+            read_beat.eq(axi_port.r.valid & axi_port.r.ready),
+            write_beat.eq(axi_port.w.valid & axi_port.w.ready),
+        ]
+        csrs_common.add_sample_port(port_id, read_beat, write_beat)
+
+        # 64-bit counters over the measurement window, copied to the snapshot registers by the
+        # common latch strobe so that all the ports are sampled in the same cycle.
+        run_cycles = Signal(64)
+        run_read_beats = Signal(64)
+        run_write_beats = Signal(64)
+        run_read_bytes = Signal(64)
+        run_write_bytes = Signal(64)
+        running = Signal()
+        self.sync += [
+            If(run_start,
+                run_cycles.eq(0),
+                run_read_beats.eq(0),
+                run_write_beats.eq(0),
+                run_read_bytes.eq(0),
+                run_write_bytes.eq(0),
+            ).Elif(csrs_common.window,
+                If(running,
+                    run_cycles.eq(run_cycles + 1),
+                ),
+                If(axi_port.w.valid & axi_port.w.ready,
+                    run_write_beats.eq(run_write_beats + 1),
+                    run_write_bytes.eq(run_write_bytes + (1 << axi_port.aw.size)),
+                ),
+                If(axi_port.r.valid & axi_port.r.ready,
+                    run_read_beats.eq(run_read_beats + 1),
+                    run_read_bytes.eq(run_read_bytes + (1 << axi_port.ar.size)),
+                ),
+            ),
+            If(csrs_common.snapshot,
+                self.snapshot_cycles.eq(run_cycles),
+                self.snapshot_read_beats.eq(run_read_beats),
+                self.snapshot_write_beats.eq(run_write_beats),
+                self.snapshot_read_bytes.eq(run_read_bytes),
+                self.snapshot_write_bytes.eq(run_write_bytes),
+            )
+        ]
 
         hbm_port_fsm = FSM(reset_state="WAIT_CMD")
         self.submodules.hbm_port_fsm = hbm_port_fsm
 
-        
+        last_burst = Signal()
+        trace_restart = Signal()
+        self.comb += [
+            last_burst.eq((self.burst_counter + 1) >= self.burst_quantity.storage),
+            running.eq(~hbm_port_fsm.ongoing("WAIT_CMD") & ~self.trace_done),
+        ]
+
         hbm_port_fsm.act(
             "WAIT_CMD",
-            self.exec_done.status.eq(1),
-            self.waitinstruction_fsm.status.eq(1),
-            If((csrs_common.start.storage != 0) & (self.port_settings.storage == OPTION_READ), 
+            self.exec_done.eq(1),
+            self.waitinstruction_fsm.eq(1),
+            If((csrs_common.run != 0) & (self.port_settings.storage == OPTION_READ), 
                 If (self.port_id_const & self.port_num_array,
                     NextValue(self.burst_counter, 0),
-                    NextValue(self.ticks.status, 0),
-                    NextValue(self.total_writes.status, 0),
-                    NextValue(self.total_reads.status, 0),
+                    stats_clear.eq(1),
+                    run_start.eq(1),
                     NextState("READ_VALID"),
                 )
-            ).Elif((csrs_common.start.storage != 0) & (self.port_settings.storage == OPTION_WRITE),
+            ).Elif((csrs_common.run != 0) & (self.port_settings.storage == OPTION_WRITE),
                 If(self.port_id_const & self.port_num_array,
-                    NextValue(self.beat_counter, 0),
                     NextValue(self.burst_counter, 0),
-                    NextValue(self.ticks.status, 0),
-                    NextValue(self.total_writes.status, 0),
-                    NextValue(self.total_reads.status, 0),
+                    stats_clear.eq(1),
+                    run_start.eq(1),
                     NextState("WRITE_VALID"),
                 )
-            ).Else(
-                NextValue(self.ticks.status, self.ticks.status),
-                NextState("WAIT_CMD"),
+            ).Elif((csrs_common.run != 0) & (self.port_settings.storage == OPTION_MIXED),
+                If(self.port_id_const & self.port_num_array,
+                    NextValue(self.burst_counter, 0),
+                    stats_clear.eq(1),
+                    run_start.eq(1),
+                    mix_restart.eq(1),
+                    NextState("MIXED_VALID"),
+                )
+            ).Elif((csrs_common.run != 0) & (self.port_settings.storage == OPTION_TRACE) & (trace_depth > 0),
+                If(self.port_id_const & self.port_num_array,
+                    NextValue(self.burst_counter, 0),
+                    stats_clear.eq(1),
+                    run_start.eq(1),
+                    trace_restart.eq(1),
+                    NextState("TRACE_VALID"),
+                )
             ),
         )
         hbm_port_fsm.act(
             "WRITE_VALID",
-            self.prepwritecommand_fsm.status.eq(1),
-            axi_port.aw.addr.eq(self.address_readwrite.storage << 5),
-            axi_port.aw.valid.eq(1),
-            axi_port.w.data.eq(self.data_sig_w),
-            axi_port.w.strb.eq(self.strb_sig),
-            axi_port.w.valid.eq(1),
-            NextValue(self.ticks.status, self.ticks.status + 1),
-            If(((axi_port.aw.ready & axi_port.w.ready) & (axi_port.aw.len > 0)),
-                NextValue(self.beat_counter, self.beat_counter + 1),
-                NextValue(self.total_writes.status, self.total_writes.status + 1),
-                NextState("WRITE_BEAT"))
-            .Elif((axi_port.aw.ready & axi_port.w.ready), 
-                axi_port.w.last.eq(1),
-                NextValue(self.total_writes.status, self.total_writes.status + 1),
+            self.prepwritecommand_fsm.eq(1),
+            ticks_en.eq(1),
+            axi_port.aw.addr.eq(address_gen.address),
+            axi_port.aw.valid.eq(write_can_issue),
+            If(write_issue,
                 NextValue(self.burst_counter, self.burst_counter + 1),
-                NextState("WRITE_LAST"),)
-            .Else(
-                NextState("WRITE_VALID"),
+                If(last_burst,
+                    NextState("WRITE_LAST"),
+                )
             ),
         )
-        hbm_port_fsm.act(
-            "WRITE_BEAT",
-            self.beat_fsm.status.eq(1),
-            axi_port.aw.addr.eq(self.address_readwrite.storage << 5),
-            axi_port.w.data.eq(self.data_sig_w),
-            axi_port.w.strb.eq(self.strb_sig),
-            axi_port.w.valid.eq(1),
-            NextValue(self.ticks.status, self.ticks.status + 1),
-            If((axi_port.w.ready & (self.beat_counter < axi_port.aw.len)),
-                NextValue(self.total_writes.status, self.total_writes.status + 1),
-                NextValue(self.beat_counter, self.beat_counter + 1),
-                NextState("WRITE_BEAT")
-            ).Elif((axi_port.w.ready & (self.beat_counter == axi_port.aw.len)),
-                axi_port.w.last.eq(1),
-                NextValue(self.total_writes.status, self.total_writes.status + 1),
-                NextValue(self.beat_counter, 0),
-                NextValue(self.burst_counter, self.burst_counter + 1),
-                NextState("WRITE_LAST"),
-            ).Else(
-                NextValue(self.total_writes.status, self.total_writes.status),
-                NextState("WRITE_BEAT")
-            )
-        )
         hbm_port_fsm.act(
             "WRITE_LAST",
-            self.prepwriteresponse_fsm.status.eq(1),
-            axi_port.aw.addr.eq(self.address_readwrite.storage << 5),
-            axi_port.w.data.eq(self.data_sig_w),
-            axi_port.w.strb.eq(self.strb_sig),
-            axi_port.w.valid.eq(0),
-            axi_port.b.ready.eq(1),
-            NextValue(self.ticks.status, self.ticks.status + 1),
-            If(axi_port.b.valid & (self.burst_counter >= self.burst_quantity.storage), 
-                If(csrs_common.start.storage == 0,
-                    NextValue(self.total_writes.status, self.total_writes.status),
+            self.prepwriteresponse_fsm.eq(1),
+            ticks_en.eq(1),
+            # Wait for the responses of all the bursts still in flight.
+            If((self.write_outstanding - write_retire) == 0,
+                If(csrs_common.run == 0,
                     NextState("WAIT_CMD"),
-                ).Elif((self.delay_ctr_max.storage > 0) | csrs_common.delay_force.storage,
-                    NextValue(self.total_writes.status, self.total_writes.status),
-                    NextValue(self.beat_counter, 0),
+                ).Elif((self.delay_ctr_max.storage > 0) | csrs_common.force_delay,
                     NextValue(self.burst_counter, 0),
                     NextValue(self.delay_ctr, 0),
                     NextState("WRITE_PAUSE"),
                 ).Else(
-                    NextValue(self.beat_counter, 0),
                     NextValue(self.burst_counter, 0),
-                    NextValue(self.ticks.status, 0),
-                    NextValue(self.total_writes.status, 0),
+                    stats_clear.eq(1),
                     NextState("WRITE_VALID"),
                 )
-            ).Elif(axi_port.b.valid,
-                NextValue(self.total_writes.status, self.total_writes.status),
-                NextValue(self.beat_counter, 0),
-                NextState("WRITE_VALID"),
-            ).Else(
-                NextValue(self.total_writes.status, self.total_writes.status),
-                NextState("WRITE_LAST"),
             ),
         )
         hbm_port_fsm.act(
             "WRITE_PAUSE",
-            self.delay_state_fsm.status.eq(1),
-            NextValue(self.ticks.status, self.ticks.status),
-            NextValue(self.total_writes.status, self.total_writes.status),
-            If((self.delay_ctr_max.storage > 0) & ~csrs_common.delay_force.storage,
+            self.delay_state_fsm.eq(1),
+            If((self.delay_ctr_max.storage > 0) & ~csrs_common.force_delay,
                 NextValue(self.delay_ctr, self.delay_ctr + 1),
-            ).Else(
-                NextValue(self.delay_ctr, self.delay_ctr),
             ),
-            If(csrs_common.start.storage == 0,
+            If(csrs_common.run == 0,
                 NextState("WAIT_CMD"),   
-            ).Elif(csrs_common.delay_force.storage, 
+            ).Elif(csrs_common.force_delay, 
                 NextState("WRITE_PAUSE"),
-            ).Elif((self.delay_ctr_max == 0) & ~csrs_common.delay_force.storage,
+            ).Elif((self.delay_ctr_max.storage == 0) & ~csrs_common.force_delay,
                 NextState("WRITE_VALID"),
             ).Elif(((self.delay_ctr + 1) >= self.delay_ctr_max.storage),
-                NextValue(self.ticks.status, 0),
-                NextValue(self.total_writes.status, 0),
+                stats_clear.eq(1),
                 NextState("WRITE_VALID"),
             )
         )
 
         hbm_port_fsm.act(
             "READ_VALID",
-            self.prepreadcommand_fsm.status.eq(1),
-            axi_port.ar.valid.eq(1),
-            axi_port.ar.addr.eq(self.address_readwrite.storage << 5),
-            NextValue(self.ticks.status, self.ticks.status + 1),
-            If(axi_port.ar.ready, 
-                NextState("READ_BEAT"),
-                NextValue(self.total_reads.status, self.total_reads.status),
-            ).Else(
-                NextValue(self.total_reads.status, self.total_reads.status),
-                NextState("READ_VALID"),
+            self.prepreadcommand_fsm.eq(1),
+            ticks_en.eq(1),
+            axi_port.ar.valid.eq(read_can_issue),
+            axi_port.ar.addr.eq(address_gen.address),
+            If(read_issue,
+                NextValue(self.burst_counter, self.burst_counter + 1),
+                If(last_burst,
+                    NextState("READ_BEAT"),
+                )
             ),
         )
         hbm_port_fsm.act(
             "READ_BEAT",
-            self.prepread_fsm.status.eq(1),
-            axi_port.ar.addr.eq(self.address_readwrite.storage << 5),
-            axi_port.r.ready.eq(1),
-            NextValue(self.ticks.status, self.ticks.status + 1),
-            If((axi_port.r.valid & axi_port.r.last),
-                NextValue(self.burst_counter, self.burst_counter + 1),
-                If(((self.burst_counter + 1) >= self.burst_quantity.storage),
-                    If(csrs_common.start.storage == 0,
-                        NextValue(self.total_reads.status, self.total_reads.status + 1),
-                        NextState("WAIT_CMD"),
-                    ).Elif((self.delay_ctr_max.storage > 0) | csrs_common.delay_force.storage,
-                        NextValue(self.total_reads.status, self.total_reads.status + 1),
-                        NextValue(self.beat_counter, 0),
-                        NextValue(self.burst_counter, 0),
-                        NextValue(self.delay_ctr, 0),
-                        NextState("READ_PAUSE"),
-                    ).Else(
-                        NextValue(self.beat_counter, 0),
-                        NextValue(self.burst_counter, 0),
-                        NextValue(self.ticks.status, 0),
-                        NextValue(self.total_reads.status, 0),
-                        NextState("READ_VALID"),
-                    )
+            self.prepread_fsm.eq(1),
+            ticks_en.eq(1),
+            # Wait for the last beat of all the bursts still in flight.
+            If((self.read_outstanding - read_retire) == 0,
+                If(csrs_common.run == 0,
+                    NextState("WAIT_CMD"),
+                ).Elif((self.delay_ctr_max.storage > 0) | csrs_common.force_delay,
+                    NextValue(self.burst_counter, 0),
+                    NextValue(self.delay_ctr, 0),
+                    NextState("READ_PAUSE"),
                 ).Else(
-                    NextValue(self.total_reads.status, self.total_reads.status + 1),
-                    NextValue(self.beat_counter, 0),
+                    NextValue(self.burst_counter, 0),
+                    stats_clear.eq(1),
                     NextState("READ_VALID"),
                 )
-            ).Elif((axi_port.r.valid), 
-                NextValue(self.total_reads.status, self.total_reads.status + 1),
-                NextState("READ_BEAT"),
-            ).Else(
-                NextValue(self.total_reads.status, self.total_reads.status),
-                NextState("READ_BEAT"),
-            )
+            ),
         )
         hbm_port_fsm.act(
             "READ_PAUSE",
-            self.delay_state_fsm.status.eq(1),
-            NextValue(self.ticks.status, self.ticks.status),
-            NextValue(self.total_reads.status, self.total_reads.status),
-            If((self.delay_ctr_max.storage > 0) & ~csrs_common.delay_force.storage,
+            self.delay_state_fsm.eq(1),
+            If((self.delay_ctr_max.storage > 0) & ~csrs_common.force_delay,
                 NextValue(self.delay_ctr, self.delay_ctr + 1),
-            ).Else(
-                NextValue(self.delay_ctr, self.delay_ctr),
             ),
-            If(csrs_common.start.storage == 0,
+            If(csrs_common.run == 0,
                 NextState("WAIT_CMD"),   
-            ).Elif(csrs_common.delay_force.storage, 
+            ).Elif(csrs_common.force_delay, 
                 NextState("READ_PAUSE"),
-            ).Elif((self.delay_ctr_max == 0) & ~csrs_common.delay_force.storage,
+            ).Elif((self.delay_ctr_max.storage == 0) & ~csrs_common.force_delay,
                 NextState("READ_VALID"),
             ).Elif(((self.delay_ctr + 1) >= self.delay_ctr_max.storage),
-                NextValue(self.ticks.status, 0),
-                NextValue(self.total_reads.status, 0),
+                stats_clear.eq(1),
                 NextState("READ_VALID"),
             )
         )
 
-        self.comb += [
-            self.data_readout1.status.eq(self.data_sig_r[:32]),
-            self.data_readout2.status.eq(self.data_sig_r[32:64]),
-            self.data_readout3.status.eq(self.data_sig_r[64:96]),
-            self.data_readout4.status.eq(self.data_sig_r[96:128]),
-            self.data_readout5.status.eq(self.data_sig_r[128:160]),
-            self.data_readout6.status.eq(self.data_sig_r[160:192]),
-            self.data_readout7.status.eq(self.data_sig_r[192:224]),
-            self.data_readout8.status.eq(self.data_sig_r[224:256]),
-
-            self.data_sig_w[:32].eq(csrs_common.data_pattern.storage + self.beat_counter),
-            self.data_sig_w[32:64].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[64:96].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[96:128].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[128:160].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[160:192].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[192:224].eq(csrs_common.data_pattern.storage),
-            self.data_sig_w[224:256].eq(csrs_common.data_pattern.storage),
+        hbm_port_fsm.act(
+            "MIXED_VALID",
+            self.prepwritecommand_fsm.eq(1),
+            self.prepreadcommand_fsm.eq(1),
+            ticks_en.eq(1),
+            axi_port.aw.addr.eq(address_gen.address),
+            axi_port.aw.valid.eq(mix_write & write_can_issue),
+            axi_port.ar.addr.eq(address_gen.address),
+            axi_port.ar.valid.eq(~mix_write & read_can_issue),
+            If(write_issue | read_issue,
+                NextValue(self.burst_counter, self.burst_counter + 1),
+                If(last_burst,
+                    NextState("MIXED_LAST"),
+                )
+            ),
+        )
+        hbm_port_fsm.act(
+            "MIXED_LAST",
+            self.prepwriteresponse_fsm.eq(1),
+            self.prepread_fsm.eq(1),
+            ticks_en.eq(1),
+            # Wait for both directions to drain.
+            If(((self.write_outstanding - write_retire) == 0) & ((self.read_outstanding - read_retire) == 0),
+                If(csrs_common.run == 0,
+                    NextState("WAIT_CMD"),
+                ).Elif((self.delay_ctr_max.storage > 0) | csrs_common.force_delay,
+                    NextValue(self.burst_counter, 0),
+                    NextValue(self.delay_ctr, 0),
+                    NextState("MIXED_PAUSE"),
+                ).Else(
+                    NextValue(self.burst_counter, 0),
+                    stats_clear.eq(1),
+                    NextState("MIXED_VALID"),
+                )
+            ),
+        )
+        hbm_port_fsm.act(
+            "MIXED_PAUSE",
+            self.delay_state_fsm.eq(1),
+            If((self.delay_ctr_max.storage > 0) & ~csrs_common.force_delay,
+                NextValue(self.delay_ctr, self.delay_ctr + 1),
+            ),
+            If(csrs_common.run == 0,
+                NextState("WAIT_CMD"),
+            ).Elif(csrs_common.force_delay,
+                NextState("MIXED_PAUSE"),
+            ).Elif((self.delay_ctr_max.storage == 0) & ~csrs_common.force_delay,
+                NextState("MIXED_VALID"),
+            ).Elif(((self.delay_ctr + 1) >= self.delay_ctr_max.storage),
+                stats_clear.eq(1),
+                NextState("MIXED_VALID"),
+            )
+        )
 
-            self.strb_sig.eq(0xffffffff)
-        ]
+        # Trace replay --------------------------------------------------------------------------
+        # One burst per record, as soon as an ID is free, then the record's gap in idle cycles.
+        # trace_cycles runs from the start until the last response of the trace. A request
+        # offered on AW/AR is held until its handshake (trace_pending) before the trace can end.
+        trace_active = Signal()
+        trace_len = Signal(len_width)
+        if trace_depth > 0:
+            self.submodules.trace = trace = HBMTraceReplay(trace_depth)
+            gap_ctr = Signal(16)
+            trace_address = Signal(address_width)
+            trace_write = Signal()
+            trace_read = Signal()
+            trace_pending = Signal()
+            self.comb += [
+                trace.restart.eq(trace_restart),
+                trace_write.eq(trace.source.valid & trace.source.write &
+                    (write_can_issue | trace_pending)),
+                trace_read.eq(trace.source.valid & ~trace.source.write &
+                    (read_can_issue | trace_pending)),
+                trace_address.eq(trace.source.address << address_shift),
+                trace_active.eq(hbm_port_fsm.ongoing("TRACE_VALID")),
+                trace_len.eq(trace.source.len),
+            ]
+            self.sync += trace_pending.eq(hbm_port_fsm.ongoing("TRACE_VALID") &
+                (trace_write | trace_read) & ~(write_issue | read_issue))
+            self.sync += If(run_start,
+                self.trace_done.eq(0),
+            ).Elif(hbm_port_fsm.ongoing("TRACE_DONE"),
+                self.trace_done.eq(1),
+            )
+            self.sync += If(trace_restart,
+                self.trace_cycles.eq(0),
+                self.trace_records.eq(0),
+            ).Elif(hbm_port_fsm.ongoing("TRACE_VALID") | hbm_port_fsm.ongoing("TRACE_GAP") |
+                hbm_port_fsm.ongoing("TRACE_LAST"),
+                self.trace_cycles.eq(self.trace_cycles + 1),
+                If(write_issue | read_issue,
+                    self.trace_records.eq(self.trace_records + 1),
+                )
+            )
 
+            hbm_port_fsm.act(
+                "TRACE_VALID",
+                self.prepwritecommand_fsm.eq(1),
+                self.prepreadcommand_fsm.eq(1),
+                ticks_en.eq(1),
+                axi_port.aw.addr.eq(trace_address),
+                axi_port.aw.valid.eq(trace_write),
+                axi_port.ar.addr.eq(trace_address),
+                axi_port.ar.valid.eq(trace_read),
+                trace.source.ready.eq(write_issue | read_issue),
+                If(write_issue | read_issue,
+                    NextValue(self.burst_counter, self.burst_counter + 1),
+                    If(trace.source.gap != 0,
+                        NextValue(gap_ctr, trace.source.gap),
+                        NextState("TRACE_GAP"),
+                    )
+                ).Elif(~trace_write & ~trace_read & (trace.done | (csrs_common.run == 0)),
+                    NextState("TRACE_LAST"),
+                )
+            )
+            hbm_port_fsm.act(
+                "TRACE_GAP",
+                self.delay_state_fsm.eq(1),
+                ticks_en.eq(1),
+                NextValue(gap_ctr, gap_ctr - 1),
+                If(csrs_common.run == 0,
+                    NextState("TRACE_LAST"),
+                ).Elif(gap_ctr <= 1,
+                    NextState("TRACE_VALID"),
+                )
+            )
+            hbm_port_fsm.act(
+                "TRACE_LAST",
+                self.prepwriteresponse_fsm.eq(1),
+                self.prepread_fsm.eq(1),
+                ticks_en.eq(1),
+                # Wait for both directions to drain.
+                If(((self.write_outstanding - write_retire) == 0) & ((self.read_outstanding - read_retire) == 0),
+                    If(csrs_common.run == 0,
+                        NextState("WAIT_CMD"),
+                    ).Else(
+                        NextState("TRACE_DONE"),
+                    )
+                ),
+            )
+            hbm_port_fsm.act(
+                "TRACE_DONE",
+                If(csrs_common.run == 0,
+                    NextState("WAIT_CMD"),
+                )
+            )
 
+        # Random strobes (DATA_RANDOM_STROBE): a Galois LFSR (x^32 + x^22 + x^2 + x + 1)
+        # advanced on every W beat masks the byte lanes. It is reloaded from the seed at the
+        # start of every run (bit 0 forced so that it never locks up) so runs are reproducible.
+        strb_lfsr = Signal(32, reset=1)
+        strb_mask = Signal(beat_bytes)
+        self.sync += If(run_start,
+            strb_lfsr.eq(csrs_common.data_pattern.storage | 1),
+        ).Elif(axi_port.w.valid & axi_port.w.ready,
+            strb_lfsr.eq(Mux(strb_lfsr[0], (strb_lfsr >> 1) ^ 0x80200003, strb_lfsr >> 1)),
+        )
+        self.comb += If(csrs_common.data_mode.storage == DATA_RANDOM_STROBE,
+            strb_mask.eq(Cat(*[strb_lfsr]*((beat_bytes + 31)//32))),
+        ).Else(
+            strb_mask.eq(2**beat_bytes - 1),
+        )
 
+        # Write strobes: only the byte lanes of the current transfer are enabled, following
+        # the beat address of the Fixed/Incr/Wrap burst.
+        lane_bits = log2_int(beat_bytes)
+        w_offset = Signal(address_width)
+        w_wrap_mask = Signal(address_width)
+        w_address = Signal(address_width)
+        w_lane = Signal(max(lane_bits, 1))
+        size_mask = Signal(beat_bytes)
+        self.comb += [
+            w_offset.eq(self.beat_counter << burst_size),
+            w_wrap_mask.eq(((w_fifo.source.len + 1) << burst_size) - 1),
+            Case(self.burst_type.storage, {
+                BURST_FIXED: w_address.eq(w_fifo.source.address),
+                BURST_WRAP: w_address.eq((w_fifo.source.address & ~w_wrap_mask) |
+                    ((w_fifo.source.address + w_offset) & w_wrap_mask)),
+                "default": w_address.eq(w_fifo.source.address + w_offset),
+            }),
+            Case(burst_size, {i: size_mask.eq(2**(2**i) - 1) for i in range(lane_bits + 1)}),
+            w_lane.eq((w_address[:lane_bits] >> burst_size) << burst_size),
+            self.strb_sig.eq((size_mask << w_lane) & strb_mask),
+        ]
 
         ##############################################################
-        # Defaults for AXI3
+        # AXI defaults
         ##############################################################
 
-        burst_type="INCR"
-
-        burst_type = {
-            "FIXED": 0b00,
-            "INCR":  0b01,
-            "WRAP":  0b10,
-        }[burst_type]
-
-        burst_size = log2_int(axi_port.data_width // 8)
-
         prot = 0
 
-        write_id = 0
-        read_id = 0
-
         self.comb += [
-            axi_port.aw.burst.eq(burst_type), 
+            axi_port.aw.burst.eq(self.burst_type.storage),
             axi_port.aw.size.eq(burst_size), # Number of bytes (-1) of each data transfer (up to 1024-bit).
             axi_port.aw.lock.eq(0),  # Normal access
             axi_port.aw.prot.eq(prot),
             axi_port.aw.cache.eq(0b0011),  # Normal Non-cacheable Bufferable
-            axi_port.aw.qos.eq(0),
-            axi_port.aw.id.eq(write_id),
+            axi_port.aw.qos.eq(self.qos.storage),
+            axi_port.aw.id.eq(self.write_tag),
 
-            axi_port.ar.burst.eq(burst_type),
+            axi_port.ar.burst.eq(self.burst_type.storage),
             axi_port.ar.size.eq(burst_size),
             axi_port.ar.lock.eq(0),
             axi_port.ar.prot.eq(prot),
             axi_port.ar.cache.eq(0b0011),
-            axi_port.ar.qos.eq(0),
-            axi_port.ar.id.eq(read_id),
+            axi_port.ar.qos.eq(self.qos.storage),
+            axi_port.ar.id.eq(self.read_tag),
 
+            # Trace records carry their own length.
+            If(trace_active,
+                axi_port.aw.len.eq(trace_len),
+                axi_port.ar.len.eq(trace_len),
             # Select last 
-            If((self.burst_counter >= self.burst_quantity.storage - 1) & (self.last_burst_len.storage > 0),
+            ).Elif((self.burst_counter >= self.burst_quantity.storage - 1) & (self.last_burst_len.storage > 0),
                 axi_port.aw.len.eq(self.last_burst_len.storage - 1), # Subtract one as last_burst specifies actual number of bursts 
                 axi_port.ar.len.eq(self.last_burst_len.storage - 1), # and len takes 0xf as 16 or 0x0 as 1 beat per transaction.
             ).Else(
@@ -431,7 +1730,598 @@ class HBMReadAndWriteSM(Module, AutoCSR):
             ),
         ]
 
-    
+        ##############################################################
+        # Statistics exported through HBMStatsBank
+        ##############################################################
+
+        self.stats = [
+            ("state", self.state),
+            ("outstanding", self.outstanding),
+            ("ticks", self.ticks),
+            ("total_reads", self.total_reads),
+            ("total_writes", self.total_writes),
+            ("snapshot_cycles", self.snapshot_cycles),
+            ("snapshot_read_beats", self.snapshot_read_beats),
+            ("snapshot_write_beats", self.snapshot_write_beats),
+            ("snapshot_read_bytes", self.snapshot_read_bytes),
+            ("snapshot_write_bytes", self.snapshot_write_bytes),
+            ("errors", checker.errors),
+            ("first_error_address", checker.first_error_address),
+            ("error_bitmap", checker.error_bitmap),
+        ]
+        for name, latency in [("read", read_latency), ("write", write_latency)]:
+            self.stats += [
+                (f"{name}_latency_min", latency.latency_min),
+                (f"{name}_latency_max", latency.latency_max),
+                (f"{name}_latency_sum", latency.latency_sum),
+                (f"{name}_latency_count", latency.latency_count),
+                (f"{name}_histogram_count", latency.histogram_count),
+            ]
+        if trace_depth > 0:
+            self.stats += [
+                ("trace_cycles", self.trace_cycles),
+                ("trace_records", self.trace_records),
+                ("trace_loops_done", trace.loops_done),
+                ("trace_done", self.trace_done),
+            ]
+        self.stats += [("data_readout", self.data_sig_r)]
+
+        # Clock domains ------------------------------------------------------------------------
+        # The engine only reads quasi-static CSR storage from clock_domain. The logic fed by the
+        # one-cycle CSR strobes (CSR.re) is described in the hbm_csr domain and stays in sys,
+        # with the CSRs, once sys has been renamed to clock_domain.
+        ClockDomainsRenamer(clock_domain)(self)
+        ClockDomainsRenamer({"hbm_csr": "sys"})(self)
+
+
+class HBMPortGroup(Module, AutoCSR):
+    """
+    CSR container of up to HBM_PORT_GROUP benchmark ports.
+
+    Every top-level AutoCSR module takes one CSR page: grouping the ports keeps 32 of them
+    within the default CSR address space. The CSRs of port i are named
+    hbm_ports<i // HBM_PORT_GROUP>_hbm_<i>_<name>.
+    """
+
+    def add_port(self, port_id, port):
+        setattr(self.submodules, f"hbm_{port_id}", port)
+
+
+class HBMStatsBank(Module):
+    """
+    Read-only memory-mapped view of the statistics of the HBM ports.
+
+    Every block (the common registers, then one per port) gets a power of two number of
+    32-bit words holding its stats back to back, 64-bit values little word first. The whole
+    set can then be fetched with one burst read over Etherbone/PCIe instead of hundreds of
+    individual CSR accesses. The read path is a two-level registered mux, so a read is
+    acknowledged three cycles after it is issued.
+    """
+
+    def __init__(self, blocks, data_width=32):
+        self.bus = wishbone.Interface(data_width=data_width)
+
+        # # #
+
+        block_words = []
+        block_layouts = []
+        for block_name, stats in blocks:
+            words = []
+            layout = []
+            for name, value in stats:
+                nwords = (len(value) + data_width - 1)//data_width
+                layout.append((block_name, name, len(words), nwords))
+                for i in range(nwords):
+                    words.append(value[data_width*i:data_width*(i+1)])
+            block_words.append(words)
+            block_layouts.append(layout)
+        self.words_per_block = 2**log2_int(max(len(words) for words in block_words), False)
+        self.size = self.words_per_block*len(blocks)*data_width//8
+
+        # (block, name, byte offset, words) of every stat.
+        self.layout = []
+        for n, layout in enumerate(block_layouts):
+            for block_name, name, offset, nwords in layout:
+                byte_offset = (n*self.words_per_block + offset)*data_width//8
+                self.layout.append((block_name, name, byte_offset, nwords))
+
+        word_bits = log2_int(self.words_per_block)
+        adr_word = Signal(word_bits)
+        adr_block = Signal(max=max(len(blocks), 2))
+        adr_block_d = Signal(max=max(len(blocks), 2))
+        self.comb += [
+            adr_word.eq(self.bus.adr[:word_bits]),
+            adr_block.eq(self.bus.adr[word_bits:]),
+        ]
+
+        # Stage 1: word within every block. Stage 2: block.
+        block_data = []
+        for words in block_words:
+            data = Signal(data_width)
+            cases = {i: data.eq(word) for i, word in enumerate(words)}
+            cases["default"] = data.eq(0)
+            self.sync += Case(adr_word, cases)
+            block_data.append(data)
+        self.sync += [
+            adr_block_d.eq(adr_block),
+            self.bus.dat_r.eq(Array(block_data)[adr_block_d]),
+        ]
+
+        pipe = Signal(2)
+        self.sync += [
+            pipe.eq(Cat(self.bus.cyc & self.bus.stb & ~self.bus.ack & (pipe == 0), pipe[0])),
+            self.bus.ack.eq(pipe[1]),
+        ]
+
+    def get_offset(self, block_name, name):
+        for block, stat, offset, nwords in self.layout:
+            if (block, stat) == (block_name, name):
+                return offset
+        raise KeyError(f"{block_name}.{name}")
+
+    def export_csv(self, filename):
+        with open(filename, "w") as f:
+            f.write("#--------------------------------------------------------------------------------\n")
+            f.write("# HBM statistics layout: block, name, byte offset in the hbm_stats region, words\n")
+            f.write("#--------------------------------------------------------------------------------\n")
+            for block, name, offset, nwords in self.layout:
+                f.write(f"{block},{name},0x{offset:08x},{nwords}\n")
+
+
+class HBMWishbone2AXI(Module):
+    """
+    Wishbone to AXI burst bridge.
+
+    Each Wishbone access is turned into a single INCR burst of
+    len(wishbone.dat_w)//axi.data_width beats, so an L2 cache line wider than the HBM port
+    is filled or written back with one burst instead of one AXI-Lite transaction per beat.
+    The Wishbone address is local to the slave (in Wishbone words) and is offset by
+    base_address (in bytes), e.g. the base of a pseudo-channel in the USPHBM2 address map.
+    """
+
+    def __init__(self, wishbone, axi, base_address=0):
+        data_width = axi.data_width
+        ratio = wishbone.data_width//data_width
+        assert ratio*data_width == wishbone.data_width
+        assert ratio <= 2**len(axi.aw.len)
+        beat_bytes = data_width//8
+
+        # # #
+
+        beat = Signal(max=max(ratio, 2))
+        address = Signal(axi.address_width)
+        self.comb += address.eq(base_address + (wishbone.adr << log2_int(wishbone.data_width//8)))
+
+        # AXI defaults: one INCR burst of full width beats per access.
+        for ax in [axi.aw, axi.ar]:
+            self.comb += [
+                ax.addr.eq(address),
+                ax.burst.eq(BURST_INCR),
+                ax.len.eq(ratio - 1),
+                ax.size.eq(log2_int(beat_bytes)),
+            ]
+        self.comb += [
+            axi.w.data.eq(Array([wishbone.dat_w[data_width*i:data_width*(i+1)] for i in range(ratio)])[beat]),
+            axi.w.strb.eq(Array([wishbone.sel[beat_bytes*i:beat_bytes*(i+1)] for i in range(ratio)])[beat]),
+            axi.w.last.eq(beat == (ratio - 1)),
+        ]
+
+        self.sync += If(axi.r.valid & axi.r.ready,
+            Case(beat, {i: wishbone.dat_r[data_width*i:data_width*(i+1)].eq(axi.r.data) for i in range(ratio)})
+        )
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            NextValue(beat, 0),
+            If(wishbone.cyc & wishbone.stb,
+                If(wishbone.we,
+                    NextState("WRITE_ADDRESS")
+                ).Else(
+                    NextState("READ_ADDRESS")
+                )
+            )
+        )
+        fsm.act("WRITE_ADDRESS",
+            axi.aw.valid.eq(1),
+            If(axi.aw.ready,
+                NextState("WRITE_DATA")
+            )
+        )
+        fsm.act("WRITE_DATA",
+            axi.w.valid.eq(1),
+            If(axi.w.ready,
+                NextValue(beat, beat + 1),
+                If(axi.w.last,
+                    NextState("WRITE_RESPONSE")
+                )
+            )
+        )
+        fsm.act("WRITE_RESPONSE",
+            axi.b.ready.eq(1),
+            If(axi.b.valid,
+                NextState("ACK")
+            )
+        )
+        fsm.act("READ_ADDRESS",
+            axi.ar.valid.eq(1),
+            If(axi.ar.ready,
+                NextState("READ_DATA")
+            )
+        )
+        fsm.act("READ_DATA",
+            axi.r.ready.eq(1),
+            If(axi.r.valid,
+                NextValue(beat, beat + 1),
+                If(axi.r.last,
+                    NextState("ACK")
+                )
+            )
+        )
+        fsm.act("ACK",
+            wishbone.ack.eq(1),
+            NextState("IDLE")
+        )
+
+
+class HBMInterleaver(Module):
+    """
+    Stripes one Wishbone master across several slaves.
+
+    Consecutive `granularity` bytes blocks go to consecutive slaves, so a linear region of
+    len(slaves) x slave size is spread over all the HBM pseudo-channels. Addresses given to
+    the slaves are local (base_address removed, channel bits dropped).
+    """
+
+    def __init__(self, master, slaves, granularity=256, base_address=0x00000000):
+        nslaves = len(slaves)
+        word_bytes = master.data_width//8
+        assert 2**log2_int(nslaves, False) == nslaves
+        assert 2**log2_int(granularity, False) == granularity and granularity >= word_bytes
+
+        # # #
+
+        offset_bits = log2_int(granularity//word_bytes)
+        channel_bits = log2_int(nslaves)
+        adr = Signal(len(master.adr))
+        channel = Signal(max=max(nslaves, 2))
+        local_adr = Signal(len(master.adr))
+        self.comb += [
+            adr.eq(master.adr - base_address//word_bytes),
+            local_adr.eq(Cat(adr[:offset_bits], adr[offset_bits + channel_bits:])),
+        ]
+        if channel_bits:
+            self.comb += channel.eq(adr[offset_bits:offset_bits + channel_bits])
+
+        for i, slave in enumerate(slaves):
+            self.comb += [
+                slave.adr.eq(local_adr),
+                slave.dat_w.eq(master.dat_w),
+                slave.sel.eq(master.sel),
+                slave.we.eq(master.we),
+                slave.cti.eq(master.cti),
+                slave.bte.eq(master.bte),
+                slave.cyc.eq(master.cyc & (channel == i)),
+                slave.stb.eq(master.stb & (channel == i)),
+            ]
+        self.comb += [
+            master.ack.eq(Array([slave.ack for slave in slaves])[channel]),
+            master.err.eq(Array([slave.err for slave in slaves])[channel]),
+            master.dat_r.eq(Array([slave.dat_r for slave in slaves])[channel]),
+        ]
+
+
+class HBMAXIClockDomainCrossing(Module):
+    """AXI Clock Domain Crossing (direct connection when both sides share the clock domain)."""
+
+    def __init__(self, master, slave, cd_from="sys", cd_to="sys"):
+        channels = [
+            (master.aw, slave.aw, cd_from, cd_to),
+            (master.w, slave.w, cd_from, cd_to),
+            (slave.b, master.b, cd_to, cd_from),
+            (master.ar, slave.ar, cd_from, cd_to),
+            (slave.r, master.r, cd_to, cd_from),
+        ]
+        for source, sink, cd_source, cd_sink in channels:
+            if cd_from == cd_to:
+                self.comb += source.connect(sink)
+            else:
+                cdc = stream.ClockDomainCrossing(source.description, cd_source, cd_sink)
+                self.submodules += cdc
+                self.comb += [
+                    source.connect(cdc.sink),
+                    cdc.source.connect(sink),
+                ]
+
+
+class HBMDMABridge(Module, AutoCSR):
+    """
+    Bridge between a LitePCIe DMA and an HBM AXI port.
+
+    `sink` (host to HBM, from the DMA reader) is written in bursts of burst_beats beats to a
+    ring of size bytes at base in the HBM and `source` (HBM to host, to the DMA writer) is read
+    from the same ring. With mode=DMA_MODE_FIFO the ring is a FIFO: only bursts acknowledged by
+    the HBM are read back and writes stall while the ring is full, so the host gets back what
+    it sent through the HBM. With mode=DMA_MODE_SPLIT both directions run independently: writes
+    wrap around the ring and reads loop over it while read_enable is set. The host side buffers
+    are scattered by the LitePCIe descriptor tables, the HBM side is always linear.
+
+    Writes are only issued once the whole burst is in the write FIFO and reads once the read
+    FIFO has room for the whole burst, so W and R never stall mid-burst.
+    """
+
+    def __init__(self, axi, data_width, base_address=0, burst_beats=16, fifo_depth=128):
+        axi_width = len(axi.w.data)
+        burst_bytes = burst_beats*axi_width//8
+        assert burst_beats <= 2**len(axi.aw.len)
+        assert fifo_depth >= 2*burst_beats
+
+        self.sink = sink = stream.Endpoint([("data", data_width)])
+        self.source = source = stream.Endpoint([("data", data_width)])
+
+        self.enable = CSRStorage(
+            1, description="Enable the bridge; a rising edge empties the ring and clears the counters",
+        )
+        self.mode = CSRStorage(
+            1, description="Ring used as a FIFO (0) or written and read independently (1)",
+        )
+        self.read_enable = CSRStorage(
+            1, description="Loop reads over the ring (DMA_MODE_SPLIT)",
+        )
+        self.base = CSRStorage(
+            len(axi.aw.addr), reset=base_address, description="Byte address of the ring in the HBM",
+        )
+        self.size = CSRStorage(
+            32, reset=0x1000_0000, description=f"Size of the ring in bytes (multiple of {burst_bytes})",
+        )
+        self.cycles = CSRStatus(64, description="Cycles since the bridge was enabled")
+        self.write_beats = CSRStatus(64, description="Beats written to the HBM")
+        self.read_beats = CSRStatus(64, description="Beats read from the HBM")
+        self.errors = CSRStatus(32, description="Write and read responses with an error")
+        self.level = CSRStatus(32, description="Bursts written and not yet read back")
+
+        # # #
+
+        start = Signal()
+        enable_d = Signal()
+        fifo_mode = Signal()
+        ring_bursts = Signal(32)
+        self.sync += enable_d.eq(self.enable.storage)
+        self.comb += [
+            start.eq(self.enable.storage & ~enable_d),
+            fifo_mode.eq(self.mode.storage == DMA_MODE_FIFO),
+            ring_bursts.eq(self.size.storage[log2_int(burst_bytes):]),
+        ]
+
+        # Burst counters.
+        aw_bursts = Signal(32)     # Write bursts issued.
+        b_bursts = Signal(32)      # Write bursts acknowledged.
+        ar_bursts = Signal(32)     # Read bursts issued.
+        r_bursts = Signal(32)      # Read bursts received.
+
+        # Write path: sink -> converter -> FIFO -> W.
+        self.submodules.write_conv = write_conv = ResetInserter()(stream.Converter(data_width, axi_width))
+        self.submodules.write_fifo = write_fifo = ResetInserter()(stream.SyncFIFO([("data", axi_width)], fifo_depth))
+        self.comb += [
+            write_conv.reset.eq(start),
+            write_fifo.reset.eq(start),
+            sink.connect(write_conv.sink, omit={"valid", "ready"}),
+            write_conv.sink.valid.eq(sink.valid & self.enable.storage),
+            sink.ready.eq(write_conv.sink.ready & self.enable.storage),
+            write_conv.source.connect(write_fifo.sink),
+        ]
+
+        # Complete bursts in the FIFO waiting for their AW, and AWs waiting for their data.
+        fill_beat = Signal(max=burst_beats)
+        burst_ready = Signal(max=fifo_depth//burst_beats + 1)
+        w_pending = Signal(max=fifo_depth//burst_beats + 1)
+        w_beat = Signal(max=burst_beats)
+        wr_offset = Signal(32)
+        filled = Signal()
+        aw_fire = Signal()
+        w_last_fire = Signal()
+        self.comb += [
+            filled.eq(write_fifo.sink.valid & write_fifo.sink.ready & (fill_beat == burst_beats - 1)),
+            axi.aw.valid.eq(self.enable.storage & (burst_ready != 0) &
+                (~fifo_mode | ((aw_bursts - r_bursts) < ring_bursts))),
+            axi.aw.addr.eq(self.base.storage + wr_offset),
+            axi.aw.burst.eq(BURST_INCR),
+            axi.aw.len.eq(burst_beats - 1),
+            axi.aw.size.eq(log2_int(axi_width//8)),
+            aw_fire.eq(axi.aw.valid & axi.aw.ready),
+            axi.w.valid.eq(write_fifo.source.valid & (w_pending != 0)),
+            axi.w.data.eq(write_fifo.source.data),
+            axi.w.strb.eq(2**(axi_width//8) - 1),
+            axi.w.last.eq(w_beat == burst_beats - 1),
+            write_fifo.source.ready.eq(axi.w.ready & (w_pending != 0)),
+            w_last_fire.eq(axi.w.valid & axi.w.ready & axi.w.last),
+            axi.b.ready.eq(1),
+        ]
+        self.sync += [
+            If(write_fifo.sink.valid & write_fifo.sink.ready,
+                fill_beat.eq(Mux(fill_beat == burst_beats - 1, 0, fill_beat + 1)),
+            ),
+            burst_ready.eq(burst_ready + filled - aw_fire),
+            w_pending.eq(w_pending + aw_fire - w_last_fire),
+            If(axi.w.valid & axi.w.ready,
+                w_beat.eq(Mux(axi.w.last, 0, w_beat + 1)),
+            ),
+            If(aw_fire,
+                aw_bursts.eq(aw_bursts + 1),
+                wr_offset.eq(Mux(wr_offset + burst_bytes >= self.size.storage, 0, wr_offset + burst_bytes)),
+            ),
+            If(axi.b.valid,
+                b_bursts.eq(b_bursts + 1),
+            ),
+            If(start,
+                fill_beat.eq(0),
+                burst_ready.eq(0),
+                w_pending.eq(0),
+                w_beat.eq(0),
+                wr_offset.eq(0),
+                aw_bursts.eq(0),
+                b_bursts.eq(0),
+            ),
+        ]
+
+        # Read path: R -> FIFO -> converter -> source.
+        self.submodules.read_fifo = read_fifo = ResetInserter()(stream.SyncFIFO([("data", axi_width)], fifo_depth))
+        self.submodules.read_conv = read_conv = ResetInserter()(stream.Converter(axi_width, data_width))
+        self.comb += [
+            read_fifo.reset.eq(start),
+            read_conv.reset.eq(start),
+            read_fifo.source.connect(read_conv.sink),
+            read_conv.source.connect(source),
+        ]
+
+        # FIFO space is reserved for the bursts in flight, so R is always accepted.
+        rd_inflight = Signal(max=fifo_depth + 1)
+        rd_offset = Signal(32)
+        ar_fire = Signal()
+        r_fire = Signal()
+        self.comb += [
+            axi.ar.valid.eq(self.enable.storage &
+                ((read_fifo.level + rd_inflight + burst_beats) <= fifo_depth) &
+                Mux(fifo_mode, b_bursts != ar_bursts, self.read_enable.storage)),
+            axi.ar.addr.eq(self.base.storage + rd_offset),
+            axi.ar.burst.eq(BURST_INCR),
+            axi.ar.len.eq(burst_beats - 1),
+            axi.ar.size.eq(log2_int(axi_width//8)),
+            ar_fire.eq(axi.ar.valid & axi.ar.ready),
+            axi.r.ready.eq(read_fifo.sink.ready),
+            read_fifo.sink.valid.eq(axi.r.valid),
+            read_fifo.sink.data.eq(axi.r.data),
+            r_fire.eq(axi.r.valid & axi.r.ready),
+        ]
+        self.sync += [
+            rd_inflight.eq(rd_inflight + Mux(ar_fire, burst_beats, 0) - r_fire),
+            If(ar_fire,
+                ar_bursts.eq(ar_bursts + 1),
+                rd_offset.eq(Mux(rd_offset + burst_bytes >= self.size.storage, 0, rd_offset + burst_bytes)),
+            ),
+            If(r_fire & axi.r.last,
+                r_bursts.eq(r_bursts + 1),
+            ),
+            If(start,
+                rd_inflight.eq(0),
+                rd_offset.eq(0),
+                ar_bursts.eq(0),
+                r_bursts.eq(0),
+            ),
+        ]
+
+        # Statistics.
+        self.comb += self.level.status.eq(b_bursts - r_bursts)
+        self.sync += [
+            If(start,
+                self.cycles.status.eq(0),
+                self.write_beats.status.eq(0),
+                self.read_beats.status.eq(0),
+                self.errors.status.eq(0),
+            ).Elif(self.enable.storage,
+                self.cycles.status.eq(self.cycles.status + 1),
+                If(axi.w.valid & axi.w.ready,
+                    self.write_beats.status.eq(self.write_beats.status + 1),
+                ),
+                If(r_fire,
+                    self.read_beats.status.eq(self.read_beats.status + 1),
+                ),
+                self.errors.status.eq(self.errors.status +
+                    (axi.b.valid & (axi.b.resp != 0)) + (r_fire & axi.r.last & (axi.r.resp != 0))),
+            ),
+        ]
+
+
+def get_usphbm2_telemetry(hbm):
+    """Connect the temperature and catastrophic temperature outputs of a USPHBM2 core.
+
+    The core leaves the DRAM_<stack>_STAT_TEMP (degrees Celsius, 7 bits) and
+    DRAM_<stack>_STAT_CATTRIP outputs of its HBM IP open: they are connected in its
+    hbm_params, before the core instantiates the IP at finalization, and returned as
+    (name, signal) telemetry for add_hbm_benchmark. The values come from the HBM APB domain.
+    """
+    telemetry = []
+    cattrip = Signal(len(hbm.axi)//16)
+    for stack in range(len(cattrip)):
+        temp = Signal(7)
+        hbm.hbm_params[f"o_DRAM_{stack}_STAT_TEMP"] = temp
+        hbm.hbm_params[f"o_DRAM_{stack}_STAT_CATTRIP"] = cattrip[stack]
+        telemetry.append((f"hbm{stack}_temp", temp))
+    telemetry.append(("hbm_cattrip", cattrip))
+    return telemetry
+
+
+def get_dram_bist_stats(generator, checker):
+    """Statistics of a LiteDRAM BIST generator/checker pair, for the stats_blocks of
+    add_hbm_benchmark.
+
+    The generator writes, and the checker reads back, length bytes of the DRAM port in
+    (write|read)_cycles of the port clock domain, so the host derives the bandwidth as for the
+    HBM ports.
+    """
+    return [
+        ("write_done",   generator.done.status),
+        ("write_cycles", generator.ticks.status),
+        ("write_bytes",  generator.length.storage),
+        ("read_done",    checker.done.status),
+        ("read_cycles",  checker.ticks.status),
+        ("read_bytes",   checker.length.storage),
+        ("errors",       checker.errors.status),
+    ]
+
+
+def add_hbm_benchmark(soc, hbm, ports=None, clock_domain="sys", clk_freq=None,
+    stats_origin=None, samples_origin=None, sample_depth=512, telemetry=None,
+    stats_blocks=None, **port_kwargs):
+    """Add the HBM benchmark to a SoC built around a USPHBM2 core.
+
+    Adds commonRegs, one HBMReadAndWriteSM named hbm_<i> for every AXI port index in ports
+    (all of hbm.axi by default, in the hbm_ports<g> CSR groups and in soc.hbm_engines), the
+    hbm_stats and hbm_samples regions (allocated in the IO region unless an origin is given)
+    and the constants read by hbm_bist_test.py, so every board exposes the same register map
+    to the host.
+    clock_domain is the domain of the HBM AXI ports and clk_freq its frequency (sys_clk_freq
+    by default). telemetry is a list of (name, signal) recorded with the bandwidth samples and
+    snapshots (see HBMCSRSCommon.add_sample_word). stats_blocks is a list of (name, stats) of
+    other engines (in sys) read back with the HBM statistics, e.g. get_dram_bist_stats.
+    port_kwargs are passed to HBMReadAndWriteSM.
+    """
+    ports = list(range(len(hbm.axi)) if ports is None else ports)
+    assert ports and max(ports) < 32 # ports_mask is 32 bits wide.
+
+    soc.submodules.commonRegs = common = HBMCSRSCommon(
+        clock_domain = clock_domain,
+        sample_ports = len(hbm.axi),
+        sample_depth = sample_depth)
+    for name, value in (telemetry or []):
+        soc.add_constant(f"HBM_TELEMETRY_{name}", common.add_sample_word(name, value))
+    if soc.irq.enabled:
+        soc.irq.add("commonRegs", use_loc_if_exists=True)
+
+    soc.hbm_engines = {}
+    for i in ports:
+        group = f"hbm_ports{i//HBM_PORT_GROUP}"
+        if not hasattr(soc, group):
+            setattr(soc.submodules, group, HBMPortGroup())
+            soc.add_csr(group)
+        soc.hbm_engines[i] = HBMReadAndWriteSM(hbm.axi[i], common, i, clock_domain=clock_domain, **port_kwargs)
+        getattr(soc, group).add_port(i, soc.hbm_engines[i])
+    soc.add_constant("HBM_PORT_GROUP", HBM_PORT_GROUP)
+    soc.add_constant("HBM_HISTOGRAM_BUCKETS", soc.hbm_engines[ports[0]].read_latency.buckets)
+
+    # Statistics of all the ports, readable in one burst.
+    soc.submodules.hbm_stats = HBMStatsBank([("common", common.stats)] +
+        [(f"hbm_{i}", soc.hbm_engines[i].stats) for i in ports] + list(stats_blocks or []))
+    soc.bus.add_slave("hbm_stats", soc.hbm_stats.bus,
+        SoCRegion(origin=stats_origin, size=soc.hbm_stats.size, cached=False))
+
+    # Bandwidth sampler ring buffer.
+    soc.bus.add_slave("hbm_samples", common.sample_bus,
+        SoCRegion(origin=samples_origin, size=common.sample_size, cached=False))
+    soc.add_constant("HBM_SAMPLE_PORTS", common.sample_ports)
+    soc.add_constant("HBM_SAMPLE_SLOTS", common.sample_slots)
+    soc.add_constant("HBM_SAMPLE_DEPTH", common.sample_depth)
+    soc.add_constant("HBM_CLK_FREQ", int(soc.sys_clk_freq if clk_freq is None else clk_freq))
+
 
 
 # # def ax_description(address_width, version="axi4"):
@@ -1,12 +1,1022 @@
+#!/usr/bin/env python3
+
+#
+# This file is part of LiteX-Boards.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""
+Host runner for the HBM benchmark gateware (HBMPortAccess.py).
+
+Connects to a running litex_server through RemoteClient, programs the ports from csr.csv,
+runs every point of the requested sweep over a hardware-timed measurement window and reads
+the statistics of all the ports back in bulk through the hbm_stats region (hbm_stats.csv, written
+by the target next to its build outputs).
+Results are written per port and per point to CSV and/or JSON.
+
+Example:
+    litex_server --jtag --jtag-config=openocd_xc7_ft2232.cfg &
+    python3 -m litex_boards.targets.hbm_bist_test --burst-len 1,2,4,8,16 --ports-mask 0x1,0xffffffff --csv results.csv
+    python3 -m litex_boards.targets.hbm_bist_test --mode read --load 0.1,0.25,0.5,0.75,0.95 --json load.json
+    python3 -m litex_boards.targets.hbm_bist_test --mode write --sample-period 450 --json series.json
+    python3 -m litex_boards.targets.hbm_bist_test --trace workload.trace --trace-loops 100 --ports-mask 0xf
+    python3 -m litex_boards.targets.hbm_bist_test --matrix pairs --ports-mask 0x1 --mode read --json matrix.json
+    python3 -m litex_boards.targets.hbm_bist_test --matrix shift --matrix-shift 0,1,4,16 --mode both
+    python3 -m litex_boards.targets.hbm_bist_test --data-mode counter,prbs31,walking-ones,walking-zeros --burst-len 16
+    python3 -m litex_boards.targets.hbm_bist_test --mode write --measure 2250000000 --sample-period 65535 --json thermal.json
+    python3 -m litex_boards.targets.hbm_bist_test --ddr4 --burst-len 16 --ports-mask 0x10,0xfffffff0 --csv ddr4_vs_hbm.csv
+
+On gateware with telemetry (xilinx_alveo_u280: SYSMON and HBM stack temperatures), the die and
+HBM temperatures and the supplies are reported with every point and, when sampling, with every
+bandwidth sample, so that throttling during long runs can be correlated with temperature.
+
+With --pcie-dma, the PCIe DMA to HBM bridges of the given ports (xilinx_alveo_u280 --pcie-hbm-ports)
+are programmed instead and their host to HBM and HBM to host throughput is reported while the host
+runs the DMAs, e.g. with litepcie_util -e dma_test from the generated driver (litex_server --pcie):
+    python3 -m litex_boards.targets.hbm_bist_test --pcie-dma 4,5 --pcie-dma-time 30 --json pcie.json
+
+With --ddr4 (xilinx_alveo_u280 --with-ddr4-bist), the LiteDRAM BIST of the DDR4 also writes and
+reads back --ddr4-length bytes after the sweep, its results being reported as one more "ddr4" port
+and compared to the best HBM single port and aggregate bandwidths of the session.
+"""
+
+import csv
+import math
+import json
+import time
 import argparse
+import itertools
+
+from litex import RemoteClient
+
+from litex_boards.targets.HBMPortAccess import OPTION_READ, OPTION_WRITE, OPTION_MIXED, OPTION_TRACE
+from litex_boards.targets.HBMPortAccess import TRACE_RECORD_LAYOUT
+from litex_boards.targets.HBMPortAccess import ADDRESS_FIXED, ADDRESS_LINEAR, ADDRESS_STRIDE
+from litex_boards.targets.HBMPortAccess import ADDRESS_BANK_OFFSET, ADDRESS_RANDOM
+from litex_boards.targets.HBMPortAccess import BURST_FIXED, BURST_INCR, BURST_WRAP
+from litex_boards.targets.HBMPortAccess import DMA_MODE_FIFO, DMA_MODE_SPLIT
+from litex_boards.targets.HBMPortAccess import DATA_COUNTER, DATA_PRBS7, DATA_PRBS15, DATA_PRBS31
+from litex_boards.targets.HBMPortAccess import DATA_WALKING_ONES, DATA_WALKING_ZEROS, DATA_ADDRESS, DATA_RANDOM_STROBE
+
+# Constants ----------------------------------------------------------------------------------------
+
+HBM_PORTS           = 32
+HBM_PORT_SIZE       = 0x1000_0000 # 256MB pseudo channel per port.
+HBM_ADDRESS_SHIFT   = 5           # address_readwrite is in 32-byte units.
+HBM_BURST_SIZE      = 5           # Full width (256-bit) transfers.
+HBM_BEAT_BYTES      = 32          # Bytes per cycle of a port at full rate.
+ETHERBONE_MAX_BURST = 255         # Etherbone records have 8-bit read/write counts.
+HBM_DMA_BURST_BYTES = 512         # Burst of the PCIe DMA bridges (16 beats).
+HBM_SWITCH_PORTS    = 4           # Ports (and pseudo channels) per switch of the HBM global addressing network.
+HBM_STACK_PORTS     = 16          # Ports (and pseudo channels) per HBM stack.
+THROTTLE_RATIO      = 0.9         # Bandwidth drop (end vs start of a sampled run) reported as throttling.
+
+ADDRESS_MODES = {
+    "fixed"  : ADDRESS_FIXED,
+    "linear" : ADDRESS_LINEAR,
+    "stride" : ADDRESS_STRIDE,
+    "bank"   : ADDRESS_BANK_OFFSET,
+    "random" : ADDRESS_RANDOM,
+}
+
+BURST_TYPES = {
+    "FIXED" : BURST_FIXED,
+    "INCR"  : BURST_INCR,
+    "WRAP"  : BURST_WRAP,
+}
+
+DMA_MODES = {
+    "fifo"  : DMA_MODE_FIFO,
+    "split" : DMA_MODE_SPLIT,
+}
+
+DATA_MODES = {
+    "counter"       : DATA_COUNTER,
+    "prbs7"         : DATA_PRBS7,
+    "prbs15"        : DATA_PRBS15,
+    "prbs31"        : DATA_PRBS31,
+    "walking-ones"  : DATA_WALKING_ONES,
+    "walking-zeros" : DATA_WALKING_ZEROS,
+    "address"       : DATA_ADDRESS,
+    "random-strobe" : DATA_RANDOM_STROBE, # PRBS31 data with random write strobes, reads are not checked.
+}
+
+# Telemetry conversion of the raw values to their units, by telemetry word name. SYSMON readings
+# are the 12 MSBs of the UltraScale+ SYSMONE4 (internal reference) results.
+TELEMETRY_UNITS = {
+    "temperature" : ("die_temp_c",  lambda v: v*509.3140064/4096 - 280.23087870),
+    "vccint"      : ("vccint_v",    lambda v: v*3.0/4096),
+    "vccaux"      : ("vccaux_v",    lambda v: v*3.0/4096),
+    "vccbram"     : ("vccbram_v",   lambda v: v*3.0/4096),
+    "hbm0_temp"   : ("hbm0_temp_c", lambda v: v),
+    "hbm1_temp"   : ("hbm1_temp_c", lambda v: v),
+    "hbm_cattrip" : ("hbm_cattrip", lambda v: v),
+}
+
+def telemetry_value(name, raw):
+    key, convert = TELEMETRY_UNITS.get(name, (name, lambda v: v))
+    return key, convert(raw)
+
+# Trace Replay -------------------------------------------------------------------------------------
+
+TRACE_OPS = {"R": 0, "W": 1}
+
+def read_trace(filename):
+    """Read a trace file: one `op,address,beats[,gap]` record per line.
+
+    op is R or W, address is in bytes from the start of the port's pseudo channel, beats is
+    the burst length and gap the idle cycles before the next record (default 0).
+    """
+    records = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            fields = [v.strip() for v in line.split(",")]
+            gap    = int(fields[3], 0) if len(fields) > 3 else 0
+            records.append((TRACE_OPS[fields[0].upper()], int(fields[1], 0), int(fields[2], 0), gap))
+    return records
+
+def pack_trace_record(write, address, beats, gap):
+    fields = {"address": address >> HBM_ADDRESS_SHIFT, "len": beats - 1, "gap": gap, "write": write}
+    value, shift = 0, 0
+    for name, width in TRACE_RECORD_LAYOUT:
+        if not 0 <= fields[name] < 2**width:
+            raise ValueError(f"trace record {name} out of range: {fields[name]}")
+        value |= fields[name] << shift
+        shift += width
+    return value
+
+# Mixed Traffic ------------------------------------------------------------------------------------
+
+def mix_sequence_from_ratio(reads, writes):
+    """Mixed mode sequence spreading `writes` writes evenly among `reads` reads."""
+    n = reads + writes
+    if n == 0 or n > 32:
+        raise ValueError(f"Mixed ratio {reads}:{writes} must have 1 to 32 bursts.")
+    sequence = 0
+    for i in range(n):
+        if ((i + 1)*writes)//n > (i*writes)//n:
+            sequence |= 1 << i
+    return sequence, n
+
+def mix_ratio(s):
+    reads, writes = s.split(":")
+    return (int(reads), int(writes))
+
+# CSR Batch ----------------------------------------------------------------------------------------
+
+class CSRBatch:
+    """Collects CSR writes and sends each run of contiguous words as one Etherbone write.
+
+    A port's CSRs are contiguous, so programming all 32 ports costs about 32 packets instead
+    of several hundreds. Words are sent in address order: registers whose write has a side
+    effect (start, latch) must not be batched.
+    """
+    def __init__(self, bus):
+        self.bus   = bus
+        self.words = {}
+
+    def write(self, reg, value):
+        mask = 2**reg.data_width - 1
+        for i in range(reg.length):
+            self.words[reg.addr + 4*i] = (value >> ((reg.length - 1 - i)*reg.data_width)) & mask
+
+    def flush(self):
+        base  = None
+        datas = []
+        for addr in sorted(self.words):
+            if datas and (addr == base + 4*len(datas)) and (len(datas) < ETHERBONE_MAX_BURST):
+                datas.append(self.words[addr])
+            else:
+                if datas:
+                    self.bus.write(base, datas)
+                base  = addr
+                datas = [self.words[addr]]
+        if datas:
+            self.bus.write(base, datas)
+        self.words = {}
+
+# HBM Bench ----------------------------------------------------------------------------------------
+
+class HBMBench:
+    def __init__(self, bus, stats_csv="build/xilinx_alveo_u280/hbm_stats.csv"):
+        self.bus        = bus
+        # Counters run in the HBM AXI clock domain (sys on older gateware).
+        self.clk_freq   = getattr(bus.constants, "hbm_clk_freq", bus.constants.config_clock_frequency)
+        # Samples are counted in sys: they must be two sys clock periods apart (see HBMCSRSCommon).
+        self.min_sample_period = max(4, 2*math.ceil(self.clk_freq/bus.constants.config_clock_frequency))
+        self.stats_base = bus.mems.hbm_stats.base
+        self.stats_size = bus.mems.hbm_stats.size
+        self.layout     = self.read_layout(stats_csv)
+        # Ports with a benchmark engine (main_ram and PCIe DMA ports have none).
+        self.ports_present = sum(1 << port for port in range(HBM_PORTS)
+            if any(block == f"hbm_{port}" for block, _ in self.layout))
+        self.sample_period = 0
+        self.latency_shift = 0
+        self.samples    = []
+        self.samples_read = 0
+        # Telemetry words recorded by the gateware, in sampler order (none on older gateware).
+        self.telemetry  = [name[len("telemetry_"):] for block, name in self.layout
+            if block == "common" and name.startswith("telemetry_")]
+        self.telemetry_samples = []
+
+    @staticmethod
+    def read_layout(filename):
+        layout = {}
+        with open(filename) as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                block, name, offset, nwords = line.strip().split(",")
+                layout[(block, name)] = (int(offset, 0), int(nwords))
+        return layout
+
+    def reg(self, name):
+        return getattr(self.bus.regs, name, None)
+
+    def common_reg(self, name):
+        return self.reg(f"commonRegs_{name}")
+
+    def port_reg(self, port, name):
+        group = getattr(self.bus.constants, "hbm_port_group", None)
+        if group is None: # One CSR bank per port on older gateware.
+            return self.reg(f"hbm_{port}_{name}")
+        return self.reg(f"hbm_ports{port//group}_hbm_{port}_{name}")
+
+    def read_stats(self):
+        """Read the whole statistics region and decode it as {block: {name: value}}."""
+        words = []
+        for addr in range(self.stats_base, self.stats_base + self.stats_size, 4*ETHERBONE_MAX_BURST):
+            length = min(ETHERBONE_MAX_BURST, (self.stats_base + self.stats_size - addr)//4)
+            words += self.bus.read(addr, length)
+        stats = {}
+        for (block, name), (offset, nwords) in self.layout.items():
+            value = 0
+            for i in range(nwords):
+                value |= words[offset//4 + i] << (32*i)
+            stats.setdefault(block, {})[name] = value
+        return stats
+
+    def stop(self):
+        self.common_reg("start").write(0)
+
+    def read_histogram(self, port, name, first, last):
+        """Read buckets first to last of a latency histogram of an idle port as {bucket: count}."""
+        index  = self.port_reg(port, f"{name}_latency_histogram_index")
+        offset = self.layout[(f"hbm_{port}", f"{name}_histogram_count")][0]
+        histogram = {}
+        for bucket in range(first, last + 1):
+            index.write(bucket)
+            histogram[bucket] = self.bus.read(self.stats_base + offset)
+        return histogram
+
+    def drain_samples(self):
+        """Read the bandwidth samples written since the last call from the ring buffer."""
+        ports = self.bus.constants.hbm_sample_ports
+        slots = getattr(self.bus.constants, "hbm_sample_slots", ports)
+        depth = self.bus.constants.hbm_sample_depth
+        base  = self.bus.mems.hbm_samples.base
+        words = {name: getattr(self.bus.constants, f"hbm_telemetry_{name}") for name in self.telemetry}
+        count = self.common_reg("sample_count").read()
+        first = max(self.samples_read, count - depth)
+        if first > self.samples_read:
+            print(f"Warning: {first - self.samples_read} bandwidth samples lost, drain faster or lower the rate.")
+        sample = first
+        while sample < count:
+            entry = sample % depth
+            n     = min(count - sample, depth - entry, max(ETHERBONE_MAX_BURST//slots, 1))
+            data  = self.bus.read(base + 4*entry*slots, n*slots)
+            for i in range(n):
+                self.samples.append([(w & 0xffff, w >> 16) for w in data[i*slots:i*slots + ports]])
+                self.telemetry_samples.append({name: data[i*slots + word] for name, word in words.items()})
+            sample += n
+        self.samples_read = count
+        self.common_reg("sample_drained").write(count)
+
+    def configure(self, ports_mask, option, burst_len, burst_quantity, address_mode, bank_offset, bank_count,
+        data_pattern, warmup, measure, max_outstanding=0, latency_shift=0, check=True,
+        burst_type=BURST_INCR, burst_size=HBM_BURST_SIZE, qos=0, mix=(1, 1), load=1.0, bucket=4096,
+        sample_period=0, targets=None, data_mode=DATA_COUNTER, written=None):
+        """Program the common registers and every port of ports_mask for the next run.
+
+        targets maps ports to the pseudo channel they access through the HBM switch network
+        (default: their own). written maps ports to the bytes written from their base by a
+        previous linear write pass: the reads are then kept inside the written range (the
+        largest power of two window holding whole bursts) and only checked if it is not empty.
+        """
+        mix_sequence, mix_length = mix_sequence_from_ratio(*mix)
+        targets = {} if targets is None else targets
+        # Random offsets are aligned on the burst (rounded up to a power of two) so that the
+        # bursts do not cross 4KB boundaries.
+        window_mask = HBM_PORT_SIZE - 1
+        if address_mode == ADDRESS_RANDOM:
+            window_mask &= ~((1 << ((burst_len << burst_size) - 1).bit_length()) - 1)
+        if 0 < sample_period < self.min_sample_period:
+            raise ValueError(f"sample_period must be at least {self.min_sample_period} cycles with this clocking.")
+        self.sample_period = sample_period
+        self.latency_shift = latency_shift
+        batch = CSRBatch(self.bus)
+        batch.write(self.common_reg("ports_mask"),     ports_mask)
+        batch.write(self.common_reg("data_pattern"),   data_pattern)
+        batch.write(self.common_reg("data_mode"),      data_mode)
+        batch.write(self.common_reg("delay_force"),    0)
+        batch.write(self.common_reg("warmup_cycles"),  warmup)
+        batch.write(self.common_reg("measure_cycles"), measure)
+        batch.write(self.common_reg("sample_period"),  sample_period)
+        for port in range(HBM_PORTS):
+            if not (ports_mask >> port) & 1:
+                continue
+            port_window_mask = window_mask
+            port_check       = check and option == OPTION_READ
+            if written is not None:
+                limit = written.get(port, 0) - (burst_len << burst_size) + 1
+                if limit <= window_mask:
+                    port_window_mask &= (1 << (limit.bit_length() - 1)) - 1 if limit > 0 else 0
+                    port_check       &= limit > 0
+            # Every register of the port is written so its block goes out as one burst.
+            settings = {
+                "port_settings"                     : option,
+                "address_readwrite"                 : (targets.get(port, port)*HBM_PORT_SIZE) >> HBM_ADDRESS_SHIFT,
+                "acknowledge_readwrite"             : 0,
+                "burst_len"                         : burst_len,
+                "last_burst_len"                    : 0,
+                "burst_quantity"                    : burst_quantity,
+                "delay_ctr_max"                     : 0,
+                "outstanding_max"                   : max_outstanding,
+                "mix_sequence"                      : mix_sequence,
+                "mix_length"                        : mix_length,
+                "burst_type"                        : burst_type,
+                "burst_size"                        : burst_size,
+                "qos"                               : qos,
+                "shaper_enable"                     : int(load < 1.0),
+                "shaper_rate"                       : round(load*HBM_BEAT_BYTES*256),
+                "shaper_bucket_size"                : bucket,
+                "address_gen_address_mode"          : address_mode,
+                "address_gen_address_stride"        : bank_offset,
+                "address_gen_bank_offset"           : bank_offset,
+                "address_gen_bank_count"            : bank_count,
+                "address_gen_window_mask"           : port_window_mask,
+                "address_gen_random_seed"           : 0x12345678 + port,
+                "checker_check_enable"              : int(port_check),
+                "read_latency_latency_shift"        : latency_shift,
+                "read_latency_histogram_index"      : 0,
+                "write_latency_latency_shift"       : latency_shift,
+                "write_latency_histogram_index"     : 0,
+            }
+            for name, value in settings.items():
+                reg = self.port_reg(port, name)
+                if reg is None:
+                    raise ValueError(f"hbm_{port}_{name} not present in csr.csv, gateware too old?")
+                batch.write(reg, value)
+        batch.flush()
+
+    def load_trace(self, port, records, loops=1):
+        """Load the trace records into the BRAM of a port (relative to its pseudo channel)."""
+        base = port*HBM_PORT_SIZE
+        self.port_reg(port, "trace_load_address").write(0)
+        data = self.port_reg(port, "trace_load_data")
+        for write, address, beats, gap in records:
+            data.write(pack_trace_record(write, base + address, beats, gap))
+        batch = CSRBatch(self.bus)
+        batch.write(self.port_reg(port, "trace_length"), len(records))
+        batch.write(self.port_reg(port, "trace_loops"), loops)
+        batch.flush()
+
+    def run_trace(self, ports_mask, timeout=10.0):
+        """Start the ports, wait for all of them to complete their trace and return the stats."""
+        self.common_reg("start").write(1)
+        deadline = time.time() + timeout
+        for port in range(HBM_PORTS):
+            if not (ports_mask >> port) & 1:
+                continue
+            offset, _ = self.layout[(f"hbm_{port}", "trace_done")]
+            while not self.bus.read(self.stats_base + offset):
+                if time.time() > deadline:
+                    self.stop()
+                    raise TimeoutError(f"Trace replay of port {port} did not complete.")
+                time.sleep(0.001)
+        stats = self.read_stats()
+        self.stop()
+        return stats
+
+    def trace_results(self, stats, ports_mask):
+        """Per-port completion time and bandwidth of a trace replay."""
+        results = []
+        for port in range(HBM_PORTS):
+            if not (ports_mask >> port) & 1:
+                continue
+            s       = stats[f"hbm_{port}"]
+            seconds = max(s["trace_cycles"], 1)/self.clk_freq
+            r = {
+                "port"        : port,
+                "cycles"      : s["trace_cycles"],
+                "time_us"     : seconds*1e6,
+                "records"     : s["trace_records"],
+                "loops"       : s["trace_loops_done"],
+                "read_bytes"  : s["total_reads"] << HBM_BURST_SIZE,
+                "write_bytes" : s["total_writes"] << HBM_BURST_SIZE,
+                "errors"      : s["errors"],
+            }
+            r["read_gbps"]  = r["read_bytes"]/seconds/1e9
+            r["write_gbps"] = r["write_bytes"]/seconds/1e9
+            results.append(r)
+        return results
+
+    def run(self, timeout=10.0):
+        """Start the ports, wait for the end of the measurement window and return the stats.
+
+        When sampling, the ring buffer is drained while waiting, the samples going to
+        self.samples as [(read beats, write beats) per port] lists and the telemetry to
+        self.telemetry_samples as {name: raw value} dicts.
+        """
+        self.samples      = []
+        self.samples_read = 0
+        self.telemetry_samples = []
+        self.common_reg("start").write(1)
+        deadline = time.time() + timeout
+        while not self.common_reg("window_done").read():
+            if time.time() > deadline:
+                self.stop()
+                raise TimeoutError("Measurement window did not complete.")
+            if self.sample_period:
+                self.drain_samples()
+            else:
+                time.sleep(0.001)
+        stats = self.read_stats()
+        if self.sample_period:
+            self.drain_samples()
+        self.stop()
+        return stats
+
+    def sample_series(self, ports_mask):
+        """Per-port read/write bandwidth time series (GB/s) of the last run."""
+        seconds = self.sample_period/self.clk_freq
+        series  = {}
+        for port in range(HBM_PORTS):
+            if (ports_mask >> port) & 1:
+                series[port] = {
+                    "read_gbps"  : [s[port][0]*HBM_BEAT_BYTES/seconds/1e9 for s in self.samples],
+                    "write_gbps" : [s[port][1]*HBM_BEAT_BYTES/seconds/1e9 for s in self.samples],
+                }
+        return series
+
+    def telemetry_series(self):
+        """Telemetry time series of the last run, in the time base of sample_series."""
+        series = {}
+        for name in self.telemetry:
+            key, _ = telemetry_value(name, 0)
+            series[key] = [telemetry_value(name, s[name])[1] for s in self.telemetry_samples]
+        return series
+
+    def telemetry_results(self, stats):
+        """Telemetry latched with the statistics of a measurement."""
+        return dict(telemetry_value(name, stats["common"][f"telemetry_{name}"]) for name in self.telemetry)
+
+    def ddr4_run(self, base, length, random=False, timeout=10.0):
+        """Write then check length bytes of the DDR4 with the LiteDRAM BIST, return the result
+        in the format of the HBM ports (the BIST runs in sys)."""
+        for engine in ["generator", "checker"]:
+            batch = CSRBatch(self.bus)
+            batch.write(self.reg(f"ddr4_bist_{engine}_base"),   base)
+            batch.write(self.reg(f"ddr4_bist_{engine}_end"),    base + length)
+            batch.write(self.reg(f"ddr4_bist_{engine}_length"), length)
+            batch.write(self.reg(f"ddr4_bist_{engine}_random"), int(random) << 1) # Addresses, not data.
+            batch.flush()
+            self.reg(f"ddr4_bist_{engine}_reset").write(1)
+            self.reg(f"ddr4_bist_{engine}_start").write(1)
+            deadline = time.time() + timeout
+            while not self.reg(f"ddr4_bist_{engine}_done").read():
+                if time.time() > deadline:
+                    raise TimeoutError(f"DDR4 BIST {engine} did not complete.")
+                time.sleep(0.001)
+        s        = self.read_stats()["ddr4"]
+        clk_freq = self.bus.constants.config_clock_frequency
+        return {
+            "port"        : "ddr4",
+            "cycles"      : s["write_cycles"] + s["read_cycles"],
+            "read_bytes"  : s["read_bytes"],
+            "write_bytes" : s["write_bytes"],
+            "read_gbps"   : s["read_bytes"]/(max(s["read_cycles"], 1)/clk_freq)/1e9,
+            "write_gbps"  : s["write_bytes"]/(max(s["write_cycles"], 1)/clk_freq)/1e9,
+            "errors"      : s["errors"],
+        }
+
+    def results(self, stats, ports_mask):
+        """Per-port bandwidth, latency and error results of a measurement.
+
+        The latency histograms are read back bucket by bucket (between the buckets of the
+        minimum and maximum latencies) and reduced to p50/p99 latencies.
+        """
+        buckets = getattr(self.bus.constants, "hbm_histogram_buckets", None) # None on older gateware.
+        results = []
+        for port in range(HBM_PORTS):
+            if not (ports_mask >> port) & 1:
+                continue
+            s       = stats[f"hbm_{port}"]
+            cycles  = max(s["snapshot_cycles"], 1)
+            seconds = cycles/self.clk_freq
+            r = {
+                "port"         : port,
+                "cycles"       : s["snapshot_cycles"],
+                "read_bytes"   : s["snapshot_read_bytes"],
+                "write_bytes"  : s["snapshot_write_bytes"],
+                "read_gbps"    : s["snapshot_read_bytes"]/seconds/1e9,
+                "write_gbps"   : s["snapshot_write_bytes"]/seconds/1e9,
+                "errors"       : s["errors"],
+            }
+            for name in ["read", "write"]:
+                count = s[f"{name}_latency_count"]
+                r[f"{name}_latency_count"]  = count
+                r[f"{name}_latency_min_ns"] = s[f"{name}_latency_min"]*1e9/self.clk_freq if count else None
+                r[f"{name}_latency_max_ns"] = s[f"{name}_latency_max"]*1e9/self.clk_freq if count else None
+                r[f"{name}_latency_avg_ns"] = s[f"{name}_latency_sum"]/count*1e9/self.clk_freq if count else None
+                histogram = None
+                if count and buckets is not None:
+                    histogram = self.read_histogram(port, name,
+                        first = min(s[f"{name}_latency_min"] >> self.latency_shift, buckets - 1),
+                        last  = min(s[f"{name}_latency_max"] >> self.latency_shift, buckets - 1))
+                for percentile in [50, 99]:
+                    r[f"{name}_latency_p{percentile}_ns"] = None if histogram is None else \
+                        histogram_percentile(histogram, percentile, self.latency_shift,
+                            s[f"{name}_latency_max"])*1e9/self.clk_freq
+                # Bucket start (ns) -> count, the last bucket collecting the tail.
+                r[f"{name}_latency_histogram"] = None if histogram is None else {
+                    round((bucket << self.latency_shift)*1e9/self.clk_freq, 3): n
+                    for bucket, n in histogram.items()}
+            results.append(r)
+        return results
+
+def histogram_percentile(histogram, percentile, shift, latency_max):
+    """Upper bound in cycles of the latency histogram bucket holding the percentile."""
+    target     = sum(histogram.values())*percentile/100
+    cumulative = 0
+    for bucket in sorted(histogram):
+        cumulative += histogram[bucket]
+        if cumulative >= target:
+            return min(((bucket + 1) << shift) - 1, latency_max)
+    return latency_max
+
+# Sweep --------------------------------------------------------------------------------------------
+
+def int_list(s):
+    return [int(v, 0) for v in s.split(",")]
+
+def data_modes(s):
+    modes = s.lower().split(",")
+    for m in modes:
+        if m not in DATA_MODES:
+            raise argparse.ArgumentTypeError(f"invalid data mode {m}, choose from {', '.join(DATA_MODES)}")
+    return modes
+
+def burst_types(s):
+    types = s.upper().split(",")
+    for t in types:
+        if t not in BURST_TYPES:
+            raise argparse.ArgumentTypeError(f"invalid burst mode {t}, choose from {', '.join(BURST_TYPES)}")
+    return types
+
+def sweep_passes(args):
+    """(mode, port option, reads:writes ratio) of the passes run at every point."""
+    return {
+        "read"  : [("read",  OPTION_READ,  (1, 0))],
+        "write" : [("write", OPTION_WRITE, (0, 1))],
+        "both"  : [("write", OPTION_WRITE, (0, 1)), ("read", OPTION_READ, (1, 0))], # Write first so the read pass can be checked.
+        "mixed" : [(f"{r}:{w}", OPTION_MIXED, (r, w)) for r, w in args.mix_ratio],
+    }[args.mode]
+
+def sweep(bench, args):
+    points = []
+    passes = sweep_passes(args)
+    address_mode = ADDRESS_BANK_OFFSET if args.bank_offset is not None else ADDRESS_MODES[args.address_mode]
+    burst_lens   = [1] if args.single else args.burst_len
+    for ports_mask, burst_len, burst_quantity, burstmode, burst_size, qos, load, data_mode in itertools.product(
+        args.ports_mask, burst_lens, args.burst_quantity, args.burstmode, args.burst_size, args.qos, args.load,
+        args.data_mode):
+        if burstmode == "WRAP" and burst_len not in [2, 4, 8, 16]:
+            continue # Not a legal AXI wrapping burst.
+        # In both mode, the read pass is checked against what the write pass wrote: the linear
+        # sequences are kept inside the written range, the other ones are not checked.
+        written = None
+        checked = args.mode != "both" or address_mode in [ADDRESS_FIXED, ADDRESS_LINEAR]
+        for mode, option, mix in passes:
+            bench.stop()
+            bench.configure(
+                ports_mask      = ports_mask,
+                option          = option,
+                burst_len       = burst_len,
+                burst_quantity  = burst_quantity,
+                address_mode    = address_mode,
+                bank_offset     = args.bank_offset or 0,
+                bank_count      = args.bank_count,
+                data_pattern    = args.data_pattern,
+                warmup          = args.warmup,
+                measure         = args.measure,
+                max_outstanding = args.max_outstanding,
+                latency_shift   = args.latency_shift,
+                check           = not args.no_check and checked,
+                burst_type      = BURST_TYPES[burstmode],
+                burst_size      = burst_size,
+                qos             = qos,
+                mix             = mix,
+                load            = load,
+                bucket          = args.bucket,
+                sample_period   = args.sample_period,
+                data_mode       = DATA_MODES[data_mode],
+                written         = written)
+            stats = bench.run()
+            ports = bench.results(stats, ports_mask)
+            if args.mode == "both" and option == OPTION_WRITE:
+                # Bursts acknowledged since the start of the write pass.
+                written = {p["port"]: p["write_latency_count"]*(burst_len << burst_size) for p in ports}
+            point = {
+                "ports_mask"     : f"0x{ports_mask:08x}",
+                "mode"           : mode,
+                "burst_len"      : burst_len,
+                "burst_quantity" : burst_quantity,
+                "burst_type"     : burstmode,
+                "burst_size"     : burst_size,
+                "qos"            : qos,
+                "load"           : load,
+                "data_mode"      : data_mode,
+                "gbps"           : sum(p["read_gbps"] + p["write_gbps"] for p in ports),
+                "errors"         : sum(p["errors"] for p in ports),
+                "ports"          : ports,
+                "telemetry"      : bench.telemetry_results(stats),
+            }
+            if args.sample_period:
+                point["sample_period_us"]  = args.sample_period*1e6/bench.clk_freq
+                point["samples"]           = bench.sample_series(ports_mask)
+                point["telemetry_samples"] = bench.telemetry_series()
+            latencies = [p[f"{name}_latency_avg_ns"] for p in ports for name in ["read", "write"]]
+            latencies = [l for l in latencies if l is not None]
+            point["latency_avg_ns"] = sum(latencies)/len(latencies) if latencies else None
+            tails = [p[f"{name}_latency_p99_ns"] for p in ports for name in ["read", "write"]]
+            tails = [l for l in tails if l is not None]
+            point["latency_p99_ns"] = max(tails) if tails else None
+            print("{ports_mask} {mode:5s} {burst_type:5s} len={burst_len:3d} size={burst_size} qty={burst_quantity:6d} "
+                "qos={qos:2d} load={load:4.2f} data={data_mode}: {gbps:8.2f} GB/s, {errors} errors".format(**point) +
+                (f", {point['latency_avg_ns']:.1f} ns avg latency" if latencies else "") +
+                (f", {point['latency_p99_ns']:.1f} ns p99 latency" if tails else "") +
+                format_telemetry(point["telemetry"]))
+            check_thermal(point)
+            points.append(point)
+        # Effective bandwidth of every read/write mix relative to the best one.
+        if args.mode == "mixed":
+            group     = points[-len(passes):]
+            reference = max(point["gbps"] for point in group)
+            for point in group:
+                point["efficiency"] = point["gbps"]/reference if reference else 0.0
+                print(f"    {point['mode']:>5s}: {100*point['efficiency']:5.1f}% of best mix")
+    return points
+
+def format_telemetry(telemetry):
+    text = ""
+    if "die_temp_c" in telemetry:
+        text += f", die {telemetry['die_temp_c']:.1f} C"
+    hbm = [f"{telemetry[key]:.0f}" for key in ["hbm0_temp_c", "hbm1_temp_c"] if key in telemetry]
+    if hbm:
+        text += f", HBM {'/'.join(hbm)} C"
+    return text
+
+def check_thermal(point):
+    """Flag HBM catastrophic temperature alarms and bandwidth drops over a sampled run."""
+    if point["telemetry"].get("hbm_cattrip"):
+        print(f"    Warning: HBM catastrophic temperature alarm (stacks 0b{point['telemetry']['hbm_cattrip']:b}).")
+    samples = point.get("samples", {})
+    gbps    = [sum(values) for values in zip(*[s["read_gbps"] for s in samples.values()],
+        *[s["write_gbps"] for s in samples.values()])]
+    n = len(gbps)//4
+    if n < 2:
+        return
+    start = sum(gbps[:n])/n
+    end   = sum(gbps[-n:])/n
+    point["throttling"] = end < THROTTLE_RATIO*start
+    if point["throttling"]:
+        text = f"    Warning: bandwidth dropped from {start:.2f} to {end:.2f} GB/s during the run"
+        temps = point.get("telemetry_samples", {})
+        for key, name in [("die_temp_c", "die"), ("hbm0_temp_c", "HBM0"), ("hbm1_temp_c", "HBM1")]:
+            if temps.get(key):
+                text += f", {name} {max(temps[key][:n]):.0f} to {max(temps[key][-n:]):.0f} C"
+        print(text + ", thermal throttling?")
+
+def replay(bench, args):
+    records = read_trace(args.trace)
+    points  = []
+    for ports_mask in args.ports_mask:
+        bench.stop()
+        bench.configure(
+            ports_mask      = ports_mask,
+            option          = OPTION_TRACE,
+            burst_len       = 1,
+            burst_quantity  = 1,
+            address_mode    = ADDRESS_LINEAR,
+            bank_offset     = 0,
+            bank_count      = args.bank_count,
+            data_pattern    = args.data_pattern,
+            warmup          = 0,
+            measure         = 0,
+            max_outstanding = args.max_outstanding,
+            latency_shift   = args.latency_shift,
+            burst_size      = HBM_BURST_SIZE,
+            data_mode       = DATA_MODES[args.data_mode[0]])
+        for port in range(HBM_PORTS):
+            if (ports_mask >> port) & 1:
+                bench.load_trace(port, records, loops=args.trace_loops)
+        ports = bench.trace_results(bench.run_trace(ports_mask, timeout=args.trace_timeout), ports_mask)
+        point = {
+            "ports_mask" : f"0x{ports_mask:08x}",
+            "mode"       : "trace",
+            "trace"      : args.trace,
+            "gbps"       : sum(p["read_gbps"] + p["write_gbps"] for p in ports),
+            "errors"     : sum(p["errors"] for p in ports),
+            "ports"      : ports,
+        }
+        print("{ports_mask} trace {trace}: {gbps:8.2f} GB/s, {errors} errors".format(**point))
+        for p in ports:
+            print(f"    port {p['port']:2d}: {p['records']} records in {p['time_us']:.3f} us")
+        points.append(point)
+    return points
+
+# Contention Matrix --------------------------------------------------------------------------------
+
+def route(port, channel):
+    """Path from a port to a pseudo channel through the HBM switch network."""
+    if port == channel:
+        return "local"
+    if port//HBM_SWITCH_PORTS == channel//HBM_SWITCH_PORTS:
+        return "switch"
+    if port//HBM_STACK_PORTS == channel//HBM_STACK_PORTS:
+        return "stack"
+    return "cross-stack"
+
+ROUTES = ["local", "switch", "stack", "cross-stack"]
+
+def matrix(bench, args):
+    """Bandwidth of the ports of --ports-mask pointed at other pseudo channels.
+
+    "pairs" runs every source port alone against every destination channel, "shift" runs all
+    the source ports at once, port p accessing channel (p + shift) % 32. Every port result is
+    tagged with its route and the bandwidth penalty relative to the local accesses of the
+    same mode. The first value of each sweep option is used.
+    """
+    sources  = [port for port in range(HBM_PORTS) if (args.ports_mask[0] >> port) & 1]
+    channels = list(range(HBM_PORTS)) if args.matrix_channels is None else args.matrix_channels
+    shifts   = list(range(HBM_PORTS)) if args.matrix_shift is None else args.matrix_shift
+    if args.matrix == "pairs":
+        mappings = [({"source": port, "channel": channel}, {port: channel}) for port in sources for channel in channels]
+    else:
+        mappings = [({"shift": shift}, {port: (port + shift) % HBM_PORTS for port in sources}) for shift in shifts]
+    address_mode = ADDRESS_BANK_OFFSET if args.bank_offset is not None else ADDRESS_MODES[args.address_mode]
+    points = []
+    for label, targets in mappings:
+        ports_mask = sum(1 << port for port in targets)
+        for mode, option, mix in sweep_passes(args):
+            bench.stop()
+            bench.configure(
+                ports_mask      = ports_mask,
+                option          = option,
+                burst_len       = 1 if args.single else args.burst_len[0],
+                burst_quantity  = args.burst_quantity[0],
+                address_mode    = address_mode,
+                bank_offset     = args.bank_offset or 0,
+                bank_count      = args.bank_count,
+                data_pattern    = args.data_pattern,
+                warmup          = args.warmup,
+                measure         = args.measure,
+                max_outstanding = args.max_outstanding,
+                latency_shift   = args.latency_shift,
+                check           = not args.no_check,
+                burst_type      = BURST_TYPES[args.burstmode[0]],
+                burst_size      = args.burst_size[0],
+                qos             = args.qos[0],
+                mix             = mix,
+                load            = args.load[0],
+                bucket          = args.bucket,
+                targets         = targets,
+                data_mode       = DATA_MODES[args.data_mode[0]])
+            ports = bench.results(bench.run(), ports_mask)
+            for p in ports:
+                p["channel"] = targets[p["port"]]
+                p["route"]   = route(p["port"], p["channel"])
+                p["gbps"]    = p["read_gbps"] + p["write_gbps"]
+            point = {
+                "ports_mask" : f"0x{ports_mask:08x}",
+                "mode"       : mode,
+                "matrix"     : args.matrix,
+                **label,
+                "gbps"       : sum(p["gbps"] for p in ports),
+                "errors"     : sum(p["errors"] for p in ports),
+                "ports"      : ports,
+            }
+            print(" ".join(f"{k}={v}" for k, v in label.items()) +
+                " {mode:5s}: {gbps:8.2f} GB/s, {errors} errors".format(**point))
+            points.append(point)
+
+    # Penalty of every route relative to the local accesses.
+    print("Route penalties (mean port bandwidth):")
+    for mode, _, _ in sweep_passes(args):
+        results = [p for point in points if point["mode"] == mode for p in point["ports"]]
+        means   = {}
+        for r in ROUTES:
+            gbps = [p["gbps"] for p in results if p["route"] == r]
+            if gbps:
+                means[r] = sum(gbps)/len(gbps)
+        local = means.get("local")
+        for p in results:
+            p["penalty"] = 1.0 - p["gbps"]/local if local else None
+        for r, gbps in means.items():
+            penalty = f", {100*(1.0 - gbps/local):5.1f}% penalty" if local else ""
+            print(f"    {mode:5s} {r:11s}: {gbps:8.2f} GB/s{penalty}")
+    return points
+
+# DDR4 ---------------------------------------------------------------------------------------------
+
+def ddr4_compare(bench, args, points):
+    """Run the DDR4 BIST and compare it to the HBM points of the session."""
+    if bench.reg("ddr4_bist_generator_start") is None:
+        raise ValueError("ddr4_bist not present in csr.csv, build with --with-ddr4-bist.")
+    r = bench.ddr4_run(args.ddr4_base, args.ddr4_length, random=args.address_mode == "random")
+    point = {
+        "mode"   : "ddr4",
+        "gbps"   : r["read_gbps"] + r["write_gbps"],
+        "errors" : r["errors"],
+        "ports"  : [r],
+    }
+    print(f"DDR4: write {r['write_gbps']:8.2f} GB/s, read {r['read_gbps']:8.2f} GB/s, {r['errors']} errors")
+    for name in ["write", "read"]:
+        ports     = [p for point in points for p in point["ports"]]
+        port      = max([p[f"{name}_gbps"] for p in ports], default=0.0)
+        aggregate = max([sum(p[f"{name}_gbps"] for p in point["ports"]) for point in points], default=0.0)
+        ddr4      = r[f"{name}_gbps"]
+        ratio     = lambda gbps: f" ({gbps/ddr4:5.2f}x DDR4)" if ddr4 else ""
+        print(f"    HBM {name:5s}: best port {port:8.2f} GB/s{ratio(port)}, aggregate {aggregate:8.2f} GB/s{ratio(aggregate)}")
+    return points + [point]
+
+# PCIe DMA -----------------------------------------------------------------------------------------
+
+def pcie_dma(bus, args):
+    clk_freq = bus.constants.config_clock_frequency # The bridges run in sys.
+    def reg(port, name):
+        return getattr(bus.regs, f"hbm_dma_{port}_{name}")
+
+    # A rising edge of enable empties the ring: program the bridges before the host starts the DMAs.
+    for port in args.pcie_dma:
+        reg(port, "enable").write(0)
+        reg(port, "mode").write(DMA_MODES[args.pcie_dma_mode])
+        reg(port, "read_enable").write(int(args.pcie_dma_mode == "split"))
+        if args.pcie_dma_size is not None:
+            reg(port, "size").write(args.pcie_dma_size)
+        reg(port, "enable").write(1)
+    print(f"HBM ports {', '.join(str(port) for port in args.pcie_dma)} ready ({args.pcie_dma_mode}), start the host DMAs.")
+
+    last   = {port: (0, 0, 0) for port in args.pcie_dma}
+    points = []
+    start  = time.time()
+    while time.time() - start < args.pcie_dma_time:
+        time.sleep(args.pcie_dma_interval)
+        ports = []
+        for port in args.pcie_dma:
+            counts = tuple(reg(port, name).read() for name in ["cycles", "write_beats", "read_beats"])
+            time_s = max(counts[0] - last[port][0], 1)/clk_freq
+            ports.append({
+                "port"       : port,
+                "write_gbps" : (counts[1] - last[port][1])*HBM_BEAT_BYTES/time_s/1e9,
+                "read_gbps"  : (counts[2] - last[port][2])*HBM_BEAT_BYTES/time_s/1e9,
+                "level"      : reg(port, "level").read(),
+                "errors"     : reg(port, "errors").read(),
+            })
+            last[port] = counts
+        point = {
+            "mode"       : f"pcie-{args.pcie_dma_mode}",
+            "time_s"     : time.time() - start,
+            "write_gbps" : sum(p["write_gbps"] for p in ports),
+            "read_gbps"  : sum(p["read_gbps"] for p in ports),
+            "gbps"       : sum(p["write_gbps"] + p["read_gbps"] for p in ports),
+            "errors"     : sum(p["errors"] for p in ports),
+            "ports"      : ports,
+        }
+        print("{time_s:6.1f}s: host to HBM {write_gbps:8.2f} GB/s, HBM to host {read_gbps:8.2f} GB/s, {errors} errors".format(**point))
+        points.append(point)
+    return points
+
+def write_csv(filename, points):
+    rows = []
+    for point in points:
+        for port in point["ports"]:
+            row = {k: v for k, v in point.items() if k not in ["ports", "gbps", "read_gbps", "write_gbps", "errors", "latency_avg_ns",
+                "latency_p99_ns", "samples", "telemetry", "telemetry_samples"]}
+            row.update(point.get("telemetry", {}))
+            row.update({k: v for k, v in port.items() if not k.endswith("_latency_histogram")}) # Distributions in JSON only.
+            rows.append(row)
+    if not rows:
+        return
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def write_json(filename, points):
+    with open(filename, "w") as f:
+        json.dump(points, f, indent=4)
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog = 'hbm_bist_test.py',
+                        description = 'Performs AXI reads and writes to verify performance of high-bandwidth memory IP cores',
+                        epilog = 'Defaults to burst mode increasing with a bank offset of 0')
+
+    parser.add_argument('-s' , '--single', action="store_true", help="Switches to single write mode, ignores burst argument")
+    parser.add_argument('-m', '--burstmode', action='store', type=burst_types, default="INCR", help="Switches AXI burst mode (INCR, FIXED, WRAP; comma separated to sweep)")
+    parser.add_argument('-o', '--bank_offset', action='store', type=lambda s: int(s, 0), help="Changes offset between memory banks, reduces bank conflicts")
+
+    parser.add_argument("--bank-count",      default=4, type=int,     help="Banks visited in bank offset mode.")
+    parser.add_argument("--host",            default="localhost",     help="Host ip address.")
+    parser.add_argument("--port",            default=1234, type=int,  help="Host bind port.")
+    parser.add_argument("--csr-csv",         default="csr.csv",       help="CSR configuration file.")
+    parser.add_argument("--stats-csv",       default="build/xilinx_alveo_u280/hbm_stats.csv", help="HBM statistics layout file, in the target build directory (e.g. build/sqrl_fk33/hbm_stats.csv).")
+    parser.add_argument("--mode",            default="both", choices=["read", "write", "both", "mixed"], help="Traffic of each point.")
+    parser.add_argument("--mix-ratio",       default="1:0,7:1,3:1,1:1,1:3,0:1", type=lambda s: [mix_ratio(v) for v in s.split(",")],
+                                                                      help="Reads:writes ratios of the mixed mode.")
+    parser.add_argument("--address-mode",    default="linear", choices=list(ADDRESS_MODES.keys()), help="Address sequence.")
+    parser.add_argument("--burst-len",       default="1,2,4,8,16", type=int_list, help="Burst lengths (beats) to sweep.")
+    parser.add_argument("--burst-quantity",  default="1024",       type=int_list, help="Bursts per command to sweep.")
+    parser.add_argument("--burst-size",      default=str(HBM_BURST_SIZE), type=int_list, help="AXI transfer sizes (log2 bytes) to sweep.")
+    parser.add_argument("--qos",             default="0",          type=int_list, help="AXI QoS values to sweep.")
+    parser.add_argument("--load",            default="1.0",        type=lambda s: [float(v) for v in s.split(",")],
+                                                                      help="Offered loads (fraction of the port bandwidth, token bucket shaped) to sweep.")
+    parser.add_argument("--bucket",          default=4096,         type=int,      help="Token bucket burst allowance in bytes.")
+    parser.add_argument("--sample-period",   default=0,            type=int,      help="Record per-port bandwidth every N cycles (0: off, time series in the JSON output).")
+    parser.add_argument("--ports-mask",      default=None,         type=int_list, help="Port masks to sweep (default: all the ports of the gateware).")
+    parser.add_argument("--max-outstanding", default=0,            type=int,      help="Bursts in flight per port (0: build limit).")
+    parser.add_argument("--latency-shift",   default=2,            type=int,      help="Latency histogram bucket width (log2 cycles).")
+    parser.add_argument("--data-pattern",    default="0x5aa55aa5", type=lambda s: int(s, 0), help="Data pattern seed.")
+    parser.add_argument("--data-mode",       default="counter",    type=data_modes, help=f"Write data patterns to sweep ({', '.join(DATA_MODES)}).")
+    parser.add_argument("--warmup",          default=1000,         type=int,      help="Warmup cycles before each measurement.")
+    parser.add_argument("--measure",         default=1000000,      type=int,      help="Measurement window in cycles.")
+    parser.add_argument("--no-check",        action="store_true",                 help="Disable read data checking.")
+    parser.add_argument("--trace",           default=None,                        help="Replay this trace file (op,address,beats[,gap] per line) instead of the sweep.")
+    parser.add_argument("--trace-loops",     default=1,            type=int,      help="Passes over the trace.")
+    parser.add_argument("--trace-timeout",   default=10.0,         type=float,    help="Trace replay timeout in seconds.")
+    parser.add_argument("--matrix",          default=None, choices=["pairs", "shift"], help="Point the ports of the first --ports-mask at other pseudo channels instead of the sweep.")
+    parser.add_argument("--matrix-channels", default=None,         type=int_list, help="Destination pseudo channels of the pairs matrix (default: all).")
+    parser.add_argument("--matrix-shift",    default=None,         type=int_list, help="Port to pseudo channel shifts of the shift matrix (default: all).")
+    parser.add_argument("--ddr4",            action="store_true",                 help="Also run the DDR4 LiteDRAM BIST and compare it to the HBM results.")
+    parser.add_argument("--ddr4-base",       default="0x0",        type=lambda s: int(s, 0), help="DDR4 BIST base address (bytes, in the DDR4).")
+    parser.add_argument("--ddr4-length",     default="0x10000000", type=lambda s: int(s, 0), help="Bytes written and read back by the DDR4 BIST.")
+    parser.add_argument("--pcie-dma",        default=None,         type=int_list, help="Program and monitor the PCIe DMA bridges of these HBM ports instead of the sweep.")
+    parser.add_argument("--pcie-dma-mode",   default="fifo", choices=list(DMA_MODES.keys()), help="HBM ring used as a FIFO (host loopback) or written and read independently.")
+    parser.add_argument("--pcie-dma-size",   default=None,         type=lambda s: int(s, 0), help="HBM ring size in bytes (default: whole pseudo-channel).")
+    parser.add_argument("--pcie-dma-time",   default=10.0,         type=float,    help="PCIe DMA monitoring time in seconds.")
+    parser.add_argument("--pcie-dma-interval", default=1.0,        type=float,    help="PCIe DMA throughput reporting interval in seconds.")
+    parser.add_argument("--csv",             default=None,                        help="Write per-port results to a CSV file.")
+    parser.add_argument("--json",            default=None,                        help="Write results to a JSON file.")
+    args = parser.parse_args()
+
+    if not 0 <= args.sample_period < 2**16:
+        parser.error("--sample-period must fit in 16 bits.")
+    if not all(0.0 < load <= 1.0 for load in args.load):
+        parser.error("--load values must be in ]0, 1].")
+    if args.trace is not None and args.trace_loops == 0:
+        parser.error("--trace-loops must be non-zero, the runner waits for the end of the trace.")
+    if args.matrix_channels is not None and not all(0 <= channel < HBM_PORTS for channel in args.matrix_channels):
+        parser.error(f"--matrix-channels must be in [0, {HBM_PORTS - 1}].")
+    if args.pcie_dma_size is not None and (args.pcie_dma_size <= 0 or args.pcie_dma_size % HBM_DMA_BURST_BYTES):
+        parser.error(f"--pcie-dma-size must be a non-zero multiple of {HBM_DMA_BURST_BYTES}.")
+    if args.trace is None and args.measure == 0:
+        parser.error("--measure must be non-zero, the runner relies on the hardware window.")
 
-parser = argparse.ArgumentParser(
-                    prog = 'hbm_bist_test.py',
-                    description = 'Performs AXI reads and writes to verify performance of high-bandwidth memory IP cores',
-                    epilog = 'Defaults to burst mode increasing with a bank offset of 0')
+    bus = RemoteClient(host=args.host, port=args.port, csr_csv=args.csr_csv)
+    bus.open()
+    try:
+        if args.pcie_dma is not None:
+            points = pcie_dma(bus, args)
+        else:
+            bench  = HBMBench(bus, stats_csv=args.stats_csv)
+            if args.ports_mask is None:
+                args.ports_mask = [bench.ports_present]
+            for ports_mask in args.ports_mask:
+                missing = [port for port in range(HBM_PORTS) if (ports_mask & ~bench.ports_present) >> port & 1]
+                if missing:
+                    parser.error(f"--ports-mask 0x{ports_mask:08x}: no benchmark engine on port(s) {', '.join(map(str, missing))}.")
+            if args.trace is not None:
+                points = replay(bench, args)
+            elif args.matrix is not None:
+                points = matrix(bench, args)
+            else:
+                points = sweep(bench, args)
+            if args.ddr4:
+                points = ddr4_compare(bench, args, points)
+    finally:
+        bus.close()
 
-parser.add_argument('-s' , '--single', action="store_true", help="Switches to single write mode, ignores burst argument")
-parser.add_argument('-m', '--burstmode', action='store', choices=["INCR", "FIXED", "WRAP"], default="INCR", help="Switches AXI burst mode")
-parser.add_argument('-o', '--bank_offset', action='store', type=int, help="Changes offset between memory banks, reduces bank conflicts")
+    if args.csv is not None:
+        write_csv(args.csv, points)
+    if args.json is not None:
+        write_json(args.json, points)
 
-parser.parse_args()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,8 @@ from litepcie.frontend.dma import LitePCIeDMA
 from litepcie.frontend.wishbone import LitePCIeWishboneBridge
 from litepcie.software import generate_litepcie_software
 
+from litex_boards.targets.HBMPortAccess import add_hbm_benchmark
+
 # CRG ----------------------------------------------------------------------------------------------
 
 class _CRG(LiteXModule):
@@ -62,8 +64,14 @@ class BaseSoC(SoCCore):
         with_led_chaser = True,
         with_pcie       = False,
         with_hbm        = False,
+        with_hbm_bench  = False,
+        hbm_max_outstanding   = 8,
+        hbm_histogram_buckets = 64,
+        hbm_trace_depth       = 1024,
+        hbm_sample_depth      = 512,
         **kwargs):
         platform = sqrl_fk33.Platform()
+        with_hbm = with_hbm or with_hbm_bench
         if with_hbm:
             assert 225e6 <= sys_clk_freq <= 450e6
 
@@ -97,6 +105,16 @@ class BaseSoC(SoCCore):
             # Link HBM2 channel 0 as main RAM
             self.bus.add_region("main_ram", SoCRegion(origin=0x4000_0000, size=0x1000_0000, linker=True)) # 256MB.
 
+            # Drive the other HBM's AXI interfaces with the benchmark (same register map and port
+            # reservation as the U280).
+            if with_hbm_bench:
+                add_hbm_benchmark(self, hbm,
+                    ports             = range(4, len(hbm.axi)),
+                    sample_depth      = hbm_sample_depth,
+                    max_outstanding   = hbm_max_outstanding,
+                    histogram_buckets = hbm_histogram_buckets,
+                    trace_depth       = hbm_trace_depth)
+
         # PCIe -------------------------------------------------------------------------------------
         if with_pcie:
             assert self.csr_data_width == 32
@@ -146,18 +164,31 @@ def main():
     parser.add_target_argument("--with-pcie",    action="store_true",       help="Enable PCIe support.")
     parser.add_target_argument("--with-hbm",     action="store_true",       help="Use HBM2.")
     parser.add_target_argument("--driver",       action="store_true",       help="Generate PCIe driver.")
+    parser.add_target_argument("--with-hbm-bench", action="store_true",     help="Use HBM2 with the benchmark on AXI ports 4-31, 0-3 staying on the main bus (see hbm_bist_test.py).")
+    parser.add_target_argument("--hbm-max-outstanding", default=8, type=int,   help="Maximum number of AXI bursts in flight per HBM port and direction.")
+    parser.add_target_argument("--hbm-trace-depth", default=1024, type=int,   help="Trace replay records per HBM port (0 to disable).")
+    parser.add_target_argument("--hbm-sample-depth", default=512, type=int,  help="Entries of the HBM bandwidth sampler ring buffer.")
+    parser.add_target_argument("--hbm-histogram-buckets", default=64, type=int, help="Number of latency histogram buckets per HBM port and direction.")
     args = parser.parse_args()
 
     soc = BaseSoC(
-        sys_clk_freq = args.sys_clk_freq,
-        with_pcie    = args.with_pcie,
-        with_hbm     = args.with_hbm,
+        sys_clk_freq   = args.sys_clk_freq,
+        with_pcie      = args.with_pcie,
+        with_hbm       = args.with_hbm,
+        with_hbm_bench = args.with_hbm_bench,
+        hbm_max_outstanding   = args.hbm_max_outstanding,
+        hbm_histogram_buckets = args.hbm_histogram_buckets,
+        hbm_trace_depth       = args.hbm_trace_depth,
+        hbm_sample_depth      = args.hbm_sample_depth,
         **parser.soc_argdict
     )
     builder = Builder(soc, **parser.builder_argdict)
     if args.build:
         builder.build(**parser.toolchain_argdict)
 
+    if hasattr(soc, "hbm_stats"):
+        soc.hbm_stats.export_csv(os.path.join(builder.output_dir, "hbm_stats.csv"))
+
     if args.driver:
         generate_litepcie_software(soc, os.path.join(builder.output_dir, "driver"))
 
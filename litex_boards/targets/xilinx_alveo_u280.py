@@ -18,6 +18,7 @@ from litex.soc.interconnect.axi import axi_lite
 
 from migen import *
 from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.fhdl.simplify import FullMemoryWE
 
 from litex.gen import LiteXModule
 
@@ -29,9 +30,11 @@ from litex.soc.integration.soc import SoCRegion
 from litex.soc.integration.builder import *
 from litex.soc.interconnect.axi import *
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import wishbone
 from litex.soc.cores.ram.xilinx_usp_hbm2 import USPHBM2
 
 from litex.soc.cores.led import LedChaser
+from litex.soc.cores.xadc import USPSystemMonitor
 from litedram.modules import MTA18ASF2G72PZ
 from litedram.phy import usddrphy
 
@@ -45,14 +48,15 @@ from litescope import LiteScopeAnalyzer
 
 from litedram.frontend.bist import  LiteDRAMBISTGenerator, LiteDRAMBISTChecker
 
-from litex_boards.targets.HBMPortAccess import HBMReadAndWriteSM, HBMCSRSCommon #, HBMBISTStarter, HBMBIST
+from litex_boards.targets.HBMPortAccess import HBM_PORT_STATE_BITS, add_hbm_benchmark, get_usphbm2_telemetry, get_dram_bist_stats
+from litex_boards.targets.HBMPortAccess import HBMWishbone2AXI, HBMInterleaver, HBMAXIClockDomainCrossing, HBMDMABridge #, HBMBISTStarter, HBMBIST
 
 from litex.build.sim.config import SimConfig
 
 # CRG ----------------------------------------------------------------------------------------------
 
 class _CRG(LiteXModule):
-    def __init__(self, platform, sys_clk_freq, ddram_channel, with_hbm):
+    def __init__(self, platform, sys_clk_freq, ddram_channel, with_hbm, hbm_axi_clk_freq=None):
         if with_hbm:
             self.cd_sys     = ClockDomain()
             self.cd_hbm_ref = ClockDomain()
@@ -105,6 +109,15 @@ class _CRG(LiteXModule):
 
             self.idelayctrl = USIDELAYCTRL(cd_ref=self.cd_idelay, cd_sys=self.cd_sys)
 
+        # HBM AXI clock, decoupled from sys (cascaded on the 100MHz HBM reference).
+        if hbm_axi_clk_freq is not None:
+            assert hbm_axi_clk_freq <= 450e6
+            self.cd_hbm_axi = ClockDomain()
+            self.hbm_pll = hbm_pll = USMMCM(speedgrade=-2)
+            hbm_pll.register_clkin(self.cd_hbm_ref.clk, 100e6)
+            hbm_pll.create_clkout(self.cd_hbm_axi, hbm_axi_clk_freq)
+            platform.add_false_path_constraints(self.cd_sys.clk, self.cd_hbm_axi.clk)
+
 # BaseSoC ------------------------------------------------------------------------------------------
 
 class BaseSoC(SoCCore):
@@ -113,44 +126,114 @@ class BaseSoC(SoCCore):
 
     def __init__(self, sys_clk_freq=150e6, ddram_channel=0,
         with_pcie       = False,
+        pcie_lanes      = 4,
+        pcie_hbm_ports  = None,
         with_led_chaser = False,
         with_hbm        = False,
+        with_ddr4_bist  = False,
+        with_hbm_telemetry = False,
+        hbm_max_outstanding = 8,
+        hbm_histogram_buckets = 64,
+        hbm_trace_depth = 1024,
+        hbm_sample_depth = 512,
+        hbm_axi_clk_freq = None,
+        hbm_main_ram_channels = None,
+        hbm_main_ram_interleave = 256,
+        hbm_main_ram_line_beats = 4,
+        with_analyzer   = False,
+        analyzer_groups = ["fsm"],
+        analyzer_ports  = [0],
+        analyzer_depth  = 512,
+        analyzer_packed_fsm = False,
         **kwargs):
         platform = xilinx_alveo_u280.Platform()
-        if with_hbm:
+        if with_hbm and hbm_axi_clk_freq is None:
             assert 225e6 <= sys_clk_freq <= 450e6
+        # HBM AXI ports and traffic engines run in hbm_axi when decoupled from sys.
+        hbm_cd = "sys" if hbm_axi_clk_freq is None else "hbm_axi"
+        # HBM ports streamed to/from by the PCIe DMAs instead of the benchmark.
+        pcie_hbm_ports = list(pcie_hbm_ports or []) if with_pcie else []
 
 
 
 
 
         # CRG --------------------------------------------------------------------------------------
-        self.crg = _CRG(platform, sys_clk_freq, ddram_channel, with_hbm)
+        self.crg = _CRG(platform, sys_clk_freq, ddram_channel, with_hbm, hbm_axi_clk_freq)
 
         # SoCCore ----------------------------------------------------------------------------------
         SoCCore.__init__(self, platform, sys_clk_freq, ident="LiteX SoC on Alveo U280 (ES1)", **kwargs)
 
+        # SYSMON -----------------------------------------------------------------------------------
+        # The card is passively cooled (OVERTEMPSHUTDOWN is enabled by the platform): with the
+        # HBM telemetry, die temperature and supplies are recorded along with the HBM bandwidth.
+        telemetry = []
+        if with_hbm_telemetry:
+            self.sysmon = USPSystemMonitor()
+            telemetry += [
+                ("temperature", self.sysmon.temperature.status),
+                ("vccint",      self.sysmon.vccint.status),
+                ("vccaux",      self.sysmon.vccaux.status),
+                ("vccbram",     self.sysmon.vccbram.status),
+            ]
+
         # HBM / DRAM -------------------------------------------------------------------------------
         if with_hbm:
+            assert not with_ddr4_bist, "The DDR4 BIST is only available with the DDR4 controller."
             # JTAGBone -----------------------------------------------------------------------------
             #self.add_jtagbone(chain=2) # Chain 1 already used by HBM2 debug probes.
 
             # Add HBM Core.
-            self.hbm = hbm = ClockDomainsRenamer({"axi": "sys"})(USPHBM2(platform))
+            self.hbm = hbm = ClockDomainsRenamer({"axi": hbm_cd})(USPHBM2(platform))
 
             # Get HBM .xci.
             os.system("wget https://github.com/litex-hub/litex-boards/files/6893157/hbm_0.xci.txt")
             os.makedirs("ip/hbm", exist_ok=True)
             os.system("mv hbm_0.xci.txt ip/hbm/hbm_0.xci")
 
+            # Stripe main_ram over the first pseudo-channels, through the L2 cache and burst bridges.
+            # main_ram is limited to 4 channels (1GB) to stay below the CPU IO region.
+            main_ram_channels = 0 if hbm_main_ram_channels is None else hbm_main_ram_channels
+            if main_ram_channels:
+                assert main_ram_channels in [1, 2, 4]
+                line_width = 256*hbm_main_ram_line_beats
+                l2_size    = kwargs.get("l2_size", 8192)
+                main_ram   = wishbone.Interface(data_width=self.bus.data_width, address_width=32, addressing="word")
+                l2_slave   = wishbone.Interface(data_width=line_width, address_width=32, addressing="word")
+                self.l2_cache = FullMemoryWE()(wishbone.Cache(
+                    cachesize = l2_size//4,
+                    master    = main_ram,
+                    slave     = l2_slave,
+                    reverse   = False))
+                self.add_config("L2_SIZE", l2_size)
+                channels = []
+                for i in range(main_ram_channels):
+                    channel = wishbone.Interface(data_width=line_width, address_width=32, addressing="word")
+                    axi_sys = AXIInterface(data_width=256, address_width=33, id_width=len(hbm.axi[i].aw.id))
+                    self.submodules += HBMWishbone2AXI(channel, axi_sys, base_address=0x1000_0000*i)
+                    self.submodules += HBMAXIClockDomainCrossing(axi_sys, hbm.axi[i], cd_from="sys", cd_to=hbm_cd)
+                    channels.append(channel)
+                self.submodules += HBMInterleaver(l2_slave, channels,
+                    granularity  = hbm_main_ram_interleave,
+                    base_address = 0x4000_0000)
+                main_ram_region = SoCRegion(origin=0x4000_0000, size=0x1000_0000*main_ram_channels) # 256MB per channel.
+                for name, io_region in self.bus.io_regions.items():
+                    assert ((main_ram_region.origin + main_ram_region.size <= io_region.origin) or
+                        (main_ram_region.origin >= io_region.origin + io_region.size)), \
+                        f"main_ram overlaps the {name} IO region."
+                self.bus.add_slave("main_ram", main_ram, main_ram_region)
+
             # Connect four of the HBM's AXI interfaces to the main bus of the SoC.
-            for i in range(4):
+            for i in range(main_ram_channels, 4):
                 axi_hbm      = hbm.axi[i]
                 axi_lite_hbm = AXILiteInterface(data_width=256, address_width=33)
-                self.submodules += AXILite2AXI(axi_lite_hbm, axi_hbm)
+                axi_lite_cdc = AXILiteInterface(data_width=256, address_width=33)
+                self.submodules += AXILiteClockDomainCrossing(axi_lite_hbm, axi_lite_cdc, cd_from="sys", cd_to=hbm_cd)
+                self.submodules += ClockDomainsRenamer(hbm_cd)(AXILite2AXI(axi_lite_cdc, axi_hbm))
                 self.bus.add_slave(f"hbm{i}", axi_lite_hbm, SoCRegion(origin=0x4000_0000 + 0x1000_0000*i, size=0x1000_0000)) # 256MB.
             # Link HBM2 channel 0 as main RAM
-            self.bus.add_region("main_ram", SoCRegion(origin=0x4000_0000, size=0x1000_0000, linker=True)) # 256MB.
+            if not main_ram_channels:
+                self.bus.add_region("main_ram", SoCRegion(origin=0x4000_0000, size=0x1000_0000, linker=True)) # 256MB.
 
             #####################################################################################
             # Added code 
@@ -158,10 +241,16 @@ class BaseSoC(SoCCore):
             # axi_lite_hbm = AXILiteInterface(data_width=256, address_width=33)
             # self.submodules += AXILite2AXI(axi_lite_hbm, hbm.axi[4])
 
-            for i in range(4, 32):
-                setattr(self.submodules, f"hbm_{i}", HBMReadAndWriteSM(hbm.axi[i]))
-                # self.submodules.hbm_4 = HBMReadAndWriteSM(hbm.axi[i])
-                self.add_csr(f"hbm_{i}")
+            assert all(i >= max(4, main_ram_channels) for i in pcie_hbm_ports)
+            add_hbm_benchmark(self, hbm,
+                ports             = [i for i in range(max(4, main_ram_channels), 32) if i not in pcie_hbm_ports],
+                clock_domain      = hbm_cd,
+                clk_freq          = hbm_axi_clk_freq,
+                sample_depth      = hbm_sample_depth,
+                max_outstanding   = hbm_max_outstanding,
+                histogram_buckets = hbm_histogram_buckets,
+                trace_depth       = hbm_trace_depth,
+                telemetry         = telemetry + (get_usphbm2_telemetry(hbm) if with_hbm_telemetry else []))
 
             #####################################################################################
         
@@ -184,8 +273,17 @@ class BaseSoC(SoCCore):
             # Firmware RAM (To ease initial LiteDRAM calibration support) --------------------------
             self.add_ram("firmware_ram", 0x20000000, 0x8000)
 
+            # DDR4 BIST: LiteDRAM generator/checker on crossbar ports, read back with the HBM
+            # statistics so that DDR4 and HBM are benchmarked in the same session.
+            stats_blocks = []
+            if with_ddr4_bist:
+                assert hasattr(self, "sdram"), "The DDR4 BIST needs the DDR4 controller (no integrated main RAM)."
+                self.ddr4_bist_generator = LiteDRAMBISTGenerator(self.sdram.crossbar.get_port())
+                self.ddr4_bist_checker   = LiteDRAMBISTChecker(self.sdram.crossbar.get_port())
+                stats_blocks.append(("ddr4", get_dram_bist_stats(self.ddr4_bist_generator, self.ddr4_bist_checker)))
+
             # Add HBM Core.
-            self.hbm = hbm = ClockDomainsRenamer({"axi": "sys"})(USPHBM2(platform))
+            self.hbm = hbm = ClockDomainsRenamer({"axi": hbm_cd})(USPHBM2(platform))
 
             # Get HBM .xci.
             os.system("wget https://github.com/litex-hub/litex-boards/files/6893157/hbm_0.xci.txt")
@@ -195,12 +293,16 @@ class BaseSoC(SoCCore):
             #####################################################################################
             # Added code 
 
-            self.submodules.commonRegs = HBMCSRSCommon()
-
-            for i in range(0, 32):
-                setattr(self.submodules, f"hbm_{i}", HBMReadAndWriteSM(hbm.axi[i], self.commonRegs, i))
-                # self.submodules.hbm_4 = HBMReadAndWriteSM(hbm.axi[i])
-                self.add_csr(f"hbm_{i}")
+            add_hbm_benchmark(self, hbm,
+                ports             = [i for i in range(32) if i not in pcie_hbm_ports],
+                clock_domain      = hbm_cd,
+                clk_freq          = hbm_axi_clk_freq,
+                sample_depth      = hbm_sample_depth,
+                max_outstanding   = hbm_max_outstanding,
+                histogram_buckets = hbm_histogram_buckets,
+                trace_depth       = hbm_trace_depth,
+                telemetry         = telemetry + (get_usphbm2_telemetry(hbm) if with_hbm_telemetry else []),
+                stats_blocks      = stats_blocks)
 
             # setattr(self.submodules, f"hbm4", HBMReadAndWriteSM(hbm.axi[4]))
             # self.add_csr("hbm4")
@@ -213,149 +315,36 @@ class BaseSoC(SoCCore):
 
             #####################################################################################
 
-        analyzer_signals = [
-            hbm.axi[0].aw,
-            hbm.axi[0].w,
-            hbm.axi[0].b,
-            hbm.axi[0].ar,
-            hbm.axi[0].r,
-            self.hbm_0.prepwritecommand_fsm.status,
-            self.hbm_1.prepwritecommand_fsm.status,
-            self.hbm_2.prepwritecommand_fsm.status,
-            self.hbm_3.prepwritecommand_fsm.status,
-            self.hbm_4.prepwritecommand_fsm.status,
-            self.hbm_5.prepwritecommand_fsm.status,
-            self.hbm_6.prepwritecommand_fsm.status,
-            self.hbm_7.prepwritecommand_fsm.status,
-            self.hbm_8.prepwritecommand_fsm.status,
-            self.hbm_9.prepwritecommand_fsm.status,
-            self.hbm_10.prepwritecommand_fsm.status,
-            self.hbm_11.prepwritecommand_fsm.status,
-            self.hbm_12.prepwritecommand_fsm.status,
-            self.hbm_13.prepwritecommand_fsm.status,
-            self.hbm_14.prepwritecommand_fsm.status,
-            self.hbm_15.prepwritecommand_fsm.status,
-            self.hbm_16.prepwritecommand_fsm.status,
-            self.hbm_17.prepwritecommand_fsm.status,
-            self.hbm_18.prepwritecommand_fsm.status,
-            self.hbm_19.prepwritecommand_fsm.status,
-            self.hbm_20.prepwritecommand_fsm.status,
-            self.hbm_21.prepwritecommand_fsm.status,
-            self.hbm_22.prepwritecommand_fsm.status,
-            self.hbm_23.prepwritecommand_fsm.status,
-            self.hbm_24.prepwritecommand_fsm.status,
-            self.hbm_25.prepwritecommand_fsm.status,
-            self.hbm_26.prepwritecommand_fsm.status,
-            self.hbm_27.prepwritecommand_fsm.status,
-            self.hbm_28.prepwritecommand_fsm.status,
-            self.hbm_29.prepwritecommand_fsm.status,
-            self.hbm_30.prepwritecommand_fsm.status,
-            self.hbm_31.prepwritecommand_fsm.status,
-            self.hbm_0.prepreadcommand_fsm.status,
-            self.hbm_1.prepreadcommand_fsm.status,
-            self.hbm_2.prepreadcommand_fsm.status,
-            self.hbm_3.prepreadcommand_fsm.status,
-            self.hbm_4.prepreadcommand_fsm.status,
-            self.hbm_5.prepreadcommand_fsm.status,
-            self.hbm_6.prepreadcommand_fsm.status,
-            self.hbm_7.prepreadcommand_fsm.status,
-            self.hbm_8.prepreadcommand_fsm.status,
-            self.hbm_9.prepreadcommand_fsm.status,
-            self.hbm_10.prepreadcommand_fsm.status,
-            self.hbm_11.prepreadcommand_fsm.status,
-            self.hbm_12.prepreadcommand_fsm.status,
-            self.hbm_13.prepreadcommand_fsm.status,
-            self.hbm_14.prepreadcommand_fsm.status,
-            self.hbm_15.prepreadcommand_fsm.status,
-            self.hbm_16.prepreadcommand_fsm.status,
-            self.hbm_17.prepreadcommand_fsm.status,
-            self.hbm_18.prepreadcommand_fsm.status,
-            self.hbm_19.prepreadcommand_fsm.status,
-            self.hbm_20.prepreadcommand_fsm.status,
-            self.hbm_21.prepreadcommand_fsm.status,
-            self.hbm_22.prepreadcommand_fsm.status,
-            self.hbm_23.prepreadcommand_fsm.status,
-            self.hbm_24.prepreadcommand_fsm.status,
-            self.hbm_25.prepreadcommand_fsm.status,
-            self.hbm_26.prepreadcommand_fsm.status,
-            self.hbm_27.prepreadcommand_fsm.status,
-            self.hbm_28.prepreadcommand_fsm.status,
-            self.hbm_29.prepreadcommand_fsm.status,
-            self.hbm_30.prepreadcommand_fsm.status,
-            self.hbm_31.prepreadcommand_fsm.status,
-            self.hbm_0.total_writes.status,
-            self.hbm_0.total_reads.status,
-            self.hbm_0.ticks.status,
-            self.hbm_0.delay_state_fsm.status,
-            self.hbm_0.waitinstruction_fsm.status,
-            self.hbm_0.port_settings.storage,
-            self.hbm_0.port_id_const,
-            self.hbm_0.port_num_array,
-            self.hbm_0.exec_done.status,
-            self.commonRegs.start.storage,
-            self.hbm_0.ticks.status,
-
-
-            # self.bus.slaves["hbm0"].adr,
-            # self.bus.slaves["hbm0"].dat_w,
-            # self.bus.slaves["hbm0"].dat_r,
-            # self.bus.slaves["hbm0"].sel,
-            # self.bus.slaves["hbm0"].cyc,
-            # self.bus.slaves["hbm0"].stb,
-            # self.bus.slaves["hbm0"].ack,
-            # self.bus.slaves["hbm0"].we,
-            # self.bus.slaves["hbm0"].cti,
-            # self.bus.slaves["hbm0"].bte,
-            # self.bus.slaves["hbm0"].err,
-
-            # axi_lite_hbm.aw,
-            # axi_lite_hbm.w,
-            # axi_lite_hbm.b,
-            # axi_lite_hbm.ar,
-            # axi_lite_hbm.r,
-            # self.cpu.ibus.stb,
-            # self.cpu.ibus.cyc,
-            # self.cpu.ibus.adr,
-            # self.cpu.ibus.we,
-            # self.cpu.ibus.ack,
-            # self.cpu.ibus.sel,
-            # self.cpu.ibus.dat_w,
-            # self.cpu.ibus.dat_r,
-            # self.cpu.dbus.stb,
-            # self.cpu.dbus.cyc,
-            # self.cpu.dbus.adr,
-            # self.cpu.dbus.we,
-            # self.cpu.dbus.ack,
-            # self.cpu.dbus.sel,
-            # self.cpu.dbus.dat_w,
-            # self.cpu.dbus.dat_r,
-        ]
-
-        from litescope import LiteScopeAnalyzer
-        self.submodules.analyzer = LiteScopeAnalyzer(analyzer_signals,
-            depth = 2048,
-            clock_domain="sys",
-            samplerate=sys_clk_freq,
-            csr_csv="analyzer.csv",
-        )
-
-        # analyzer_signals = [axi_lite_hbm.aw]
-
-        # analyzer_depth = 128
-
-        # analyzer_clock_domain = "sys"
-
-        # self.submodules.analyzer = LiteScopeAnalyzer(analyzer_signals,
-        #                                              analyzer_depth,
-        #                                              clock_domain=analyzer_clock_domain)
-
+        # Analyzer ---------------------------------------------------------------------------------
+        if with_analyzer:
+            self.add_hbm_analyzer(
+                groups       = analyzer_groups,
+                ports        = analyzer_ports,
+                depth        = analyzer_depth,
+                packed_fsm   = analyzer_packed_fsm,
+                clock_domain = hbm_cd,
+                clk_freq     = hbm_axi_clk_freq)
 
         # PCIe -------------------------------------------------------------------------------------
         if with_pcie:
-            self.pcie_phy = USPPCIEPHY(platform, platform.request("pcie_x4"),
-                data_width = 256,
+            assert pcie_lanes in [4, 16]
+            self.pcie_phy = USPPCIEPHY(platform, platform.request(f"pcie_x{pcie_lanes}"),
+                data_width = {4: 256, 16: 512}[pcie_lanes],
                 bar0_size  = 0x20000)
-            self.add_pcie(phy=self.pcie_phy, ndmas=1)
+            self.add_pcie(phy=self.pcie_phy, ndmas=max(1, len(pcie_hbm_ports)))
+
+            # Stream each DMA to/from a ring in its HBM port (the port's pseudo-channel by default).
+            for n, i in enumerate(pcie_hbm_ports):
+                axi_sys = AXIInterface(data_width=256, address_width=33, id_width=len(self.hbm.axi[i].aw.id))
+                bridge  = HBMDMABridge(axi_sys, self.pcie_phy.data_width, base_address=0x1000_0000*i)
+                setattr(self.submodules, f"hbm_dma_{i}", bridge)
+                self.add_csr(f"hbm_dma_{i}")
+                self.submodules += HBMAXIClockDomainCrossing(axi_sys, self.hbm.axi[i], cd_from="sys", cd_to=hbm_cd)
+                dma = getattr(self, f"pcie_dma{n}")
+                self.comb += [
+                    dma.source.connect(bridge.sink),
+                    bridge.source.connect(dma.sink),
+                ]
 
         # Leds -------------------------------------------------------------------------------------
         if with_led_chaser:
@@ -363,6 +352,42 @@ class BaseSoC(SoCCore):
                 pads         = platform.request_all("gpio_led"),
                 sys_clk_freq = sys_clk_freq)
 
+    # HBM Analyzer ---------------------------------------------------------------------------------
+    # Probes are selected by group for each of the given ports:
+    # - "axi":      the AXI channels of the port (large, wide data buses).
+    # - "fsm":      the FSM status bits, or with packed_fsm one status vector per port (the bits
+    #               of HBM_PORT_STATE_BITS packed, several of them can be set at once).
+    # - "counters": the per-command counters and the outstanding bursts.
+    # The probes are sampled in clock_domain (clk_freq), the domain of the HBM engines.
+    def add_hbm_analyzer(self, groups=None, ports=None, depth=512, packed_fsm=False, clock_domain="sys", clk_freq=None):
+        assert hasattr(self, "commonRegs"), "The analyzer probes the HBM benchmark ports."
+        groups = ["fsm"] if groups is None else groups
+        ports  = [0] if ports is None else ports
+        for group in groups:
+            assert group in ["axi", "fsm", "counters"], f"Unknown analyzer group {group}."
+        analyzer_signals = []
+        for i in ports:
+            port = self.hbm_engines[i]
+            if "axi" in groups:
+                axi = self.hbm.axi[i]
+                analyzer_signals += [axi.aw, axi.w, axi.b, axi.ar, axi.r]
+            if "fsm" in groups:
+                if packed_fsm:
+                    analyzer_signals += [port.state]
+                else:
+                    analyzer_signals += [getattr(port, name) for name in HBM_PORT_STATE_BITS]
+            if "counters" in groups:
+                analyzer_signals += [port.total_writes, port.total_reads, port.ticks, port.outstanding]
+        analyzer_signals += [self.commonRegs.start.storage, self.commonRegs.window]
+
+        from litescope import LiteScopeAnalyzer
+        self.submodules.analyzer = LiteScopeAnalyzer(analyzer_signals,
+            depth        = depth,
+            clock_domain = clock_domain,
+            samplerate   = self.sys_clk_freq if clk_freq is None else clk_freq,
+            csr_csv      = "analyzer.csv",
+        )
+
 # Build --------------------------------------------------------------------------------------------
 
 def main():
@@ -372,31 +397,62 @@ def main():
     parser.add_target_argument("--sys-clk-freq",    default=150e6, type=float, help="System clock frequency.") # HBM2 with 250MHz, DDR4 with 150MHz (1:4)
     parser.add_target_argument("--ddram-channel",   default="0",               help="DDRAM channel (0, 1, 2 or 3).") # also selects clk 0 or 1
     parser.add_target_argument("--with-pcie",       action="store_true",       help="Enable PCIe support.")
+    parser.add_target_argument("--pcie-lanes",      default=4, type=int, choices=[4, 16], help="PCIe lanes (x16: 512-bit DMAs, use a 250MHz sys clock for the full rate).")
+    parser.add_target_argument("--pcie-hbm-ports",  default=None,              help="HBM ports streamed to/from by the PCIe DMAs, one DMA each (comma separated).")
     parser.add_target_argument("--driver",          action="store_true",       help="Generate PCIe driver.")
     parser.add_target_argument("--with-hbm",        action="store_true",       help="Use HBM2.")
+    parser.add_target_argument("--with-hbm-telemetry", action="store_true",   help="Record SYSMON and HBM temperatures with the HBM benchmark statistics.")
+    parser.add_target_argument("--with-ddr4-bist",  action="store_true",       help="Add a LiteDRAM BIST on the DDR4 to compare it with the HBM ports (without --with-hbm).")
+    parser.add_target_argument("--hbm-axi-clk-freq", default=None, type=float, help="HBM AXI clock frequency, decoupled from sys (up to 450MHz, default: sys).")
+    parser.add_target_argument("--hbm-main-ram-channels", default=None, type=int, help="Stripe main_ram over this many HBM pseudo-channels (1, 2 or 4, default: channel 0 through AXI-Lite).")
+    parser.add_target_argument("--hbm-main-ram-interleave", default=256, type=int, help="main_ram interleaving granularity in bytes.")
+    parser.add_target_argument("--hbm-main-ram-line-beats", default=4, type=int, help="HBM beats per L2 cache line (AXI burst length of the main_ram bridges).")
+    parser.add_target_argument("--hbm-max-outstanding", default=8, type=int,   help="Maximum number of AXI bursts in flight per HBM port and direction.")
+    parser.add_target_argument("--hbm-trace-depth", default=1024, type=int,   help="Trace replay records per HBM port (0 to disable).")
+    parser.add_target_argument("--hbm-sample-depth", default=512, type=int,  help="Entries of the HBM bandwidth sampler ring buffer.")
+    parser.add_target_argument("--hbm-histogram-buckets", default=64, type=int, help="Number of latency histogram buckets per HBM port and direction.")
     parser.add_target_argument("--with-analyzer",   action="store_true",       help="Enable Analyzer.")
+    parser.add_target_argument("--analyzer-groups", default="fsm",             help="Analyzer probe groups (axi, fsm, counters; comma separated).")
+    parser.add_target_argument("--analyzer-ports",  default="0",               help="HBM ports probed by the Analyzer (comma separated or all).")
+    parser.add_target_argument("--analyzer-depth",  default=512, type=int,     help="Analyzer depth.")
+    parser.add_target_argument("--analyzer-packed-fsm", action="store_true",   help="Capture the FSM status bits of each port as one packed vector.")
     parser.add_target_argument("--with-led-chaser", action="store_true",       help="Enable LED Chaser.")
     # parser.add_target_argument("--with-litex-sim",  action="store_true",       help="Run simulation")
     args = parser.parse_args()
 
     args.csr_csv = "csr.csv"
-    args.csr_address_width = 15
 
     # if args.with_litex_sim:
     #     sim_config = SimConfig()
     #     sim_config.add_clocker("sys_clk", freq_hz=args.sys_clk_freq)
 
 
-    if args.with_hbm:
+    if args.with_hbm and args.hbm_axi_clk_freq is None:
         args.sys_clk_freq = 250e6
 
     soc = BaseSoC(
         sys_clk_freq    = args.sys_clk_freq,
         ddram_channel   = int(args.ddram_channel, 0),
         with_pcie       = args.with_pcie,
+        pcie_lanes      = args.pcie_lanes,
+        pcie_hbm_ports  = None if args.pcie_hbm_ports is None else [int(p) for p in args.pcie_hbm_ports.split(",")],
         with_led_chaser = args.with_led_chaser,
         with_hbm        = args.with_hbm,
+        with_ddr4_bist  = args.with_ddr4_bist,
+        with_hbm_telemetry = args.with_hbm_telemetry,
+        hbm_max_outstanding = args.hbm_max_outstanding,
+        hbm_histogram_buckets = args.hbm_histogram_buckets,
+        hbm_trace_depth = args.hbm_trace_depth,
+        hbm_sample_depth = args.hbm_sample_depth,
+        hbm_axi_clk_freq = args.hbm_axi_clk_freq,
+        hbm_main_ram_channels = args.hbm_main_ram_channels,
+        hbm_main_ram_interleave = args.hbm_main_ram_interleave,
+        hbm_main_ram_line_beats = args.hbm_main_ram_line_beats,
         with_analyzer   = args.with_analyzer,
+        analyzer_groups = args.analyzer_groups.split(","),
+        analyzer_ports  = list(range(32)) if args.analyzer_ports == "all" else [int(p) for p in args.analyzer_ports.split(",")],
+        analyzer_depth  = args.analyzer_depth,
+        analyzer_packed_fsm = args.analyzer_packed_fsm,
         **parser.soc_argdict
 	)
     builder = Builder(soc, **parser.builder_argdict)
@@ -413,6 +469,9 @@ def main():
 
         # soc.analyzer.export_csv(vns, "test/analyzer.csv")
 
+    if hasattr(soc, "hbm_stats"):
+        soc.hbm_stats.export_csv(os.path.join(builder.output_dir, "hbm_stats.csv"))
+
     if args.driver:
         generate_litepcie_software(soc, os.path.join(builder.output_dir, "driver"))
 
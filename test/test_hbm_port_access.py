@@ -0,0 +1,596 @@
+#
+# This file is part of LiteX-Boards.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect.axi import AXIInterface
+from litex.soc.interconnect import wishbone
+
+from litex_boards.targets.HBMPortAccess import *
+
+# AXI HBM Model ------------------------------------------------------------------------------------
+
+class AXIHBMModel:
+    """Behavioural AXI slave standing in for one USPHBM2 port.
+
+    Address requests are accepted immediately and answered after `latency` cycles. Read and
+    write data share the port and move at `bandwidth` beats per cycle (1.0 = one beat every
+    cycle), reads and writes taking turns when both are pending. Responses and read data wait
+    for ready.
+    """
+    def __init__(self, axi, latency=32, bandwidth=1.0):
+        self.axi        = axi
+        self.latency    = latency
+        self.bandwidth  = bandwidth
+        self.beat_bytes = axi.data_width//8
+        self.mem        = {}
+        self.cycle      = 0
+        self.aw_count   = 0
+        self.ar_count   = 0
+        self.aw_addrs   = []
+        self.ar_addrs   = []
+
+    @passive
+    def generator(self):
+        axi     = self.axi
+        credit  = 0.0
+        aw      = []   # [id, addr, len, beat] of the bursts awaiting data.
+        w       = []   # Accepted W beats.
+        b       = []   # (cycle, id) of the pending responses.
+        ar      = []   # (cycle, id, addr, len) of the pending reads.
+        r       = None # Read burst being returned: [id, addr, len, beat].
+        r_turn  = True
+        while True:
+            credit = min(credit + self.bandwidth, 1.0)
+            if r is None and ar and ar[0][0] <= self.cycle:
+                r = list(ar.pop(0)[1:]) + [0]
+            # Give the data cycle to reads or writes, alternating when both are pending.
+            data_ready = credit >= 1.0
+            r_go = data_ready and (r is not None) and (r_turn or not (yield axi.w.valid))
+            w_go = data_ready and not r_go
+            b_valid = bool(b) and b[0][0] <= self.cycle
+            yield axi.aw.ready.eq(1)
+            yield axi.ar.ready.eq(1)
+            yield axi.w.ready.eq(w_go)
+            yield axi.b.valid.eq(b_valid)
+            yield axi.b.id.eq(b[0][1] if b_valid else 0)
+            yield axi.r.valid.eq(r_go)
+            if r_go:
+                yield axi.r.id.eq(r[0])
+                yield axi.r.last.eq(r[3] == r[2])
+                yield axi.r.data.eq(self.mem.get(r[1] + r[3]*self.beat_bytes, 0))
+            yield
+            if (yield axi.aw.valid):
+                aw.append([(yield axi.aw.id), (yield axi.aw.addr), (yield axi.aw.len), 0])
+                self.aw_count += 1
+                self.aw_addrs.append((yield axi.aw.addr))
+            if w_go and (yield axi.w.valid):
+                w.append(((yield axi.w.data), (yield axi.w.last)))
+                credit -= 1.0
+                r_turn  = True
+            while aw and w:
+                data, last = w.pop(0)
+                burst = aw[0]
+                self.mem[burst[1] + burst[3]*self.beat_bytes] = data
+                assert bool(last) == (burst[3] == burst[2])
+                burst[3] += 1
+                if burst[3] > burst[2]:
+                    aw.pop(0)
+                    b.append((self.cycle + self.latency, burst[0]))
+            if b_valid and (yield axi.b.ready):
+                b.pop(0)
+            if (yield axi.ar.valid):
+                ar.append((self.cycle + self.latency, (yield axi.ar.id), (yield axi.ar.addr), (yield axi.ar.len)))
+                self.ar_count += 1
+                self.ar_addrs.append((yield axi.ar.addr))
+            if r_go and (yield axi.r.ready):
+                credit -= 1.0
+                r_turn  = False
+                if r[3] == r[2]:
+                    r = None
+                else:
+                    r[3] += 1
+            self.cycle += 1
+
+# Bench --------------------------------------------------------------------------------------------
+
+class HBMBench(Module):
+    def __init__(self, nports=1, latency=32, bandwidth=1.0, clock_domain="sys", telemetry=[], **kwargs):
+        self.clock_domain = clock_domain
+        self.submodules.common = common = HBMCSRSCommon(clock_domain=clock_domain)
+        for name, value in telemetry:
+            common.add_sample_word(name, value)
+        self.axis   = []
+        self.ports  = []
+        self.models = []
+        for i in range(nports):
+            axi  = AXIInterface(data_width=256, address_width=33, id_width=6)
+            port = HBMReadAndWriteSM(axi, common, i, clock_domain=clock_domain, **kwargs)
+            setattr(self.submodules, f"hbm_{i}", port)
+            self.axis.append(axi)
+            self.ports.append(port)
+            self.models.append(AXIHBMModel(axi, latency=latency, bandwidth=bandwidth))
+        self.submodules.stats = HBMStatsBank(
+            [("common", common.stats)] + [(f"hbm_{i}", p.stats) for i, p in enumerate(self.ports)])
+
+    def configure(self, option, burst_len=16, burst_quantity=64, warmup=100, measure=500):
+        yield self.common.ports_mask.storage.eq(2**len(self.ports) - 1)
+        yield self.common.data_pattern.storage.eq(0x5aa55aa5)
+        yield self.common.warmup_cycles.storage.eq(warmup)
+        yield self.common.measure_cycles.storage.eq(measure)
+        for i, port in enumerate(self.ports):
+            yield port.port_settings.storage.eq(option)
+            yield port.address_readwrite.storage.eq((i*2**28) >> 5)
+            yield port.burst_len.storage.eq(burst_len)
+            yield port.burst_quantity.storage.eq(burst_quantity)
+            yield port.address_gen.address_mode.storage.eq(ADDRESS_LINEAR)
+            yield port.address_gen.window_mask.storage.eq(2**13 - 1)
+
+    def run(self):
+        """Run one measurement window and wait for the ports to go idle."""
+        yield self.common.start.storage.eq(1)
+        yield
+        while not (yield self.common.window_done.status):
+            yield
+        yield self.common.start.storage.eq(0)
+        yield
+        for port in self.ports:
+            while not (yield port.exec_done):
+                yield
+
+    def load_trace(self, port, records, loops=1):
+        """Load (write, address, len, gap) records into the trace BRAM of a port."""
+        trace = self.ports[port].trace
+        yield from trace.load_address.write(0)
+        for record in records:
+            value, shift = 0, 0
+            for (name, width), field in zip(TRACE_RECORD_LAYOUT, [record[1], record[2], record[3], record[0]]):
+                value |= field << shift
+                shift += width
+            yield from trace.load_data.write(value)
+        yield trace.length.storage.eq(len(records))
+        yield trace.loops.storage.eq(loops)
+
+    def run_trace(self):
+        """Replay the traces and wait for the ports to complete them."""
+        yield self.common.start.storage.eq(1)
+        yield
+        for port in self.ports:
+            while not (yield port.trace_done):
+                yield
+        yield self.common.start.storage.eq(0)
+        yield
+        for port in self.ports:
+            while not (yield port.exec_done):
+                yield
+
+    def read_word(self, bus, adr):
+        yield bus.adr.eq(adr)
+        yield bus.cyc.eq(1)
+        yield bus.stb.eq(1)
+        yield
+        while not (yield bus.ack):
+            yield
+        value = (yield bus.dat_r)
+        yield bus.cyc.eq(0)
+        yield bus.stb.eq(0)
+        yield
+        return value
+
+    def read_stat(self, block, name):
+        offset, nwords = [(o, n) for b, s, o, n in self.stats.layout if (b, s) == (block, name)][0]
+        value = 0
+        for i in range(nwords):
+            value |= (yield from self.read_word(self.stats.bus, offset//4 + i)) << (32*i)
+        return value
+
+    def simulate(self, generator, clocks={"sys": 10}):
+        generators = {"sys": [generator]}
+        generators.setdefault(self.clock_domain, [])
+        generators[self.clock_domain] += [model.generator() for model in self.models]
+        run_simulation(self, generators, clocks=clocks)
+
+class HBMMainRAMBench(Module):
+    def __init__(self, nchannels=2, line_width=1024, granularity=256, clock_domain="sys", latency=16):
+        self.clock_domain = clock_domain
+        self.bus    = wishbone.Interface(data_width=line_width, address_width=32, addressing="word")
+        self.models = []
+        slaves      = []
+        for i in range(nchannels):
+            slave   = wishbone.Interface(data_width=line_width, address_width=32, addressing="word")
+            axi_sys = AXIInterface(data_width=256, address_width=33, id_width=6)
+            axi_hbm = AXIInterface(data_width=256, address_width=33, id_width=6)
+            self.submodules += HBMWishbone2AXI(slave, axi_sys, base_address=0x1000_0000*i)
+            self.submodules += HBMAXIClockDomainCrossing(axi_sys, axi_hbm, cd_from="sys", cd_to=clock_domain)
+            self.models.append(AXIHBMModel(axi_hbm, latency=latency))
+            slaves.append(slave)
+        self.submodules.interleaver = HBMInterleaver(self.bus, slaves,
+            granularity  = granularity,
+            base_address = 0x4000_0000)
+
+    def simulate(self, generator, clocks={"sys": 10}):
+        generators = {"sys": [generator]}
+        generators.setdefault(self.clock_domain, [])
+        generators[self.clock_domain] += [model.generator() for model in self.models]
+        run_simulation(self, generators, clocks=clocks)
+
+class HBMDMABench(Module):
+    def __init__(self, data_width=512, clock_domain="sys", latency=16, **kwargs):
+        self.clock_domain = clock_domain
+        axi_sys = AXIInterface(data_width=256, address_width=33, id_width=6)
+        axi_hbm = AXIInterface(data_width=256, address_width=33, id_width=6)
+        self.submodules.bridge = HBMDMABridge(axi_sys, data_width, **kwargs)
+        self.submodules += HBMAXIClockDomainCrossing(axi_sys, axi_hbm, cd_from="sys", cd_to=clock_domain)
+        self.model = AXIHBMModel(axi_hbm, latency=latency)
+
+    def send(self, words):
+        sink = self.bridge.sink
+        for word in words:
+            yield sink.valid.eq(1)
+            yield sink.data.eq(word)
+            yield
+            while not (yield sink.ready):
+                yield
+        yield sink.valid.eq(0)
+
+    def receive(self, n, words):
+        source = self.bridge.source
+        yield source.ready.eq(1)
+        while len(words) < n:
+            if (yield source.valid):
+                words.append((yield source.data))
+            yield
+        yield source.ready.eq(0)
+
+    def simulate(self, generators, clocks={"sys": 10}):
+        generators = {"sys": generators}
+        generators.setdefault(self.clock_domain, [])
+        generators[self.clock_domain].append(self.model.generator())
+        run_simulation(self, generators, clocks=clocks)
+
+# Test HBMPortAccess -------------------------------------------------------------------------------
+
+class TestHBMPortAccess(unittest.TestCase):
+    def measure(self, option, nports=1, latency=32, bandwidth=1.0, burst_len=16, max_outstanding=8):
+        bench   = HBMBench(nports, latency=latency, bandwidth=bandwidth, max_outstanding=max_outstanding)
+        results = []
+        def generator():
+            yield from bench.configure(option, burst_len=burst_len)
+            yield from bench.run()
+            for i, port in enumerate(bench.ports):
+                r = {}
+                for name in ["snapshot_cycles", "snapshot_read_beats", "snapshot_write_beats",
+                    "read_latency_min", "read_latency_max", "read_latency_count",
+                    "write_latency_min", "write_latency_count", "errors"]:
+                    r[name] = (yield from bench.read_stat(f"hbm_{i}", name))
+                results.append(r)
+        bench.simulate(generator())
+        return bench, results
+
+    def test_read_throughput(self):
+        bench, results = self.measure(OPTION_READ)
+        r = results[0]
+        self.assertEqual(r["snapshot_cycles"], 500)
+        self.assertGreaterEqual(r["snapshot_read_beats"]/r["snapshot_cycles"], 0.9)
+        self.assertEqual(r["snapshot_write_beats"], 0)
+
+    def test_write_throughput(self):
+        bench, results = self.measure(OPTION_WRITE)
+        r = results[0]
+        self.assertGreaterEqual(r["snapshot_write_beats"]/r["snapshot_cycles"], 0.9)
+        self.assertEqual(r["snapshot_read_beats"], 0)
+
+    def test_bandwidth_limited(self):
+        bench, results = self.measure(OPTION_READ, bandwidth=0.5)
+        r = results[0]
+        self.assertGreaterEqual(r["snapshot_read_beats"]/r["snapshot_cycles"], 0.45)
+        self.assertLessEqual(r["snapshot_read_beats"]/r["snapshot_cycles"], 0.5)
+
+    def test_read_latency(self):
+        # A single burst in flight: latency is the model latency plus the burst itself.
+        bench, results = self.measure(OPTION_READ, latency=50, burst_len=4, max_outstanding=1)
+        r = results[0]
+        self.assertGreater(r["read_latency_count"], 0)
+        self.assertGreaterEqual(r["read_latency_min"], 50)
+        self.assertLessEqual(r["read_latency_max"], 50 + 4 + 4)
+        # Without outstanding bursts the port is latency bound.
+        self.assertLess(r["snapshot_read_beats"]/r["snapshot_cycles"], 0.1)
+
+    def test_clock_domain_crossing(self):
+        # Ports in a faster hbm_axi domain, CSRs and stats in sys.
+        bench   = HBMBench(2, clock_domain="hbm_axi")
+        results = []
+        def generator():
+            yield from bench.configure(OPTION_READ, warmup=200, measure=1000)
+            yield from bench.run()
+            for i in range(2):
+                results.append(((yield from bench.read_stat(f"hbm_{i}", "snapshot_cycles")),
+                                (yield from bench.read_stat(f"hbm_{i}", "snapshot_read_beats"))))
+            results.append((yield from bench.read_stat("common", "window_done")))
+        bench.simulate(generator(), clocks={"sys": 10, "hbm_axi": 4})
+        for cycles, beats in results[:2]:
+            self.assertEqual(cycles, 1000)
+            self.assertGreaterEqual(beats/cycles, 0.9)
+        self.assertEqual(results[2], 1)
+
+    def test_multi_port(self):
+        bench, results = self.measure(OPTION_WRITE, nports=4, bandwidth=0.5)
+        for r in results:
+            self.assertEqual(r["snapshot_cycles"], 500)
+            self.assertGreaterEqual(r["snapshot_write_beats"]/r["snapshot_cycles"], 0.45)
+            self.assertGreater(r["write_latency_count"], 0)
+
+    def test_read_check(self):
+        bench  = HBMBench(1)
+        errors = []
+        def generator():
+            yield from bench.configure(OPTION_WRITE)
+            yield from bench.run()
+            port = bench.ports[0]
+            yield port.port_settings.storage.eq(OPTION_READ)
+            yield port.checker.check_enable.storage.eq(1)
+            yield from bench.run()
+            errors.append((yield from bench.read_stat("hbm_0", "errors")))
+            # Read back with another pattern: every beat mismatches.
+            yield bench.common.data_pattern.storage.eq(0)
+            yield from bench.run()
+            errors.append((yield from bench.read_stat("hbm_0", "errors")))
+        bench.simulate(generator())
+        self.assertEqual(errors[0], 0)
+        self.assertGreater(errors[1], 0)
+
+    def test_data_modes(self):
+        bench  = HBMBench(1)
+        modes  = [DATA_PRBS7, DATA_PRBS31, DATA_WALKING_ONES, DATA_ADDRESS]
+        errors = {}
+        mems   = {}
+        def generator():
+            port = bench.ports[0]
+            for mode in modes:
+                yield from bench.configure(OPTION_WRITE, burst_quantity=8, measure=100)
+                yield bench.common.data_mode.storage.eq(mode)
+                bench.models[0].mem.clear()
+                yield from bench.run()
+                mems[mode] = dict(bench.models[0].mem)
+                yield port.port_settings.storage.eq(OPTION_READ)
+                yield port.checker.check_enable.storage.eq(1)
+                yield from bench.run()
+                errors[mode] = (yield from bench.read_stat("hbm_0", "errors"))
+                yield port.checker.check_enable.storage.eq(0)
+        bench.simulate(generator())
+        self.assertEqual(errors, {mode: 0 for mode in modes})
+        for mode in modes:
+            self.assertGreaterEqual(len(mems[mode]), 16*8)
+        # PRBS: every lane follows its polynomial within a burst, about half of the bits toggle.
+        for prbs, (n, m) in [(DATA_PRBS7, (7, 6)), (DATA_PRBS31, (31, 28))]:
+            beats = [mems[prbs][adr] for adr in sorted(mems[prbs])]
+            for i in range(8):
+                bits = [(data >> (32*i + j)) & 1 for data in beats[:16] for j in range(32)]
+                self.assertTrue(all(bits[k] == bits[k - n] ^ bits[k - m] for k in range(n, len(bits))))
+            toggles = [bin(a ^ b).count("1") for a, b in zip(beats, beats[1:])]
+            self.assertTrue(96 < sum(toggles)/len(toggles) < 160)
+        for adr, data in mems[DATA_WALKING_ONES].items():
+            self.assertEqual(data, 1 << ((adr//32) % 256))
+        for adr, data in mems[DATA_ADDRESS].items():
+            self.assertEqual([(data >> 32*i) & 0xffffffff for i in range(8)], [adr + 4*i for i in range(8)])
+
+    def test_mixed(self):
+        bench = HBMBench(1)
+        def generator():
+            yield from bench.configure(OPTION_MIXED, burst_len=4)
+            yield bench.ports[0].mix_sequence.storage.eq(0b1000)
+            yield bench.ports[0].mix_length.storage.eq(4)
+            yield from bench.run()
+        bench.simulate(generator())
+        model = bench.models[0]
+        self.assertGreater(model.aw_count, 0)
+        self.assertEqual(model.ar_count, 3*model.aw_count)
+
+    def test_main_ram_interleaving(self):
+        # 128-byte lines striped over two channels 256 bytes at a time, AXI side in hbm_axi.
+        bench = HBMMainRAMBench(clock_domain="hbm_axi")
+        lines = {adr: (0x0123456789abcdef*(adr + 1)) << (64*(adr % 15)) for adr in range(16)}
+        read  = {}
+        def generator():
+            for adr, data in lines.items():
+                yield from bench.bus.write(0x4000_0000//128 + adr, data)
+            for adr in lines:
+                read[adr] = (yield from bench.bus.read(0x4000_0000//128 + adr))
+        bench.simulate(generator(), clocks={"sys": 10, "hbm_axi": 4})
+        self.assertEqual(read, lines)
+        for i, model in enumerate(bench.models):
+            # One 4-beat burst per line and direction, half of the lines on each channel.
+            self.assertEqual(model.aw_count, 8)
+            self.assertEqual(model.ar_count, 8)
+            # Lines 0-1, 4-5, ... land on 0x000-0x0ff, 0x100-0x1ff, ... of each pseudo-channel.
+            base = 0x1000_0000*i
+            self.assertEqual(model.aw_addrs, [base + 128*line for line in range(8)])
+            self.assertEqual(model.ar_addrs, [base + 128*line for line in range(8)])
+            self.assertEqual(sorted(model.mem)[:8], list(range(base, base + 0x100, 32)))
+            self.assertEqual(max(model.mem), base + 0x400 - 32)
+
+    def test_trace_replay(self):
+        # 4 writes then 4 reads of the same locations with gaps, replayed twice.
+        bench   = HBMBench(1)
+        records = [(1, 4*i, 3, 0) for i in range(4)] + [(0, 4*i, 3, 3) for i in range(4)]
+        stats   = {}
+        def generator():
+            yield from bench.configure(OPTION_TRACE)
+            yield bench.ports[0].checker.check_enable.storage.eq(1)
+            yield from bench.load_trace(0, records, loops=2)
+            yield from bench.run_trace()
+            for name in ["trace_records", "trace_loops_done", "trace_done", "trace_cycles", "errors"]:
+                stats[name] = (yield from bench.read_stat("hbm_0", name))
+        bench.simulate(generator())
+        model = bench.models[0]
+        self.assertEqual(model.aw_count, 8)
+        self.assertEqual(model.ar_count, 8)
+        self.assertEqual(sorted(model.mem), [32*i for i in range(16)])
+        self.assertEqual(stats["trace_records"], 16)
+        self.assertEqual(stats["trace_loops_done"], 2)
+        self.assertEqual(stats["trace_done"], 1)
+        self.assertEqual(stats["errors"], 0)
+        # Every read is followed by 3 idle cycles.
+        self.assertGreaterEqual(stats["trace_cycles"], 2*4*4)
+
+    def test_trace_load_hbm_axi(self):
+        # Trace loaded from sys while the engine runs in a faster hbm_axi domain.
+        bench   = HBMBench(1, clock_domain="hbm_axi")
+        records = [(1, 4*i, 3, i) for i in range(8)] + [(0, 4*i, 3, 0) for i in range(8)]
+        stats   = {}
+        mem     = []
+        def generator():
+            yield from bench.configure(OPTION_TRACE)
+            yield bench.ports[0].checker.check_enable.storage.eq(1)
+            yield from bench.load_trace(0, records)
+            # Let the last load_data write reach the BRAM.
+            for _ in range(4):
+                yield
+            trace = bench.ports[0].trace
+            for i in range(len(records)):
+                mem.append((yield trace.mem[i]))
+            yield from bench.run_trace()
+            for name in ["trace_records", "trace_done", "errors"]:
+                stats[name] = (yield from bench.read_stat("hbm_0", name))
+        bench.simulate(generator(), clocks={"sys": 10, "hbm_axi": 4})
+        expected = []
+        for write, address, length, gap in records:
+            value, shift = 0, 0
+            for (name, width), field in zip(TRACE_RECORD_LAYOUT, [address, length, gap, write]):
+                value |= field << shift
+                shift += width
+            expected.append(value)
+        self.assertEqual(mem, expected)
+        self.assertEqual(bench.models[0].aw_count, 8)
+        self.assertEqual(bench.models[0].ar_count, 8)
+        self.assertEqual(stats["trace_records"], 16)
+        self.assertEqual(stats["trace_done"], 1)
+        self.assertEqual(stats["errors"], 0)
+
+    def test_trace_line_rate(self):
+        bench   = HBMBench(1)
+        records = [(0, 16*i, 15, 0) for i in range(16)]
+        stats   = {}
+        def generator():
+            yield from bench.configure(OPTION_TRACE)
+            yield from bench.load_trace(0, records, loops=8)
+            yield from bench.run_trace()
+            for name in ["trace_cycles", "total_reads"]:
+                stats[name] = (yield from bench.read_stat("hbm_0", name))
+        bench.simulate(generator())
+        self.assertEqual(stats["total_reads"], 8*16*16)
+        self.assertGreaterEqual(stats["total_reads"]/stats["trace_cycles"], 0.9)
+
+    def test_shaping(self):
+        # Offered load set by the token bucket, one 16-beat burst at a time above it.
+        for load in [0.25, 0.6]:
+            bench   = HBMBench(1)
+            results = []
+            def generator():
+                yield from bench.configure(OPTION_READ, measure=2000)
+                shaper = bench.ports[0].shaper
+                yield shaper.enable.storage.eq(1)
+                yield shaper.rate.storage.eq(int(load*32*256))
+                yield shaper.bucket_size.storage.eq(16*32)
+                yield from bench.run()
+                results.append((yield from bench.read_stat("hbm_0", "snapshot_read_beats")))
+                results.append((yield from bench.read_stat("hbm_0", "snapshot_cycles")))
+            bench.simulate(generator())
+            beats, cycles = results
+            self.assertAlmostEqual(beats/cycles, load, delta=0.03)
+
+    def test_sampler(self):
+        # Read on port 0, write on port 1, sampled every 50 cycles of the hbm_axi domain.
+        bench   = HBMBench(2, clock_domain="hbm_axi")
+        samples = []
+        stats   = {}
+        def generator():
+            yield from bench.configure(OPTION_READ, warmup=100, measure=1000)
+            yield bench.ports[1].port_settings.storage.eq(OPTION_WRITE)
+            yield bench.common.sample_period.storage.eq(50)
+            yield from bench.run()
+            stats["count"] = (yield bench.common.sample_count.status)
+            for i in range(stats["count"]):
+                sample = []
+                for port in range(2):
+                    adr = i*bench.common.sample_ports + port
+                    sample.append((yield from bench.read_word(bench.common.sample_bus, adr)))
+                samples.append(sample)
+            stats["overflow"] = (yield bench.common.sample_overflow.status)
+        bench.simulate(generator(), clocks={"sys": 10, "hbm_axi": 4})
+        self.assertGreaterEqual(stats["count"], 1100//50 - 1)
+        self.assertEqual(stats["overflow"], 0)
+        # Read beats in the low half-word of port 0, write beats in the high half-word of port 1.
+        self.assertTrue(all(port0 >> 16 == 0 and port1 & 0xffff == 0 for port0, port1 in samples))
+        for port0, port1 in samples[2:-2]:
+            self.assertGreaterEqual(port0 & 0xffff, 45)
+            self.assertLessEqual(port0 & 0xffff, 50)
+            self.assertGreaterEqual(port1 >> 16, 45)
+
+    def test_telemetry(self):
+        # A temperature ramp recorded with the beats of a write port, sampled every 50 cycles.
+        temperature = Signal(12)
+        bench   = HBMBench(1, clock_domain="hbm_axi", telemetry=[("temperature", temperature)])
+        common  = bench.common
+        samples = []
+        stats   = {}
+        def generator():
+            yield from bench.configure(OPTION_WRITE, warmup=100, measure=1000)
+            yield common.sample_period.storage.eq(50)
+            yield temperature.eq(2000)
+            yield common.start.storage.eq(1)
+            yield
+            for i in range(40):
+                yield temperature.eq(2000 + i)
+                for _ in range(10):
+                    yield
+            while not (yield common.window_done.status):
+                yield
+            yield common.start.storage.eq(0)
+            yield
+            stats["count"] = (yield common.sample_count.status)
+            for i in range(stats["count"]):
+                adr = i*common.sample_slots
+                samples.append(((yield from bench.read_word(common.sample_bus, adr)),
+                    (yield from bench.read_word(common.sample_bus, adr + common.sample_ports))))
+            stats["snapshot"] = (yield from bench.read_stat("common", "telemetry_temperature"))
+        bench.simulate(generator(), clocks={"sys": 10, "hbm_axi": 4})
+        self.assertEqual(common.sample_slots, 64)
+        # The BRAM only holds the port words and the telemetry word.
+        self.assertEqual(common.sample_mem.width, 32*33)
+        self.assertGreaterEqual(stats["count"], 1100//50 - 1)
+        # Beats and telemetry share the entries: the temperature follows the ramp.
+        temperatures = [t for _, t in samples]
+        self.assertTrue(all(2000 <= t < 2040 for t in temperatures))
+        self.assertEqual(temperatures, sorted(temperatures))
+        self.assertGreater(temperatures[-1], temperatures[0])
+        self.assertTrue(all(beats >> 16 > 0 for beats, _ in samples[2:-2]))
+        self.assertEqual(stats["snapshot"], 2039)
+
+    def test_dma_bridge(self):
+        # 512-bit DMA words through a 4-burst HBM ring used as a FIFO, wrapping twice.
+        bench    = HBMDMABench(clock_domain="hbm_axi", base_address=0x1000_0000)
+        words    = [(0x0123456789abcdef*(i + 1)) << (8*(i % 32)) for i in range(64)]
+        received = []
+        stats    = {}
+        def control():
+            bridge = bench.bridge
+            yield bridge.size.storage.eq(4*16*32)
+            yield bridge.enable.storage.eq(1)
+            yield
+            yield from bench.send(words)
+            while len(received) < len(words):
+                yield
+            for name in ["write_beats", "read_beats", "errors", "level"]:
+                stats[name] = (yield getattr(bridge, name).status)
+        bench.simulate([control(), bench.receive(len(words), received)], clocks={"sys": 10, "hbm_axi": 4})
+        self.assertEqual(received, words)
+        self.assertEqual(stats, {"write_beats": 128, "read_beats": 128, "errors": 0, "level": 0})
+        # 8 bursts of 16 beats over the 4 bursts of the ring.
+        self.assertEqual(bench.model.aw_count, 8)
+        self.assertEqual(bench.model.ar_count, 8)
+        self.assertEqual(sorted(bench.model.mem), [0x1000_0000 + 32*i for i in range(64)])
@@ -31,6 +31,8 @@ class TestTargets(unittest.TestCase):
     ]
     excluded_targets   = [
         "simple",                            # Reason: Generic target.
+        "HBMPortAccess",                     # Reason: Not a target (HBM benchmark cores).
+        "hbm_bist_test",                     # Reason: Not a target (HBM benchmark host runner).
         "quicklogic_quickfeather",           # Reason: No default clock.
         "efinix_titanium_ti60_f225_dev_kit", # Reason: Require Efinity toolchain.
         "efinix_trion_t120_bga576_dev_kit",  # Reason: Require Efinity toolchain.
@@ -86,3 +88,23 @@ python3 -m litex_boards.targets.{} \
     --no-compile            \
 """.format(name)
                 subprocess.check_call(cmd, shell=True)
+
+    # Elaborate the HBM benchmark options of the Alveo U280.
+    def test_alveo_u280_hbm(self):
+        configs = [
+            "--with-hbm-telemetry --with-ddr4-bist",
+            "--with-hbm --with-hbm-telemetry --hbm-main-ram-channels=2",
+            "--with-hbm --hbm-axi-clk-freq=400e6 --with-analyzer --analyzer-groups=fsm,counters",
+        ]
+        for config in configs:
+            with self.subTest(config=config):
+                os.system("rm -rf build")
+                cmd = """\
+python3 -m litex_boards.targets.xilinx_alveo_u280 \
+    --cpu-type=vexriscv     \
+    --cpu-variant=minimal   \
+    --build                 \
+    --no-compile            \
+    {}
+""".format(config)
+                subprocess.check_call(cmd, shell=True)